@@ -1,11 +1,36 @@
+import atexit
+import configparser
+import copy
+import json
 import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener
 
 _log_format = f"%(asctime)s - [%(levelname)s] - %(name)s - (%(filename)s).%(funcName)s(%(lineno)d) - %(message)s"
 
+# Зарегистрированные логгеры: имя -> список файлов логов
+_loggers = {}
+# Обработчики файлов логов при асинхронной записи: файл -> FileHandler
+_file_handlers = {}
+_queue = None
+_listener = None
+# Формат записей лога: text или json
+_format = 'text'
+# Фильтр прореживания записей, если задан в настройках
+_sampling = None
+
+
+def get_formatter():
+    return JsonFormatter() if _format == 'json' else logging.Formatter(_log_format)
+
 def get_file_handler(file):
     file_handler = logging.FileHandler(file)
     file_handler.setLevel(logging.INFO)
-    file_handler.setFormatter(logging.Formatter(_log_format))
+    file_handler.setFormatter(get_formatter())
     return file_handler
 
 def get_stream_handler():
@@ -17,7 +42,335 @@ def get_stream_handler():
 def get_logger(name, file):
     logger = logging.getLogger(name)
     logger.setLevel(logging.INFO)
-    logger.addHandler(get_file_handler(file))
+    _loggers.setdefault(name, []).append(file)
+    if _sampling is not None and _sampling not in logger.filters:
+        logger.addFilter(_sampling)
+    if _listener is not None:
+        logger.addHandler(_LazyQueueHandler(_queue, file))
+    else:
+        logger.addHandler(get_file_handler(file))
     # logger.addHandler(get_stream_handler())
 
-    return logger
\ No newline at end of file
+    return logger
+
+
+class _LazyQueueHandler(QueueHandler):
+    """
+    Обработчик, который передаёт записи лога в очередь. Аргументы подставляются
+    в сообщение при постановке в очередь, как в QueueHandler, чтобы в лог попали
+    их значения на момент вызова, а не после последующих изменений.
+    Строка лога (формат text или json) формируется потоком QueueListener при записи в файл
+    """
+
+    def __init__(self, log_queue, file):
+        super().__init__(log_queue)
+        self.file = file
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        record.log_file = self.file
+        return record
+
+    def enqueue(self, record):
+        self.queue.put_nowait(record)
+
+
+class _FileRouter(logging.Handler):
+    """
+    Обработчик потока QueueListener: записывает запись в файл лога,
+    указанный при её постановке в очередь
+    """
+
+    def handle(self, record):
+        handler = _file_handlers.get(record.log_file)
+        if handler is None:
+            handler = _file_handlers[record.log_file] = get_file_handler(record.log_file)
+        if record.levelno >= handler.level:
+            handler.handle(record)
+        return True
+
+
+def event(logger, name, msg, *args, level=logging.INFO, **fields):
+    """
+    Запись в лог события с именем и дополнительными полями (номер строки, номер СИ,
+    длительность и т.п.). В формате json поля записываются отдельными ключами,
+    в текстовом формате записывается только сообщение.
+
+    :param logger: объект логгера
+    :param name: имя события
+    :param msg: сообщение, с подстановкой аргументов args через %s
+    :param args: аргументы сообщения
+    :param level: уровень записи
+    :param fields: дополнительные поля события
+    :return:
+    """
+    if logger.isEnabledFor(level):
+        logger.log(level, msg, *args, extra={'event': name, 'fields': fields}, stacklevel=2)
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Форматирование записи лога в одну строку JSON: время, уровень, логгер,
+    имя события, сообщение и дополнительные поля события
+    """
+
+    def format(self, record):
+        data = {'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+                'level': record.levelname,
+                'logger': record.name,
+                'event': getattr(record, 'event', None),
+                'message': record.getMessage(),
+                'func': record.funcName,
+                'line': record.lineno}
+        data.update(getattr(record, 'fields', {}))
+        if record.exc_info:
+            data['exception'] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Фильтр для прореживания частых записей лога уровня ниже WARNING.
+    Записи группируются по имени события, а если его нет - по шаблону сообщения:
+        sample - из каждых sample записей группы пропускается одна;
+        rate_limit - не более rate_limit записей группы в секунду (0 - без ограничения).
+    Количество отброшенных записей по группам записывается в лог при завершении работы.
+    """
+
+    def __init__(self, sample: int = 1, rate_limit: int = 0, events: dict = None):
+        """
+        Конструктор класса
+
+        :param sample: прореживание по умолчанию
+        :param rate_limit: ограничение количества записей в секунду по умолчанию
+        :param events: словарь имя события -> прореживание для отдельных событий
+        """
+        super().__init__()
+        self.sample = max(1, sample)
+        self.rate_limit = rate_limit
+        self.events = events or {}
+        self.counts = {}
+        self.windows = {}
+        self.dropped = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        name = getattr(record, 'event', None)
+        key = (record.name, name or str(record.msg))
+        sample = max(1, self.events.get(name, self.sample)) if name else self.sample
+        with self._lock:
+            count = self.counts.get(key, 0)
+            self.counts[key] = count + 1
+            passed = count % sample == 0
+            if passed and self.rate_limit > 0:
+                second = int(time.monotonic())
+                window_second, window_count = self.windows.get(key, (second, 0))
+                if window_second != second:
+                    window_second, window_count = second, 0
+                passed = window_count < self.rate_limit
+                self.windows[key] = (window_second, window_count + 1 if passed else window_count)
+            if not passed:
+                self.dropped[key] = self.dropped.get(key, 0) + 1
+        return passed
+
+    def pop_dropped(self):
+        """
+        Количество отброшенных записей по группам, счётчики обнуляются
+
+        :return: словарь (имя логгера, событие или шаблон сообщения) -> количество
+        """
+        with self._lock:
+            dropped, self.dropped = self.dropped, {}
+        return dropped
+
+
+def _replace_handlers(make_handler):
+    """
+    Замена обработчиков файлов логов у всех зарегистрированных логгеров
+
+    :param make_handler: функция, которая по имени файла возвращает новый обработчик
+    :return:
+    """
+    for name, files in _loggers.items():
+        logger = logging.getLogger(name)
+        for handler in list(logger.handlers):
+            if isinstance(handler, (logging.FileHandler, _LazyQueueHandler)):
+                logger.removeHandler(handler)
+                if isinstance(handler, logging.FileHandler):
+                    handler.close()
+        for file in files:
+            logger.addHandler(make_handler(file))
+
+
+def start_queue():
+    """
+    Включение асинхронной записи логов: логгеры передают записи в очередь,
+    в файлы их пишет отдельный поток QueueListener
+
+    :return:
+    """
+    global _queue, _listener
+    if _listener is not None:
+        return
+    _queue = queue.SimpleQueue()
+    _listener = QueueListener(_queue, _FileRouter())
+    _replace_handlers(lambda file: _LazyQueueHandler(_queue, file))
+    _listener.start()
+
+
+def stop_queue():
+    """
+    Выключение асинхронной записи логов: оставшиеся в очереди записи
+    записываются в файлы, логгеры снова пишут в файлы напрямую
+
+    :return:
+    """
+    global _queue, _listener
+    _sampling_summary()
+    if _listener is None:
+        return
+    _listener.stop()
+    _listener = None
+    _replace_handlers(get_file_handler)
+    for handler in _file_handlers.values():
+        handler.close()
+    _file_handlers.clear()
+
+
+def _after_fork_in_child():
+    """
+    В дочернем процессе нет потока QueueListener, поэтому логгеры
+    снова пишут в файлы напрямую
+
+    :return:
+    """
+    global _queue, _listener
+    if _listener is not None:
+        _listener = None
+        _replace_handlers(get_file_handler)
+        _file_handlers.clear()
+
+
+# Ключи секции [LOG], которые не являются именами логгеров
+_SETTINGS_KEYS = ('queue', 'level', 'format', 'sample', 'rate_limit')
+
+
+def set_levels(levels: dict):
+    """
+    Установка уровней логирования по логгерам
+
+    :param levels: словарь имя логгера -> уровень (например, 'WARNING'),
+                   имена сравниваются без учёта регистра
+    :return:
+    """
+    names = {name.lower(): name for name in _loggers}
+    for name, level in levels.items():
+        try:
+            logging.getLogger(names.get(name.lower(), name)).setLevel(level.upper())
+        except ValueError:
+            logging.getLogger(__name__).warning("Неизвестный уровень логирования %s для логгера %s", level, name)
+
+
+def read_settings(namefile):
+    """
+    Чтение секции [LOG] файла настроек
+
+    :param namefile: имя файла настроек
+    :return: словарь настроек секции [LOG], пустой, если файла или секции нет
+    """
+    if not os.path.isfile(namefile):
+        return {}
+    parser = configparser.ConfigParser()
+    parser.read(namefile)
+    if not parser.has_section('LOG'):
+        return {}
+    return {name: parser.get('LOG', name, raw=True) for name in parser['LOG']}
+
+
+def configure(settings: dict):
+    """
+    Настройка логирования по словарю настроек секции [LOG]. Словарь можно передать
+    в процессы пула, чтобы они писали логи с теми же настройками, что и основной процесс:
+        queue - yes/no, асинхронная запись логов через очередь;
+        level - уровень логирования для всех логгеров;
+        format - text или json (одна строка JSON на запись);
+        sample - из каждых sample одинаковых записей уровня ниже WARNING записывается одна;
+        sample.<имя события> - прореживание для отдельного события;
+        rate_limit - не более rate_limit одинаковых записей в секунду;
+        <имя логгера> - уровень логирования для отдельного логгера, например: localdb = WARNING
+
+    :param settings: словарь настроек секции [LOG] (read_settings)
+    :return:
+    """
+    if not settings:
+        return
+    parser = configparser.ConfigParser(interpolation=None)
+    parser.read_dict({'LOG': settings})
+    section = parser['LOG']
+    levels = {}
+    if 'level' in section:
+        levels = {name: section['level'] for name in _loggers}
+    levels.update({name: value for name, value in section.items()
+                   if name not in _SETTINGS_KEYS and not name.startswith('sample.')})
+    set_levels(levels)
+    set_format(section.get('format', 'text'))
+    sample = section.getint('sample', fallback=1)
+    rate_limit = section.getint('rate_limit', fallback=0)
+    events = {name[len('sample.'):]: section.getint(name) for name in section if name.startswith('sample.')}
+    if sample > 1 or rate_limit > 0 or events:
+        set_sampling(SamplingFilter(sample, rate_limit, events))
+    if section.getboolean('queue', fallback=False):
+        start_queue()
+
+
+def set_format(log_format: str):
+    """
+    Установка формата записей лога для всех логгеров
+
+    :param log_format: text - текстовый формат, json - одна строка JSON на запись
+    :return:
+    """
+    global _format
+    _format = 'json' if log_format.lower() == 'json' else 'text'
+    handlers = list(_file_handlers.values())
+    for name in _loggers:
+        handlers.extend(logging.getLogger(name).handlers)
+    for handler in handlers:
+        handler.setFormatter(get_formatter())
+
+
+def set_sampling(sampling_filter):
+    """
+    Установка фильтра прореживания записей для всех логгеров
+
+    :param sampling_filter: объект SamplingFilter или None, чтобы убрать фильтр
+    :return:
+    """
+    global _sampling
+    for name in _loggers:
+        logger = logging.getLogger(name)
+        if _sampling is not None:
+            logger.removeFilter(_sampling)
+        if sampling_filter is not None:
+            logger.addFilter(sampling_filter)
+    _sampling = sampling_filter
+
+
+def _sampling_summary():
+    """
+    Запись в лог сводки по отброшенным фильтром прореживания записям
+
+    :return:
+    """
+    if _sampling is not None:
+        for (name, key), count in sorted(_sampling.pop_dropped().items()):
+            logging.getLogger(name).warning("При прореживании отброшено записей %s: %s", key, count)
+
+
+atexit.register(stop_queue)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
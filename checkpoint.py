@@ -0,0 +1,244 @@
+#!/usr/bin/python3
+"""
+Модуль для сохранения промежуточного состояния обработки файла Excel
+(контрольной точки) и продолжения работы с этого места после сбоя.
+
+В контрольной точке хранятся:
+    - параметры запуска, по которым она создана;
+    - последняя обработанная строка по каждому виду СИ;
+    - накопленные и ещё не сохранённые в файл изменения ячеек (CellUpdates);
+    - записи для локальной БД, которые не удалось записать;
+    - статистика обработки;
+    - результаты завершённых заданий параллельной обработки.
+
+Файл контрольной точки - последовательность записей pickle: первая запись - полное
+состояние, каждая следующая - изменения после предыдущего сохранения. При чтении
+записи применяются по порядку, повреждённая последняя запись (сбой во время
+дозаписи) отбрасывается.
+"""
+
+# Блок импорта
+import os
+import pickle
+import app_logger
+import xlsx
+from datetime import datetime
+
+# Конец блока импорта
+
+logger = app_logger.get_logger(__name__, 'checkpoint_log.log')
+
+# Версия формата файла контрольной точки
+VERSION = 2
+
+
+class Checkpoint:
+    """
+    Класс контрольной точки обработки файла
+    """
+
+    def __init__(self, namefile: str, run_params: dict, interval: int = 500):
+        """
+        Конструктор класса
+
+        :param namefile: имя файла контрольной точки
+        :param run_params: словарь с параметрами запуска (имя файла Excel, режим, год, виды СИ),
+                           контрольная точка подходит только для тех же параметров
+        :param interval: количество обработанных строк между сохранениями (0 - только явные сохранения)
+        """
+        self.namefile = namefile
+        self.run_params = run_params
+        self.interval = interval
+        self.last_rows = {}
+        self.updates = xlsx.CellUpdates()
+        self.pending_records = []
+        self.stats = {}
+        self.tasks = {}
+        self._rows_since_save = 0
+        # Ключи заданий, завершённых после последнего сохранения
+        self._new_tasks = []
+        # True - при следующем сохранении файл перезаписывается полным состоянием
+        self._compact = True
+
+    def load(self):
+        """
+        Метод для чтения контрольной точки из файла
+
+        :return: True, если контрольная точка прочитана и подходит для текущего запуска
+        """
+        if not os.path.isfile(self.namefile):
+            logger.info(f"Файл контрольной точки {self.namefile} не найден, начинаем обработку сначала")
+            return False
+        try:
+            with open(self.namefile, 'rb') as file:
+                state = pickle.load(file)
+                if state.get('version') != VERSION or state.get('run_params') != self.run_params:
+                    logger.warning(f"Контрольная точка {self.namefile} создана для других параметров запуска "
+                                   f"{state.get('run_params')}, текущие параметры - {self.run_params}. "
+                                   f"Начинаем обработку сначала")
+                    return False
+                self.last_rows = state['last_rows']
+                self.updates = state['updates']
+                self.pending_records = state['pending_records']
+                self.stats = state['stats']
+                self.tasks = state['tasks']
+                count_deltas = 0
+                while file.peek(1):
+                    try:
+                        delta = pickle.load(file)
+                    except Exception as err:
+                        logger.warning(f"Последняя запись контрольной точки {self.namefile} повреждена "
+                                       f"и не учитывается. Ошибка: {err}")
+                        break
+                    self.__apply(delta)
+                    state['saved'] = delta['saved']
+                    count_deltas += 1
+        except Exception as err:
+            logger.warning(f"Не удалось прочитать файл контрольной точки {self.namefile}. Ошибка: {err}")
+            return False
+
+        # Следующее сохранение перезапишет файл полным состоянием
+        self._compact = True
+        logger.info(f"Прочитана контрольная точка от {state['saved']}: последние строки {self.last_rows}, "
+                    f"изменений ячеек - {len(self.updates)}, записей для БД - {len(self.pending_records)}, "
+                    f"завершённых заданий - {len(self.tasks)}, записей изменений - {count_deltas}")
+        return True
+
+    def __apply(self, delta: dict):
+        """
+        Метод для применения записи изменений, прочитанной из файла контрольной точки
+
+        :param delta: словарь с изменениями после предыдущего сохранения
+        :return:
+        """
+        self.last_rows = delta['last_rows']
+        self.updates.merge(delta['updates'])
+        self.pending_records = delta['pending_records']
+        self.stats = delta['stats']
+        self.tasks.update(delta['tasks'])
+
+    def save(self, updates=None, stats=None, pending_records=None):
+        """
+        Метод для записи контрольной точки в файл. В конец файла дописываются только
+        изменения после предыдущего сохранения: ячейки, изменённые в буфере updates,
+        и новые завершённые задания. Полное состояние записывается через временный файл,
+        поэтому при сбое во время записи предыдущая контрольная точка не портится:
+        при первом сохранении за запуск, после чтения контрольной точки,
+        после очистки буфера изменений и после ошибки записи.
+
+        :param updates: объект CellUpdates с несохранёнными изменениями ячеек
+        :param stats: словарь статистики обработки
+        :param pending_records: список записей для локальной БД, которые не удалось записать
+        :return: True or False
+        """
+        if updates is not None:
+            self.updates = updates
+        if stats is not None:
+            self.stats = stats
+        if pending_records is not None:
+            self.pending_records = pending_records
+        changed = self.updates.pop_changed()
+        try:
+            if self._compact or changed is None:
+                self.__write_full()
+            else:
+                delta = {'saved': datetime.now(),
+                         'last_rows': self.last_rows,
+                         'updates': changed,
+                         'pending_records': self.pending_records,
+                         'stats': self.stats,
+                         'tasks': {key: self.tasks[key] for key in self._new_tasks}}
+                with open(self.namefile, 'ab') as file:
+                    pickle.dump(delta, file, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception as err:
+            # Изменения после последнего сохранения не записаны, поэтому в следующий раз - полная запись
+            self._compact = True
+            logger.warning(f"Не удалось сохранить контрольную точку {self.namefile}. Ошибка: {err}")
+            return False
+        self._rows_since_save = 0
+        self._new_tasks = []
+        logger.info(f"Контрольная точка сохранена: последние строки {self.last_rows}")
+        return True
+
+    def __write_full(self):
+        """
+        Метод для записи полного состояния в новый файл контрольной точки
+
+        :return:
+        """
+        state = {'version': VERSION,
+                 'saved': datetime.now(),
+                 'run_params': self.run_params,
+                 'last_rows': self.last_rows,
+                 'updates': self.updates,
+                 'pending_records': self.pending_records,
+                 'stats': self.stats,
+                 'tasks': self.tasks}
+        tmp_namefile = self.namefile + '.tmp'
+        with open(tmp_namefile, 'wb') as file:
+            pickle.dump(state, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_namefile, self.namefile)
+        self._compact = False
+
+    def is_done(self, kind: str, row: int):
+        """
+        Метод для проверки, обработана ли строка по виду СИ до контрольной точки
+
+        :param kind: вид СИ
+        :param row: номер строки
+        :return: True or False
+        """
+        return row <= self.last_rows.get(kind, 0)
+
+    def mark(self, kind: str, row: int):
+        """
+        Метод для отметки обработанной строки по виду СИ
+
+        :param kind: вид СИ
+        :param row: номер строки
+        :return: True, если пора сохранить контрольную точку
+        """
+        self.last_rows[kind] = row
+        self._rows_since_save += 1
+        return 0 < self.interval <= self._rows_since_save
+
+    def has_unsaved(self):
+        """
+        Метод для проверки, есть ли обработанные строки или задания после последнего сохранения
+
+        :return: True or False
+        """
+        return self._rows_since_save > 0
+
+    def add_task(self, key: tuple, updates, stats: dict, pending_records: list, rows: int = 1):
+        """
+        Метод для сохранения результатов завершённого задания параллельной обработки.
+        Контрольная точка записывается в файл, когда с последнего сохранения
+        обработано не меньше interval строк
+
+        :param key: ключ задания
+        :param updates: объект CellUpdates задания
+        :param stats: словарь статистики задания
+        :param pending_records: список записей для БД задания, которые не удалось записать
+        :param rows: количество строк файла в задании
+        :return: True, если контрольная точка сохранена
+        """
+        self.tasks[key] = (updates, stats, pending_records)
+        self._new_tasks.append(key)
+        self._rows_since_save += rows
+        if 0 < self.interval <= self._rows_since_save:
+            return self.save()
+        return False
+
+    def remove(self):
+        """
+        Метод для удаления файла контрольной точки после успешного завершения работы
+
+        :return:
+        """
+        try:
+            if os.path.isfile(self.namefile):
+                os.remove(self.namefile)
+                logger.info(f"Файл контрольной точки {self.namefile} удалён")
+        except Exception as err:
+            logger.warning(f"Не удалось удалить файл контрольной точки {self.namefile}. Ошибка: {err}")
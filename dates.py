@@ -0,0 +1,113 @@
+#!/usr/bin/python3
+"""
+Модуль для пакетного разбора дат из файла Excel и карточек ФГИС.
+
+Даты хранятся как порядковые номера дня (date.toordinal()), 0 - даты нет.
+Строки дат разбираются один раз: результат запоминается для каждой строки,
+поэтому одинаковые даты в столбце файла или в карточках не разбираются повторно.
+Значения-исключения (прочерки, "н/д" и т.п.) проверяются по множеству.
+"""
+
+# Блок импорта
+from array import array
+from datetime import datetime, date
+import app_logger
+
+# Конец блока импорта
+
+logger = app_logger.get_logger(__name__, 'dates_log.log')
+
+# Значения ячеек, которые означают отсутствие даты
+EXC_STR = frozenset(['',
+                     '-',
+                     '--',
+                     '---',
+                     'не пригоден',
+                     'н/д',
+                     'нет данных',
+                     'отсутствует',
+                     None])
+
+DATE_FORMAT = "%d.%m.%Y"
+
+
+class DateConverter:
+    """
+    Класс для приведения значений к порядковому номеру дня
+    с запоминанием результата разбора строк
+    """
+
+    def __init__(self):
+        self.__parsed = {}
+        self.__years = {0: 0}
+
+    def to_ordinal(self, value):
+        """
+        Метод для приведения значения к порядковому номеру дня
+
+        :param value: дата (date или datetime), строка формата dd.mm.YYYY или значение-исключение
+        :return: порядковый номер дня, 0 - если даты нет или разобрать её не удалось
+        """
+        if isinstance(value, date):
+            return value.toordinal()
+        try:
+            return self.__parsed[value]
+        except KeyError:
+            pass
+        except TypeError:
+            # Нехешируемое значение: датой оно быть не может
+            return 0
+        ordinal = 0
+        if value not in EXC_STR:
+            try:
+                ordinal = datetime.strptime(value, DATE_FORMAT).toordinal()
+            except (TypeError, ValueError) as err:
+                logger.warning(f"Невозможно привести значение <{value}> к дате. Ошибка <{err}>")
+        self.__parsed[value] = ordinal
+        return ordinal
+
+    def column(self, values):
+        """
+        Метод для приведения столбца значений к порядковым номерам дня
+
+        :param values: итерируемый объект со значениями
+        :return: array('l') с порядковыми номерами дня
+        """
+        to_ordinal = self.to_ordinal
+        return array('l', [to_ordinal(value) for value in values])
+
+    def year(self, ordinal: int):
+        """
+        Метод для получения года по порядковому номеру дня
+
+        :param ordinal: порядковый номер дня
+        :return: год, 0 - если даты нет
+        """
+        year = self.__years.get(ordinal)
+        if year is None:
+            year = self.__years[ordinal] = date.fromordinal(ordinal).year
+        return year
+
+    def years(self, ordinals):
+        """
+        Метод для получения столбца годов по столбцу порядковых номеров дня
+
+        :param ordinals: итерируемый объект с порядковыми номерами дня
+        :return: array('l') с годами, 0 - если даты нет
+        """
+        year = self.year
+        return array('l', [year(ordinal) for ordinal in ordinals])
+
+
+# Общий для процесса объект разбора дат
+CONVERTER = DateConverter()
+
+
+def to_ordinal(value):
+    """
+    Приведение значения к порядковому номеру дня общим объектом разбора дат
+
+    :param value: дата, строка формата dd.mm.YYYY или значение-исключение
+    :return: порядковый номер дня, 0 - если даты нет
+    """
+    return CONVERTER.to_ordinal(value)
@@ -9,6 +9,7 @@ import requests
 from http.client import HTTPConnection
 import app_logger
 import argparse
+import metrics
 
 HTTPConnection._http_vsn_str = "HTTP/1.0"
 
@@ -39,45 +40,76 @@ def request_fgis(dict_params: dict):
 
     :return:
     """
+    return query_fgis(dict_params)[0]
+
+
+def query_fgis(dict_params: dict):
+    """
+    Запрос в БД ФГИС с результатом выполнения запроса
+
+    :param dict_params: словарь с параметрами запроса
+    :return: кортеж (список записей, результат запроса): found - данные получены,
+             empty - по запросу ничего нет, too_many - слишком много результатов,
+             aborted - превышено количество попыток, timeout - таймаут соединения
+    """
     url_for_request = format_url(dict_params)
-    logger.info(f"Попытка запроса <{url_for_request}>")
+    logger.info("Попытка запроса <%s>", url_for_request)
     result_items = []
+    outcome = 'aborted'
     count_req = 0
     count_err = 0
+    start = time.perf_counter()
     while True:
         if count_req > 15:
             logger.warning(
                 f"Получение данных по запросу <{url_for_request}> прервано из-за превышения допустимого количества попыток")
+            metrics.inc('fgis_results', outcome='aborted')
             break
         if count_err > 15:
             logger.warning(f"Подключение прервано из-за таймаунта соединения.")
+            metrics.inc('fgis_results', outcome='timeout')
+            outcome = 'timeout'
             break
+        if count_req + count_err > 0:
+            metrics.inc('fgis_retries')
         try:
-            response = requests.get(url_for_request, cookies=cookies, headers=headers)
+            with metrics.timer('fgis_http'):
+                response = requests.get(url_for_request, cookies=cookies, headers=headers)
         except requests.exceptions.ConnectTimeout:
+            metrics.inc('fgis_requests', status='timeout')
             count_err += 1
             continue
+        metrics.inc('fgis_requests', status=response.status_code)
         if response.status_code == 200:
-            logger.info(f"Запрос <{url_for_request}> успешно выполнен")
+            logger.info("Запрос <%s> успешно выполнен", url_for_request)
             response_json = response.json()
             # Получаем количество элементов в ответе
             count_items = response_json.get('result').get('count')
             if count_items <= int(dict_params['rows']) and count_items > 0:
                 result_items = parse_response(response_json)
-                logger.info(f"Результаты запроса <{url_for_request}> обработаны. Завершаем цикл обработки.")
+                logger.info("Результаты запроса <%s> обработаны. Завершаем цикл обработки.", url_for_request)
+                outcome = 'found'
             elif count_items == 0:
-                logger.info(f"По запросу <{url_for_request}> данных не получено")
+                logger.info("По запросу <%s> данных не получено", url_for_request)
+                outcome = 'empty'
             else:
                 logger.warning(
                     f"По запросу <{url_for_request}> получено результатов, более {dict_params['rows']}. Прекращаем обработку")
+                outcome = 'too_many'
+            metrics.inc('fgis_results', outcome=outcome)
             break
         else:
             logger.warning(
                 f"По запросу <{url_for_request}> не получено ответа от сервера. Код ответа: {response.status_code}, {response.text}")
             time.sleep(2)
             count_req += 1
+    duration = time.perf_counter() - start
+    metrics.observe('fgis_query', duration)
+    app_logger.event(logger, 'fgis_query', "Запрос <%s> завершён, получено записей - %s", url_for_request,
+                     len(result_items), serial=dict_params.get('filter_minumber'), results=len(result_items),
+                     attempts=count_req + count_err + 1, duration=round(duration, 6), outcome=outcome)
 
-    return result_items
+    return result_items, outcome
 
 
 def parse_response(result_response):
@@ -0,0 +1,247 @@
+#!/usr/bin/python3
+"""
+Модуль для нечёткого сопоставления СИ из файла Excel с карточками локальной БД.
+
+Заводские номера и типы СИ в файле часто отличаются от карточек ФГИС
+ведущими нулями, лишними пробелами, латинскими буквами вместо похожих
+кириллических (T-0,66 и Т-0,66) или разными видами тире. Поэтому значения
+сначала приводятся к нормальному виду, а затем сравниваются по совпадению
+триграмм (последовательностей из трёх символов).
+
+Карточки индексируются по нормализованным заводским номерам, поиск по индексу
+возвращает список кандидатов с оценкой сходства от 0 до 1.
+"""
+
+# Блок импорта
+import re
+import threading
+import app_logger
+
+# Конец блока импорта
+
+logger = app_logger.get_logger(__name__, 'fuzzy_match_log.log')
+
+# Заглавные латинские буквы, похожие по написанию на кириллические
+# (строка сначала приводится к верхнему регистру, затем заменяются буквы)
+LOOKALIKE = str.maketrans('ABCEHKMOPTXY', 'АВСЕНКМОРТХУ')
+# Разные виды тире и дефиса
+DASHES = str.maketrans({'‐': '-', '‑': '-', '‒': '-', '–': '-', '—': '-', '−': '-'})
+SPACES = re.compile(r"\s+")
+
+
+def normalize_text(value):
+    """
+    Функция для приведения строки к нормальному виду: без пробелов,
+    с единым видом тире, в верхнем регистре, с кириллическими буквами
+    вместо похожих латинских
+
+    :param value: исходное значение
+    :return: строка, '' - если значение пустое
+    """
+    if value is None:
+        return ''
+    return SPACES.sub('', str(value)).upper().translate(DASHES).translate(LOOKALIKE)
+
+
+def normalize_serial(value):
+    """
+    Функция для приведения заводского номера к нормальному виду:
+    как normalize_text, дополнительно убираются ведущие нули.
+    В локальной БД так же нормализуется столбец serial_key (функция normalize_serial_key)
+
+    :param value: заводской номер
+    :return: строка
+    """
+    serial = normalize_text(value)
+    return serial.lstrip('0') or serial[:1]
+
+
+def normalize_type(value):
+    """
+    Функция для приведения типа СИ к нормальному виду.
+    В локальной БД так же нормализуется столбец type_key (функция normalize_type_key)
+
+    :param value: тип СИ
+    :return: строка
+    """
+    return normalize_text(value)
+
+
+def ngrams(text: str, n: int = 3):
+    """
+    Функция для получения множества n-грамм строки, строка дополняется
+    пробелами с краёв, чтобы учитывались начало и конец строки
+
+    :param text: строка
+    :param n: длина n-граммы
+    :return: множество строк
+    """
+    padded = ' ' * (n - 1) + text + ' '
+    return {padded[ind:ind + n] for ind in range(len(padded) - n + 1)}
+
+
+def similarity(first: str, second: str, n: int = 3):
+    """
+    Функция для оценки сходства двух строк по n-граммам (коэффициент Дайса)
+
+    :param first: первая строка
+    :param second: вторая строка
+    :param n: длина n-граммы
+    :return: число от 0 до 1
+    """
+    if first == second:
+        return 1.0
+    first_grams, second_grams = ngrams(first, n), ngrams(second, n)
+    return 2 * len(first_grams & second_grams) / (len(first_grams) + len(second_grams))
+
+
+class NgramIndex:
+    """
+    Индекс строк по n-граммам: n-грамма -> ключи строк, в которых она встречается
+    """
+
+    def __init__(self, n: int = 3):
+        """
+        Конструктор класса
+
+        :param n: длина n-граммы
+        """
+        self.n = n
+        self.texts = {}
+        self.__postings = {}
+
+    def __len__(self):
+        return len(self.texts)
+
+    def add(self, key, text: str):
+        """
+        Метод для добавления строки в индекс
+
+        :param key: ключ строки
+        :param text: нормализованная строка
+        :return:
+        """
+        grams = ngrams(text, self.n)
+        self.texts[key] = (text, len(grams))
+        for gram in grams:
+            self.__postings.setdefault(gram, []).append(key)
+
+    def search(self, text: str, threshold: float = 0.0, limit: int = None):
+        """
+        Метод для поиска строк, похожих на text
+
+        :param text: нормализованная строка для поиска
+        :param threshold: минимальная оценка сходства
+        :param limit: максимальное количество результатов, None - без ограничения
+        :return: список пар (ключ, оценка), по убыванию оценки
+        """
+        grams = ngrams(text, self.n)
+        counts = {}
+        for gram in grams:
+            for key in self.__postings.get(gram, ()):
+                counts[key] = counts.get(key, 0) + 1
+        result = []
+        for key, count in counts.items():
+            key_text, key_len = self.texts[key]
+            score = 1.0 if key_text == text else 2 * count / (len(grams) + key_len)
+            if score >= threshold:
+                result.append((key, score))
+        result.sort(key=lambda pair: -pair[1])
+        return result if limit is None else result[:limit]
+
+
+def type_similarity(type_si: str, type_card: str):
+    """
+    Функция для оценки сходства нормализованных типов СИ: если тип из файла
+    входит в тип из карточки (как при поиске type_title like '%type_si%'),
+    то сходство полное, иначе - по триграммам
+
+    :param type_si: тип СИ из файла
+    :param type_card: тип СИ из карточки
+    :return: число от 0 до 1
+    """
+    if type_si == '' or type_si in type_card:
+        return 1.0
+    return similarity(type_si, type_card)
+
+
+class CardMatcher:
+    """
+    Класс для нечёткого поиска карточек CardFgis по заводскому номеру и типу СИ.
+    Оценка кандидата складывается из сходства номеров (с весом 2) и типов (с весом 1).
+    """
+
+    def __init__(self, cards=(), threshold: float = 0.8):
+        """
+        Конструктор класса
+
+        :param cards: итерируемый объект с CardFgis
+        :param threshold: минимальная оценка кандидата
+        """
+        self.cards = list(cards)
+        self.threshold = threshold
+        self.__serials = NgramIndex()
+        self.__types = []
+        for pos, card in enumerate(self.cards):
+            self.__serials.add(pos, normalize_serial(card.mi_number))
+            self.__types.append(normalize_type(card.mi_mitype))
+
+    def __len__(self):
+        return len(self.cards)
+
+    def candidates(self, serial, type_si, limit: int = 5, accept=None):
+        """
+        Метод для получения кандидатов для СИ из файла
+
+        :param serial: заводской номер из файла
+        :param type_si: тип СИ из файла или None
+        :param limit: максимальное количество кандидатов
+        :param accept: функция отбора карточек (например, по дате поверки) или None
+        :return: список пар (CardFgis, оценка), по убыванию оценки
+        """
+        norm_serial = normalize_serial(serial)
+        if norm_serial == '':
+            return []
+        norm_type = normalize_type(type_si)
+        result = []
+        # Нижняя граница сходства номеров, при которой кандидат может набрать threshold
+        # даже при полном совпадении типа
+        for pos, serial_score in self.__serials.search(norm_serial, (3 * self.threshold - 1) / 2):
+            score = (2 * serial_score + type_similarity(norm_type, self.__types[pos])) / 3
+            if score >= self.threshold and (accept is None or accept(self.cards[pos])):
+                result.append((self.cards[pos], round(score, 4)))
+        result.sort(key=lambda pair: -pair[1])
+        return result[:limit]
+
+
+class MatcherCache:
+    """
+    Кэш объектов CardMatcher по годам поверки: карточки года загружаются
+    из локальной БД один раз и используются всеми потоками процесса
+    """
+
+    def __init__(self, threshold: float = 0.8):
+        """
+        Конструктор класса
+
+        :param threshold: минимальная оценка кандидата
+        """
+        self.threshold = threshold
+        self.__matchers = {}
+        self.__lock = threading.Lock()
+
+    def get(self, year: int, database):
+        """
+        Метод для получения объекта CardMatcher по году поверки
+
+        :param year: год поверки
+        :param database: объект WorkDb для загрузки карточек, если их ещё нет в кэше
+        :return: объект CardMatcher
+        """
+        with self.__lock:
+            matcher = self.__matchers.get(year)
+            if matcher is None:
+                cards = database.get_cards_on_year(year) if database is not None else None
+                matcher = self.__matchers[year] = CardMatcher(cards or [], self.threshold)
+                logger.info(f"Построен индекс нечёткого поиска за {year} год: карточек - {len(matcher)}")
+        return matcher
@@ -1,19 +1,39 @@
 #!/usr/bin/python3
 """
 Модуль для работы с локальной БД PostgreSQL.
-В модуле два класса:
+В модуле три класса:
     WorkDb - класс для объекта БД postgreSQL,
-    CardFgis - структура данных для карточки ФГИС для экземпляра СИ.
+    CardFgis - структура данных для карточки ФГИС для экземпляра СИ,
+    CardTable - колоночное хранилище карточек ФГИС для сопоставления.
 """
 
 # Блок импорта
 import os.path
+import re
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import compress
 import psycopg2 as psql
 import app_logger
+import metrics
+import dates
+from parse_type_si import match_any
+from fuzzy_match import normalize_serial, normalize_type
 
 logger = app_logger.get_logger(__name__, 'localdb_log.log')
 output_data_metrology = app_logger.get_logger('Data_from_metrology', 'localdb_log.log')
 
+# Результаты проверки гиперссылки из файла Excel:
+# valid - запись с гиперссылкой есть в tbmetrology, идентификатор совпадает со столбцом id файла (или он не заполнен),
+# invalid - записи с гиперссылкой нет,
+# mismatch - запись есть, но её идентификатор не совпадает с идентификатором из файла
+HREF_VALID = 'valid'
+HREF_INVALID = 'invalid'
+HREF_MISMATCH = 'mismatch'
+# Начало параметров запроса или фрагмента в гиперссылке
+HREF_TAIL = re.compile(r"[?#]")
+
 
 class WorkDb:
     MODE_CHECK = {'title': 'tbtitle',
@@ -52,6 +72,9 @@ class WorkDb:
                            'type': 'id_type'}
         self.namefile_sql_scripts = 'query_metrology.sql'
         self.lst_sql_scripts_metrology = self.__get_sql_scripts()
+        self.__type_index = None
+        # Результаты проверок наличия функций и столбцов БД (has_function, has_column)
+        self.__features = {}
 
     def __get_sql_scripts(self):
         """
@@ -71,7 +94,8 @@ class WorkDb:
         """"
         Метод для создания описания таблиц БД
         """
-        lst_names_files = list(os.walk('scripts/create'))[0][2]
+        # Скрипты выполняются по порядку номеров в именах файлов
+        lst_names_files = sorted(list(os.walk('scripts/create'))[0][2])
         for f in lst_names_files:
             name = os.path.join('scripts', 'create', f)
             with open(name, 'r') as script_file:
@@ -111,21 +135,26 @@ class WorkDb:
             logger.warning(f"Не удалось выполнить запрос <{format_sql_query}>")
             return False
 
-    def __write_data(self, sql_query: str):
+    def __write_data(self, sql_query: str, params: tuple = None):
         """
         Метод для записи данных в БД, по сути выполняет sql-запрос, заранее сформированный
 
         :param sql_query: строка запроса для выполнения
+        :param params: параметры запроса, если в запросе есть плейсхолдеры %s
         :return: True or False
         """
         try:
-            logger.info(f"Попытка записи данных по запросу: {sql_query}")
-            self.cursor.execute(sql_query)
+            logger.info("Попытка записи данных по запросу: %s", sql_query)
+            start = time.perf_counter()
+            self.cursor.execute(sql_query, params)
             self.connect.commit()
+            app_logger.event(logger, 'db_write', "Данные по запросу <%s> записаны", sql_query,
+                             duration=round(time.perf_counter() - start, 6))
             return True
         except Exception as err:
+            metrics.inc('db_errors', operation='write')
             self.connect.rollback()
-            logger.warning(f"Не удалось записать данные по запросу: {sql_query}. Ошибка: {err.__str__()}")
+            logger.warning("Не удалось записать данные по запросу: %s. Ошибка: %s", sql_query, err)
             return False
 
     def __update_record_metrology(self, dict_for_write: dict):
@@ -137,14 +166,15 @@ class WorkDb:
         """
         pass
 
+    @metrics.timed('db_query')
     def write_metrology(self, dict_for_write: dict):
         """
         Метод для записи данных в таблицу tbmetrology
 
         :param dict_for_write: словарь с данными для формирования запроса на запись
-        :return:
+        :return: True, если данные записаны, иначе False
         """
-        logger.info(f"Начало работы функции write_metrology для данных {dict_for_write}")
+        logger.info("Начало работы функции write_metrology для данных %s", dict_for_write)
         sql_query = f"call add_record_metrology({dict_for_write['mitnumber']}," \
                     f"                          {dict_for_write['modification']}," \
                     f"                          '{dict_for_write['si_number']}'," \
@@ -160,33 +190,45 @@ class WorkDb:
                     f"                          '{dict_for_write['change_date']}'::date," \
                     f"                          {dict_for_write['change_flag']}," \
                     f"                          {dict_for_write['rows_number']})"
-        logger.info(f"Сформированный для записи данных запрос: {sql_query}")
+        logger.info("Сформированный для записи данных запрос: %s", sql_query)
         try:
             if self.__write_data(sql_query):
-                logger.info(f"Данные в таблицу tbmetrology успешно записаны")
+                logger.info("Данные в таблицу tbmetrology успешно записаны")
+                return True
             else:
-                logger.warning(f"Не удалось записать данные по запросу: {sql_query}")
+                logger.warning("Не удалось записать данные по запросу: %s", sql_query)
         except:
-            logger.warning(f"Запись данных завершилась аварийно по запросу: {sql_query}")
+            logger.warning("Запись данных завершилась аварийно по запросу: %s", sql_query)
+        return False
         # self.__write_data_on_db("tbmetrology", dict_for_write)
         # logger.info(f"Окончание работы функции write_metrology для данных {dict_for_write}")
 
-    def __get_data_from_db(self, sql_query: str):
+    def __get_data_from_db(self, sql_query: str, params: tuple = None):
         """
         Метод для получения данных из БД
 
         :param sql_query: sql-скрипт
+        :param params: параметры запроса, если в запросе есть плейсхолдеры %s
         :return: словарь, где ключи - наименования столбцов,
                           значения - соответствующие значения стобцов
         """
         try:
-            logger.info(f"Попытка получения данных из БД по запросу {sql_query}")
-            self.cursor.execute(sql_query)
+            logger.info("Попытка получения данных из БД по запросу %s", sql_query)
+            start = time.perf_counter()
+            self.cursor.execute(sql_query, params)
             rows = self.cursor.fetchall()
-            logger.info(f"Данные по запросу <{sql_query}> успешно получены")
+            app_logger.event(logger, 'db_read', "Данные по запросу <%s> успешно получены", sql_query,
+                             rows=len(rows), duration=round(time.perf_counter() - start, 6))
             return rows
         except Exception as err:
-            logger.warning(f"Не удалось получить данные по запросу <{sql_query}>, ошибка: {err.__str__()}")
+            metrics.inc('db_errors', operation='read')
+            # После ошибки транзакция прервана, без отката все следующие запросы соединения тоже не выполнятся
+            if self.connect is not None:
+                try:
+                    self.connect.rollback()
+                except psql.Error as rollback_err:
+                    logger.warning("Не удалось откатить транзакцию, ошибка: %s", rollback_err)
+            logger.warning("Не удалось получить данные по запросу <%s>, ошибка: %s", sql_query, err)
 
     @property
     def tables(self):
@@ -208,6 +250,50 @@ class WorkDb:
         else:
             logger.info(f"Объект cursor() = None")
 
+    def has_function(self, name: str):
+        """
+        Метод для проверки наличия в БД функции или процедуры, например,
+        если скрипты из scripts/create ещё не выполнены на существующей БД
+
+        :param name: имя функции
+        :return: True or False
+        """
+        if name not in self.__features:
+            data = self.__get_data_from_db("select exists(select 1 from pg_proc where proname = %s)", (name,))
+            self.__features[name] = self.__check_feature(data, f"функции {name}")
+        return self.__features[name]
+
+    def has_column(self, table: str, column: str):
+        """
+        Метод для проверки наличия столбца в таблице БД, например,
+        если скрипт миграции 24 ещё не выполнен на существующей БД
+
+        :param table: имя таблицы
+        :param column: имя столбца
+        :return: True or False
+        """
+        key = f"{table}.{column}"
+        if key not in self.__features:
+            data = self.__get_data_from_db("select exists(select 1 from information_schema.columns "
+                                           "where table_name = %s and column_name = %s)", (table, column))
+            self.__features[key] = self.__check_feature(data, f"столбца {key}")
+        return self.__features[key]
+
+    def __check_feature(self, data, name: str):
+        """
+        Результат проверки наличия объекта БД, при отсутствии объекта - предупреждение в лог
+        (проверки запоминаются, поэтому предупреждение выводится один раз)
+
+        :param data: результат запроса exists
+        :param name: описание объекта для лога
+        :return: True or False
+        """
+        exists = bool(data and data[0][0])
+        if not exists and data is not None:
+            logger.warning(f"В БД нет {name}: выполните скрипты из scripts/create в порядке, указанном "
+                           f"в 24.migrate_normalized_keys.sql, до этого используются прежние запросы")
+        return exists
+
     @property
     def types(self):
         """
@@ -267,6 +353,22 @@ class WorkDb:
         else:
             logger.warning(f"Не удалось получить объект cursor(), так как соединение с БД не было установлено")
 
+    def close(self):
+        """
+        Метод для закрытия соединения с БД
+
+        :return:
+        """
+        if self.connect is not None:
+            try:
+                self.connect.close()
+                logger.info("Соединение с БД закрыто")
+            except Exception as err:
+                logger.warning(f"Не удалось закрыть соединение с БД <{err}>")
+        self.connect = None
+        self.cursor = None
+
+    @metrics.timed('db_query')
     def check_value(self, value: tuple, mode: str = ""):
         """
         Метод для проверки значения value
@@ -347,6 +449,7 @@ class WorkDb:
                 query = f"insert into {table} ({column}) values ('{value}');"
                 return query
 
+    @metrics.timed('db_query')
     def get_id(self, value, mode=""):
         """
         Метод для получения id с БД по существующему значению value
@@ -372,6 +475,7 @@ class WorkDb:
             except IndexError:
                 logger.warning(f"Получено пустое значение из БД по запросу <{sql_query}>")
 
+    @metrics.timed('db_query')
     def set_id(self, value, mode=""):
         """
         Метод для записи значения value в БД
@@ -398,6 +502,8 @@ class WorkDb:
                 case 'type':
                     if self.__add_type_record(value[0], value[1]):
                         id_record = self.get_id_type(value[0], value[1])
+                        if self.__type_index is not None and id_record is not None:
+                            self.__type_index.add(id_record, normalize_type(value[0]))
                         return id_record
                     else:
                         return None
@@ -452,6 +558,7 @@ class WorkDb:
 
         return sql_query
 
+    @metrics.timed('db_query')
     def get_card_for_si(self, dict_filter):
         """
         Метод для получения данных из БД по текущему СИ
@@ -477,6 +584,7 @@ class WorkDb:
             # current_card = self.__parse_fgis_card(lst_card, dict_filter['type_si'], dict_filter['verif_date'])
             return lst_card
 
+    @metrics.timed('db_query')
     def check_tbmetrology_value(self, value):
         """
         Метод для проверки значения в таблице tbmetrology
@@ -596,6 +704,7 @@ class WorkDb:
             logger.warning(f"Не удалось добавить запись в таблицу tbtitle. Ошибка: {err.__str__()}")
             return False
 
+    @metrics.timed('db_query')
     def get_id_mod(self, modification: str):
         """
         Метод для получения идентификатора записи id_mod из таблицы
@@ -610,6 +719,7 @@ class WorkDb:
         except:
             logger.warning(f"Не удалось получить id_mod из БД по запросу: {sql_query}")
 
+    @metrics.timed('db_query')
     def get_id_org(self, organization: str):
         """
         Метод для получения идентификатора записи id_org из таблицы
@@ -624,6 +734,7 @@ class WorkDb:
         except:
             logger.warning(f"Не удалось получить идентификатор id_org из локальной БД по запросу: {sql_query}")
 
+    @metrics.timed('db_query')
     def get_id_title(self, si_title: str):
         """
         Метод для получения идентификатора записи id_title из таблицы
@@ -638,6 +749,7 @@ class WorkDb:
         except:
             logger.warning(f"Не удалось получить идентификатор id_title из локально БД по запросу: {sql_query}")
 
+    @metrics.timed('db_query')
     def get_id_type(self, type_title: str, type_number: str):
         """
         Метод для получения идентификатора записи id_type из таблицы
@@ -653,6 +765,7 @@ class WorkDb:
         except:
             logger.warning(f"Не удалост получить идентификатор id_type из локальной БД по запросу: {sql_query}")
 
+    @metrics.timed('db_query')
     def get_id_for_href(self, href: str):
         """
         Метод для получения ижентификатора записи из таблицы tbmetrology,
@@ -667,6 +780,51 @@ class WorkDb:
         except:
             logger.warning(f"Не удалось получить идентификатор записи для гиперссылки: {href}")
 
+    @metrics.timed('db_query')
+    def get_vri_ids(self, vri_ids, chunk_size: int = 1000):
+        """
+        Метод для получения идентификаторов записей tbmetrology по списку vri_id.
+        Значения отправляются пачками по chunk_size, чтобы не делать отдельный запрос
+        на каждую строку файла.
+
+        :param vri_ids: итерируемый объект с vri_id
+        :param chunk_size: количество vri_id в одном запросе
+        :return: словарь vri_id -> id_record (ненайденных vri_id в словаре нет),
+                 или None - если получить данные не удалось
+        """
+        lst_vri = sorted({vri_id for vri_id in vri_ids if vri_id is not None})
+        vri_records = {}
+        for ind in range(0, len(lst_vri), chunk_size):
+            chunk = lst_vri[ind:ind + chunk_size]
+            data = self.__get_data_from_db("select get_ids_for_vri_ids(%s)", (chunk,))
+            if data is None:
+                logger.warning(f"Не удалось получить идентификаторы записей по vri_id, пачка №{ind // chunk_size}")
+                return None
+            if data[0][0] is not None:
+                vri_records.update(data[0][0])
+        logger.info(f"Найдено в БД vri_id: {len(vri_records)} из {len(lst_vri)}")
+        return vri_records
+
+    def validate_hrefs(self, rows):
+        """
+        Метод для проверки гиперссылок строк файла Excel одним запросом к БД.
+        Гиперссылки сравниваются не целиком, а по vri_id (vri_from_href)
+
+        :param rows: список кортежей (гиперссылка, идентификатор записи из файла или None)
+        :return: список кортежей (результат проверки HREF_*, id_record записи с гиперссылкой или None)
+                 в порядке rows, или None - если получить данные не удалось
+        """
+        keys = [vri_from_href(href) for href, _ in rows]
+        vri_records = self.get_vri_ids(keys)
+        if vri_records is None:
+            return None
+        result = []
+        for key, (_, id_record) in zip(keys, rows):
+            href_id = vri_records.get(key)
+            result.append((href_status(href_id, id_record), href_id))
+        return result
+
+    @metrics.timed('db_query')
     def get_type_title(self, id_type: int):
         """
         Метод для получения типа СИ и регистрационного номера СИ из локальной БД
@@ -681,21 +839,136 @@ class WorkDb:
         except:
             logger.warning(f"Не удалось получить кортеж type_title по запросу: {sql_query}")
 
+    @property
+    def type_index(self):
+        """
+        Индекс нормализованных типов СИ по частям наименования, строится один раз
+        по столбцу type_key таблицы tbtype. Если столбца нет (не выполнен скрипт 24)
+        или он не заполнен, тип нормализуется функцией normalize_type
+
+        :return: объект TypeIndex, или None - если получить список типов не удалось
+        """
+        if self.__type_index is None:
+            lst_types = self.__get_data_from_db("select id_type, type_title, type_key from tbtype")
+            if lst_types is None:
+                lst_types = [[id_type, type_title, None] for id_type, type_title in self.types or []] or None
+            if lst_types is not None:
+                self.__type_index = TypeIndex([[id_type, normalize_type(type_title) if type_key is None else type_key]
+                                               for id_type, type_title, type_key in lst_types])
+                logger.info(f"Построен индекс типов СИ: типов - {len(self.__type_index)}")
+        return self.__type_index
+
+    @metrics.timed('db_query')
     def get_card_si(self, serial: str, type: str):
         """
         Метод для получения информации по СИ из локальной БД по серийному номеру
-        при единственном совпадении
+        при единственном совпадении. Если построен индекс типов, идентификаторы
+        подходящих типов определяются по нему по нормализованному типу, и карточки
+        выбираются по нормализованному номеру и списку идентификаторов вместо
+        поиска по шаблону like.
 
         :param serial: строка серийного номера
+        :param type: тип СИ из файла
         :return: карточка СИ -> CardFgis, либо список из элементов CardFgis
         """
-        sql_query = f"select get_card_array_on_type('{serial}', '{type}')"
+        # Поиск по списку идентификаторов типов требует скриптов 18 и 24, на БД без них - по шаблону like
+        type_index = None
+        if type is not None and self.has_function('get_card_array_on_type_ids') \
+                and self.has_column('tbmetrology', 'serial_key'):
+            type_index = self.type_index
+        if type_index is not None:
+            type_ids = type_index.resolve(normalize_type(type))
+            if len(type_ids) == 0:
+                logger.info("В индексе типов не найдено типов, содержащих %s", type)
+                return None
+            sql_query, params = "select get_card_array_on_type_ids(%s, %s)", (str(serial), type_ids)
+        else:
+            sql_query, params = f"select get_card_array_on_type('{serial}', '{type}')", None
         try:
-            cards_fgis = self.create_lst_cardfgis(self.__get_data_from_db(sql_query)[0][0])
+            cards_fgis = self.create_lst_cardfgis(self.__get_data_from_db(sql_query, params)[0][0])
             return cards_fgis
         except:
             logger.warning(f"Не удалось получить данные CardFgis по серийному номеру: {serial}")
 
+    @metrics.timed('db_query')
+    def get_card_table(self, serials, chunk_size: int = 1000):
+        """
+        Метод для загрузки из локальной БД всех карточек по списку нормализованных
+        серийных номеров (normalize_serial) в колоночное хранилище CardTable.
+        Номера отправляются пачками по chunk_size, чтобы не делать отдельный запрос
+        на каждую строку файла.
+
+        :param serials: итерируемый объект с нормализованными серийными номерами
+        :param chunk_size: количество номеров в одном запросе
+        :return: объект CardTable, или None - если получить данные не удалось
+        """
+        if not (self.has_function('get_card_array_on_serial_keys') and self.has_column('tbmetrology', 'serial_key')):
+            return None
+        lst_serials = sorted({str(serial) for serial in serials if serial is not None})
+        card_table = CardTable()
+        for ind in range(0, len(lst_serials), chunk_size):
+            chunk = lst_serials[ind:ind + chunk_size]
+            data = self.__get_data_from_db("select get_card_array_on_serial_keys(%s)", (chunk,))
+            if data is None:
+                logger.warning(f"Не удалось загрузить карточки по серийным номерам, пачка №{ind // chunk_size}")
+                return None
+            if data[0][0] is not None:
+                card_table.extend(self.create_lst_cardfgis(data[0][0]))
+        logger.info(f"Загружено карточек в CardTable: {len(card_table)} по {len(lst_serials)} серийным номерам")
+        return card_table
+
+    @metrics.timed('db_query')
+    def get_cards_on_year(self, year: int):
+        """
+        Метод для получения из локальной БД всех карточек с датой поверки в заданном году
+
+        :param year: год поверки
+        :return: список объектов CardFgis, или None - если получить данные не удалось
+        """
+        if not self.has_function('get_card_array_on_year'):
+            return None
+        data = self.__get_data_from_db("select get_card_array_on_year(%s)", (str(year),))
+        if data is None:
+            logger.warning(f"Не удалось загрузить карточки за {year} год")
+            return None
+        if data[0][0] is None:
+            return []
+        return self.create_lst_cardfgis(data[0][0])
+
+    @metrics.timed('db_query')
+    def get_not_found(self, key: str):
+        """
+        Метод для получения записи отрицательного кэша запросов во ФГИС (таблица tbfgis_not_found)
+
+        :param key: ключ запроса во ФГИС
+        :return: кортеж (время последнего запроса в секундах, количество запросов без результата),
+                 или None - если записи нет или получить её не удалось
+        """
+        if not self.has_function('get_fgis_not_found'):
+            return None
+        data = self.__get_data_from_db("select get_fgis_not_found(%s)", (key,))
+        if data is None or data[0][0] is None:
+            return None
+        last_checked, attempts = data[0][0]
+        return float(last_checked), int(attempts)
+
+    @metrics.timed('db_query')
+    def set_not_found(self, key: str, found: bool):
+        """
+        Метод для изменения записи отрицательного кэша запросов во ФГИС:
+        если по запросу ничего не найдено, то увеличивается количество запросов
+        и обновляется время последнего запроса, если найдено - запись удаляется
+
+        :param key: ключ запроса во ФГИС
+        :param found: найдены ли данные по запросу
+        :return: True or False
+        """
+        procedure = 'del_fgis_not_found' if found else 'add_fgis_not_found'
+        if not self.has_function(procedure):
+            return False
+        return self.__write_data(f"call {procedure}(%s)", (key,))
+
+    @metrics.timed('db_query')
     def set_row(self, id_record: int, row_number: int):
         """
         Метод для записи номера строки файла Excel, которой соответствует
@@ -707,6 +980,7 @@ class WorkDb:
         """
         pass
 
+    @metrics.timed('db_query')
     def check_valid_href(self, href_value: str):
         """
         Метод для проверки валидности ссылки из файла Excel,
@@ -766,173 +1040,503 @@ class CardFgis:
         13. change_date - дата изменения записи в БД.
         14. change_flag - флаг изменения данных в БД.
         15. number_rows - номер строки в файле Excel, которой соответствует запись.
+
+    Поля, которые нужны для сопоставления, разбираются один раз при создании объекта:
+        verif_ordinal - дата последней поверки в виде порядкового номера дня (0, если даты нет);
+        vri_number - числовая часть vri_id (0, если разобрать не удалось);
+        key - кортеж ключевых параметров для сравнения карточек в check_equals.
     """
+    FIELDS = ('id_record',
+              'mi_mitnumber',
+              'mi_modification',
+              'mi_number',
+              'valid_date',
+              'result_docnum',
+              'mi_mitype',
+              'mi_mititle',
+              'org_title',
+              'applicability',
+              'vri_id',
+              'verification_date',
+              'href',
+              'change_date',
+              'change_flag',
+              'number_rows')
+
+    __slots__ = FIELDS + ('verif_ordinal', 'vri_number', 'key')
 
     def __init__(self, init_data: tuple):
-        self.IND_PROP = {'id': 0,
-                         'mi_mitnumber': 1,
-                         'mi_modification': 2,
-                         'mi_number': 3,
-                         'valid_date': 4,
-                         'result_docnum': 5,
-                         'mi_mitype': 6,
-                         'mi_mititle': 7,
-                         'org_title': 8,
-                         'applicability': 9,
-                         'vri_id': 10,
-                         'verification_date': 11,
-                         'href': 12,
-                         'change_date': 13,
-                         'change_flag': 14,
-                         'number_rows': 15}
-        self.__card = init_data
+        if len(init_data) < len(CardFgis.FIELDS):
+            init_data = tuple(init_data) + (None,) * (len(CardFgis.FIELDS) - len(init_data))
+        (self.id_record,
+         self.mi_mitnumber,
+         self.mi_modification,
+         self.mi_number,
+         self.valid_date,
+         self.result_docnum,
+         self.mi_mitype,
+         self.mi_mititle,
+         self.org_title,
+         self.applicability,
+         self.vri_id,
+         self.verification_date,
+         self.href,
+         self.change_date,
+         self.change_flag,
+         self.number_rows) = init_data[:len(CardFgis.FIELDS)]
+        self.verif_ordinal = date_to_ordinal(self.verification_date)
+        self.vri_number = vri_to_number(self.vri_id)
+        docnum = self.result_docnum or ''
+        self.key = (self.mi_mitnumber,
+                    self.mi_modification,
+                    docnum[:docnum.rfind('/')],
+                    self.mi_mitype,
+                    self.mi_mititle,
+                    self.org_title,
+                    self.verification_date)
+
+    def __repr__(self):
+        return f"CardFgis(id={self.id_record}, mi_number={self.mi_number}, vri_id={self.vri_id})"
 
-    @property
-    def id_record(self):
-        """
-        Идентификатор записи
-        :return:
+    def check_equals(self, other_card):
         """
-        return self.__card[self.IND_PROP['id']]
+        Метод для сравнения двух карточек, по ключевым параметрам
 
-    @property
-    def mi_mitnumber(self):
-        """
-        Возвращаем регистрационный номер типа СИ
-        :return: регистрационный номер типа СИ
+        :param other_card: объект CardFgis
+        :return: True or False
         """
-        return self.__card[self.IND_PROP['mi_mitnumber']]
+        return self.key == other_card.key
 
-    @property
-    def mi_modification(self):
-        """
-        Модификация типа СИ
-        :return: модификация типа СИ
-        """
-        return self.__card[self.IND_PROP['mi_modification']]
 
-    @property
-    def mi_number(self):
+class CardChoice:
+    """
+    Карточка, выбранная в CardTable из нескольких карточек с одинаковой датой поверки
+    (CardTable.choose), и количество неоднозначностей - число групп карточек, кроме выбранной
+    """
+    __slots__ = ('card', 'ambiguous')
+
+    def __init__(self, card, ambiguous: int):
+        self.card = card
+        self.ambiguous = ambiguous
+
+
+class CardTable:
+    """
+    Колоночное хранилище карточек ФГИС для сопоставления в режиме local.
+    Вместо списков объектов CardFgis ключевые поля хранятся в отдельных
+    столбцах (array), строковые значения - кодами (позициями в списке
+    различных значений). Поиск по строке файла - выборка позиций по коду
+    номера бинарным поиском по отсортированному столбцу и фильтрация позиций
+    по столбцам типа, даты поверки и vri_id. Фильтры проходят по столбцам
+    через compress/map, без обращения к объектам CardFgis. Номера и типы
+    для поиска нормализуются при добавлении карточки (normalize_serial, normalize_type).
+        serial_codes - код нормализованного серийного номера;
+        type_ids - код типа СИ (позиция в списке types);
+        verif_ordinals - дата последней поверки, порядковый номер дня;
+        vri_numbers - числовая часть vri_id;
+        key_codes - код ключевых параметров карточки (CardFgis.key).
+    """
+
+    def __init__(self, cards=()):
+        self.cards = []
+        self.serial_codes = array('l')
+        self.type_ids = array('l')
+        self.verif_ordinals = array('l')
+        self.vri_numbers = array('q')
+        self.key_codes = array('l')
+        self.types = []
+        self.type_keys = []
+        self.__serial_codes = {}
+        self.__type_codes = {}
+        self.__key_codes = {}
+        self.__type_match = {}
+        # Позиции, отсортированные по коду номера, и коды в этом порядке (строятся при первом поиске)
+        self.__order = None
+        self.__sorted_codes = None
+        self.extend(cards)
+
+    def __len__(self):
+        return len(self.cards)
+
+    @staticmethod
+    def __code(codes: dict, value):
+        """
+        Код значения - номер в порядке первого появления
+        """
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(codes)
+        return code
+
+    def add(self, card: CardFgis):
+        """
+        Метод для добавления карточки в хранилище
+
+        :param card: объект CardFgis
+        :return:
         """
-        Заводской номер СИ
-        :return: заводской номер СИ
+        type_title = card.mi_mitype or ''
+        code = self.__type_codes.get(type_title)
+        if code is None:
+            code = len(self.types)
+            self.__type_codes[type_title] = code
+            self.types.append(type_title)
+            self.type_keys.append(normalize_type(type_title))
+        self.cards.append(card)
+        self.serial_codes.append(self.__code(self.__serial_codes, normalize_serial(str(card.mi_number))))
+        self.type_ids.append(code)
+        self.verif_ordinals.append(card.verif_ordinal)
+        self.vri_numbers.append(card.vri_number)
+        self.key_codes.append(self.__code(self.__key_codes, card.key))
+        self.__order = None
+
+    def extend(self, cards):
+        """
+        Метод для добавления нескольких карточек
+
+        :param cards: итерируемый объект с CardFgis
+        :return:
         """
-        return self.__card[self.IND_PROP['mi_number']]
+        for card in cards:
+            self.add(card)
 
-    @property
-    def valid_date(self):
+    def __type_like(self, code: int, type_key: str):
         """
-        Дата следующей поверки
-        :return: дата следующей поверки
+        Проверка вхождения нормализованного типа СИ из файла в нормализованный
+        тип из карточки (аналог type_title like '%type_si%' в get_card_array_on_type)
         """
-        return self.__card[self.IND_PROP['valid_date']]
+        key = (code, type_key, 'like')
+        res = self.__type_match.get(key)
+        if res is None:
+            res = type_key in self.type_keys[code]
+            self.__type_match[key] = res
+        return res
 
-    @property
-    def result_docnum(self):
+    def __type_parse(self, code: int, type_si: str):
         """
-        Серия и номер свидетельства о поверке
-        :return: номер свидетельства о поверке
+        Проверка совпадения типа СИ через match_any, хотя бы одна часть типа
+        из файла должна найтись в типе из карточки. Результат запоминается
+        для пары (код типа, тип из файла).
         """
-        return self.__card[self.IND_PROP['result_docnum']]
+        key = (code, type_si, 'parse')
+        res = self.__type_match.get(key)
+        if res is None:
+            res = match_any(self.types[code], type_si)
+            self.__type_match[key] = res
+        return res
 
-    @property
-    def mi_mitype(self):
+    def __type_mask(self, check, type_value: str):
         """
-        Тип СИ
-        :return: тип СИ
+        Маска кодов типов СИ: bytearray, в позиции кода - результат проверки check(код, type_value)
         """
-        return self.__card[self.IND_PROP['mi_mitype']]
+        return bytearray(check(code, type_value) for code in range(len(self.types)))
 
-    @property
-    def mi_mititle(self):
+    def filter_serial(self, serial_key: str):
         """
-        Наименование СИ
-        :return: наименование СИ
+        Позиции карточек с заданным нормализованным серийным номером
+
+        :param serial_key: нормализованный серийный номер СИ (normalize_serial)
+        :return: список позиций
         """
-        return self.__card[self.IND_PROP['mi_mititle']]
+        code = self.__serial_codes.get(serial_key)
+        if code is None:
+            return []
+        if self.__order is None:
+            self.__order = array('l', sorted(range(len(self.cards)), key=self.serial_codes.__getitem__))
+            self.__sorted_codes = array('l', map(self.serial_codes.__getitem__, self.__order))
+        return self.__order[bisect_left(self.__sorted_codes, code):bisect_right(self.__sorted_codes, code)].tolist()
 
-    @property
-    def org_title(self):
+    def filter_type(self, positions: list, type_key: str):
         """
-        Организация-поверитель
-        :return: наименование организации-поверителя
+        Отбор позиций, нормализованный тип которых содержит type_key
+
+        :param positions: список позиций
+        :param type_key: нормализованный тип СИ из файла (normalize_type)
+        :return: список позиций
         """
-        return self.__card[self.IND_PROP['org_title']]
+        mask = self.__type_mask(self.__type_like, type_key)
+        return list(compress(positions, map(mask.__getitem__, map(self.type_ids.__getitem__, positions))))
 
-    @property
-    def applicability(self):
+    def filter_date(self, positions: list, verif_ordinal: int):
         """
-        Флаг пригодности к измерениям
-        :return: False или True
+        Отбор позиций, у которых дата последней поверки равна verif_ordinal
+
+        :param positions: список позиций
+        :param verif_ordinal: порядковый номер дня
+        :return: список позиций
         """
-        return self.__card[self.IND_PROP['applicability']]
+        return list(compress(positions, map(verif_ordinal.__eq__, map(self.verif_ordinals.__getitem__, positions))))
 
-    @property
-    def vri_id(self):
+    def find(self, serial_key: str, type_key: str):
         """
-        Уникальный идентификатор в БД ФГИС
-        :return: идентификатор
+        Позиции карточек с заданным нормализованным серийным номером,
+        нормализованный тип которых содержит type_key
+
+        :param serial_key: нормализованный серийный номер СИ (normalize_serial)
+        :param type_key: нормализованный тип СИ из файла (normalize_type) или None
+        :return: список позиций
         """
-        return self.__card[self.IND_PROP['vri_id']]
+        positions = self.filter_serial(serial_key)
+        if type_key is None or len(positions) == 0:
+            return positions
+        return self.filter_type(positions, type_key)
 
-    @property
-    def verification_date(self):
+    def filter_same(self, positions: list, type_si: str, verif_ordinal: int):
         """
-        Дата последней поверки
-        :return: дата последней поверки из БД ФГИС
+        Отбор позиций, у которых дата последней поверки равна verif_ordinal
+        и тип совпадает по match_any
+
+        :param positions: список позиций
+        :param type_si: тип СИ из файла
+        :param verif_ordinal: дата последней поверки из файла, порядковый номер дня
+        :return: список позиций
         """
-        return self.__card[self.IND_PROP['verification_date']]
+        positions = self.filter_date(positions, verif_ordinal)
+        if len(positions) == 0:
+            return positions
+        mask = self.__type_mask(self.__type_parse, type_si)
+        return list(compress(positions, map(mask.__getitem__, map(self.type_ids.__getitem__, positions))))
 
-    @property
-    def href(self):
+    def max_vri(self, positions: list):
         """
-        Ссылка на карточку СИ
-        :return: ссылка
+        Позиция карточки с максимальным vri_id (при равенстве - первая)
+
+        :param positions: список позиций
+        :return: позиция или None, если список пуст
         """
-        return self.__card[self.IND_PROP['href']]
+        if not positions:
+            return None
+        return max(positions, key=self.vri_numbers.__getitem__)
 
-    @property
-    def change_date(self):
+    def choose(self, positions: list):
         """
-        Дата изменения записи
-        :return: дата
+        Выбор карточки из нескольких, как в group_same_cards: позиции группируются
+        по ключевым параметрам карточки (столбец key_codes), в каждой группе остаётся
+        карточка с максимальным vri_id, из групп выбирается самая многочисленная
+        (при равенстве - с большим vri_id)
+
+        :param positions: список позиций
+        :return: объект CardChoice, или None - если список пуст
         """
-        return self.__card[self.IND_PROP['change_date']]
+        groups = {}
+        for pos, code in zip(positions, map(self.key_codes.__getitem__, positions)):
+            groups.setdefault(code, []).append(pos)
+        if not groups:
+            return None
+        best = [(len(group), self.max_vri(group)) for group in groups.values()]
+        _, pos = max(best, key=lambda item: (item[0], self.vri_numbers[item[1]]))
+        return CardChoice(self.cards[pos], len(groups) - 1)
 
-    @property
-    def change_flag(self):
+    def get_cards(self, positions: list):
         """
-        Флаг изменения
-        :return:
+        Список объектов CardFgis по позициям
+
+        :param positions: список позиций
+        :return: список CardFgis
         """
-        return self.__card[self.IND_PROP['change_flag']]
+        return [self.cards[pos] for pos in positions]
 
-    @property
-    def number_rows(self):
+
+class TypeIndex:
+    """
+    Инвертированный индекс типов СИ: части наименования типа (разделители
+    пробел, -, /, ., запятая) -> идентификаторы типов из таблицы tbtype.
+
+    По индексу для типа из файла отбираются типы-кандидаты, затем у них
+    проверяется вхождение строки целиком, поэтому результат совпадает
+    с условием type_title like '%type_si%'. Части типа из файла, кроме крайних,
+    совпадают с частями наименования целиком, первая часть - с окончанием,
+    последняя - с началом части наименования.
+    """
+
+    SEPARATORS = re.compile(r"[ \-/.,]")
+
+    def __init__(self, types=()):
         """
-        Номер строки в файле Excel
-        :return: номер строки
+        Конструктор класса
+
+        :param types: список пар [id_type, type_title]
         """
-        return self.__card[self.IND_PROP['number_rows']]
+        self.titles = {}
+        self.__tokens = {}
+        self.__prefixes = None
+        self.__suffixes = None
+        self.__resolved = {}
+        for id_type, type_title in types:
+            self.add(id_type, type_title)
 
-    def check_equals(self, other_card):
+    def __len__(self):
+        return len(self.titles)
+
+    def add(self, id_type: int, type_title: str):
         """
-        Метод для сравнения двух карточек, по ключевым параметрам
+        Метод для добавления типа в индекс
 
-        :param other_card: объект CardFgis
-        :return: True or False
+        :param id_type: идентификатор типа
+        :param type_title: наименование типа
+        :return:
         """
-        if (self.mi_mitnumber == other_card.mi_mitnumber and
-                self.mi_modification == other_card.mi_modification and
-                self.result_docnum[:self.result_docnum.rfind('/')] == other_card.result_docnum[
-                                                                      :other_card.result_docnum.rfind('/')] and
-                self.mi_mitype == other_card.mi_mitype and
-                self.mi_mititle == other_card.mi_mititle and
-                self.org_title == other_card.org_title and
-                self.verification_date == other_card.verification_date):
-            return True
+        if type_title is None:
+            return
+        self.titles[id_type] = type_title
+        for token in TypeIndex.SEPARATORS.split(type_title):
+            if token != '':
+                self.__tokens.setdefault(token, set()).add(id_type)
+        self.__prefixes = None
+        self.__suffixes = None
+        self.__resolved = {}
+
+    def __ids_starting_with(self, part: str):
+        """
+        Идентификаторы типов, у которых есть часть наименования, начинающаяся с part
+        """
+        if self.__prefixes is None:
+            self.__prefixes = sorted(self.__tokens)
+        ids = set()
+        for ind in range(bisect_left(self.__prefixes, part), len(self.__prefixes)):
+            token = self.__prefixes[ind]
+            if not token.startswith(part):
+                break
+            ids |= self.__tokens[token]
+        return ids
+
+    def __ids_ending_with(self, part: str):
+        """
+        Идентификаторы типов, у которых есть часть наименования, заканчивающаяся на part
+        """
+        if self.__suffixes is None:
+            self.__suffixes = sorted(token[::-1] for token in self.__tokens)
+        reverse_part = part[::-1]
+        ids = set()
+        for ind in range(bisect_left(self.__suffixes, reverse_part), len(self.__suffixes)):
+            token = self.__suffixes[ind]
+            if not token.startswith(reverse_part):
+                break
+            ids |= self.__tokens[token[::-1]]
+        return ids
+
+    def __ids_containing(self, part: str):
+        """
+        Идентификаторы типов, у которых есть часть наименования, содержащая part
+        """
+        ids = set()
+        for token, token_ids in self.__tokens.items():
+            if part in token:
+                ids |= token_ids
+        return ids
+
+    def resolve(self, type_si: str):
+        """
+        Метод для получения идентификаторов типов, наименование которых содержит type_si.
+        Результат запоминается для строки типа.
+
+        :param type_si: тип СИ из файла
+        :return: отсортированный список идентификаторов типов
+        """
+        res = self.__resolved.get(type_si)
+        if res is not None:
+            return res
+        parts = TypeIndex.SEPARATORS.split(type_si)
+        lst_sets = []
+        if len(parts) == 1:
+            if parts[0] != '':
+                lst_sets.append(self.__ids_containing(parts[0]))
         else:
-            return False
+            for part in parts[1:-1]:
+                if part != '':
+                    lst_sets.append(self.__tokens.get(part, set()))
+            if parts[0] != '':
+                lst_sets.append(self.__ids_ending_with(parts[0]))
+            if parts[-1] != '':
+                lst_sets.append(self.__ids_starting_with(parts[-1]))
+        if len(lst_sets) > 0:
+            lst_sets.sort(key=len)
+            candidates = set.intersection(*lst_sets)
+        else:
+            candidates = self.titles.keys()
+        res = sorted(id_type for id_type in candidates if type_si in self.titles[id_type])
+        self.__resolved[type_si] = res
+        return res
+
+
+def group_same_cards(cards):
+    """
+    Функция для группировки карточек с одинаковыми ключевыми параметрами
+    (CardFgis.key) за один проход. В каждой группе остаётся карточка
+    с максимальным vri_id, из групп выбирается самая многочисленная
+    (при равенстве - с большим vri_id).
+
+    :param cards: итерируемый объект с CardFgis
+    :return: кортеж (выбранная карточка CardFgis или None, количество неоднозначностей -
+             число групп, кроме выбранной)
+    """
+    groups = {}
+    for card in cards:
+        group = groups.get(card.key)
+        if group is None:
+            groups[card.key] = [card, 1]
+        else:
+            group[1] += 1
+            if card.vri_number > group[0].vri_number:
+                group[0] = card
+    if not groups:
+        return None, 0
+    best_card, _ = max(groups.values(), key=lambda group: (group[1], group[0].vri_number))
+    return best_card, len(groups) - 1
+
+
+def date_to_ordinal(value):
+    """
+    Функция для приведения даты к порядковому номеру дня
+
+    :param value: дата - строка формата dd.mm.YYYY, date или datetime
+    :return: порядковый номер дня (date.toordinal()), 0 - если дату разобрать не удалось
+    """
+    return dates.to_ordinal(value)
+
+
+def vri_from_href(href):
+    """
+    Функция для получения vri_id из гиперссылки на результат поверки
+    (https://fgis.gost.ru/fundmetrology/cm/results/<vri_id>): последняя часть пути
+    без параметров запроса и завершающего "/", поэтому от адреса сайта результат не зависит.
+    В локальной БД так же разбирается гиперссылка функцией href_vri_id
+
+    :param href: строка гиперссылки
+    :return: vri_id, или None - если гиперссылка пустая
+    """
+    if href is None:
+        return None
+    key = HREF_TAIL.split(str(href).strip(), maxsplit=1)[0].rstrip('/').rsplit('/', 1)[-1]
+    return key or None
+
+
+def href_status(href_id, id_record):
+    """
+    Функция для получения результата проверки гиперссылки
+
+    :param href_id: идентификатор записи tbmetrology с гиперссылкой или None, если её нет в БД
+    :param id_record: идентификатор записи из файла Excel или None
+    :return: HREF_VALID, HREF_INVALID или HREF_MISMATCH
+    """
+    if href_id is None:
+        return HREF_INVALID
+    if id_record is not None and href_id != id_record:
+        return HREF_MISMATCH
+    return HREF_VALID
+
+
+def vri_to_number(vri_id):
+    """
+    Функция для получения числовой части идентификатора vri_id
+
+    :param vri_id: строка идентификатора, например 1-123456789
+    :return: число, 0 - если разобрать не удалось
+    """
+    try:
+        return int(vri_id[2:])
+    except (TypeError, ValueError):
+        return 0
 
 
 def main():
@@ -0,0 +1,213 @@
+#!/usr/bin/python3
+"""
+Модуль для запоминания результатов запросов в пределах одного запуска скрипта.
+
+В файле одни и те же СИ встречаются несколько раз (трёхфазные трансформаторы,
+повторяющиеся точки учёта), поэтому запрос во ФГИС или в локальную БД
+с одинаковыми параметрами выполняется один раз, а результат отдаётся всем
+строкам с такими же параметрами. Если запрос по ключу уже выполняется
+в другом потоке, то поток ждёт его результата, а не отправляет запрос повторно.
+
+Запросы во ФГИС, по которым ничего не найдено, запоминаются между запусками
+в локальной БД (отрицательный кэш): такой запрос повторяется не раньше,
+чем через заданное количество дней, и с каждым повтором без результата
+интервал удваивается.
+"""
+
+# Блок импорта
+import threading
+import time
+import app_logger
+import metrics
+
+# Конец блока импорта
+
+logger = app_logger.get_logger(__name__, 'memo_log.log')
+
+# Признак отсутствия ключа в кэше
+_MISSING = object()
+
+
+class Unsaved(Exception):
+    """
+    Результат запроса, который не нужно сохранять в кэше, например,
+    ответ ФГИС при превышении времени ожидания: повторный запрос может дать другой результат
+    """
+
+    def __init__(self, result):
+        super().__init__(result)
+        self.result = result
+
+
+class _Pending:
+    """
+    Запрос по ключу, который выполняется в одном из потоков
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.failed = False
+
+
+class LookupMemo:
+    """
+    Потокобезопасный кэш результатов запросов по ключу.
+    Ключ - кортеж, первый элемент которого - источник данных (fgis, local),
+    далее параметры запроса: номер СИ, тип СИ, год поверки и т.п.
+    """
+
+    def __init__(self):
+        self.__results = {}
+        self.__lock = threading.Lock()
+        # Количество запросов, которые не пришлось выполнять, по источникам
+        self.duplicates = {}
+
+    def __len__(self):
+        return len(self.__results)
+
+    def get(self, key: tuple, func):
+        """
+        Метод для получения результата запроса по ключу: при первом обращении
+        выполняется func(), при следующих - возвращается сохранённый результат.
+        Если func() завершилась ошибкой, то результат не сохраняется и ошибка
+        передаётся вызывающему, ожидающие потоки выполняют запрос сами.
+        Если func() вызвала Unsaved, то результат из исключения возвращается
+        без сохранения, ожидающие потоки также выполняют запрос сами.
+
+        :param key: ключ запроса, кортеж
+        :param func: функция без параметров, которая выполняет запрос
+        :return: результат запроса
+        """
+        while True:
+            with self.__lock:
+                result = self.__results.get(key, _MISSING)
+                if result is _MISSING:
+                    pending = self.__results[key] = _Pending()
+                    break
+                if not isinstance(result, _Pending):
+                    self.__count(key)
+                    return result
+            result.done.wait()
+            if not result.failed:
+                with self.__lock:
+                    self.__count(key)
+                    return self.__results[key]
+
+        try:
+            result = func()
+        except Unsaved as err:
+            logger.info(f"Результат запроса по ключу {key} не сохранён")
+            with self.__lock:
+                del self.__results[key]
+            pending.failed = True
+            pending.done.set()
+            return err.result
+        except BaseException as err:
+            logger.warning(f"Запрос по ключу {key} завершился ошибкой <{err}>, результат не сохранён")
+            with self.__lock:
+                del self.__results[key]
+            pending.failed = True
+            pending.done.set()
+            raise
+        metrics.inc('lookup_memo', source=key[0], result='miss')
+        with self.__lock:
+            self.__results[key] = result
+        pending.done.set()
+        return result
+
+    def __count(self, key: tuple):
+        """
+        Учёт запроса, результат которого взят из кэша (вызывается под блокировкой)
+
+        :param key: ключ запроса
+        :return:
+        """
+        self.duplicates[key[0]] = self.duplicates.get(key[0], 0) + 1
+        metrics.inc('lookup_memo', source=key[0], result='hit')
+
+    def total_duplicates(self):
+        """
+        Общее количество запросов, которые не пришлось выполнять
+
+        :return: количество
+        """
+        with self.__lock:
+            return sum(self.duplicates.values())
+
+
+class NotFoundCache:
+    """
+    Отрицательный кэш запросов во ФГИС, записи хранятся в таблице tbfgis_not_found
+    локальной БД: ключ запроса, время последнего запроса и количество запросов без результата.
+    Запрос повторяется через recheck_days * 2^(attempts - 1) дней, но не реже, чем раз в MAX_DAYS дней.
+    """
+    # Максимальный интервал между повторными запросами, дней
+    MAX_DAYS = 365
+
+    def __init__(self, recheck_days: int = 30):
+        """
+        Конструктор класса
+
+        :param recheck_days: интервал до первого повторного запроса, дней
+        """
+        self.recheck_days = recheck_days
+        self.__known = set()
+        self.__lock = threading.Lock()
+
+    def interval(self, attempts: int):
+        """
+        Метод для получения интервала до повторного запроса
+
+        :param attempts: количество запросов без результата
+        :return: интервал в секундах
+        """
+        days = min(self.recheck_days * 2 ** max(0, min(attempts - 1, 16)), NotFoundCache.MAX_DAYS)
+        return days * 86400
+
+    def skip(self, key: str, database):
+        """
+        Метод для проверки, можно ли не выполнять запрос во ФГИС: по нему ничего
+        не было найдено, и время повторного запроса ещё не наступило
+
+        :param key: ключ запроса
+        :param database: объект WorkDb
+        :return: True - запрос выполнять не нужно, False - нужно
+        """
+        entry = database.get_not_found(key) if database is not None else None
+        if entry is None:
+            return False
+        last_checked, attempts = entry
+        with self.__lock:
+            self.__known.add(key)
+        if time.time() < last_checked + self.interval(attempts):
+            metrics.inc('fgis_not_found', result='skipped')
+            logger.info(f"Запрос во ФГИС {key} пропущен: данных не было при {attempts} запросах")
+            return True
+        metrics.inc('fgis_not_found', result='recheck')
+        return False
+
+    def update(self, key: str, outcome: str, database):
+        """
+        Метод для изменения записи отрицательного кэша по результату запроса во ФГИС
+
+        :param key: ключ запроса
+        :param outcome: результат запроса (fgis_eapi.query_fgis): empty - запись добавляется
+                        или увеличивается количество запросов, found - запись удаляется,
+                        при остальных результатах (ошибках) запись не меняется
+        :param database: объект WorkDb
+        :return:
+        """
+        if database is None:
+            return
+        if outcome == 'empty':
+            metrics.inc('fgis_not_found', result='added')
+            database.set_not_found(key, False)
+            with self.__lock:
+                self.__known.add(key)
+        elif outcome == 'found':
+            with self.__lock:
+                known = key in self.__known
+                self.__known.discard(key)
+            if known:
+                metrics.inc('fgis_not_found', result='removed')
+                database.set_not_found(key, True)
@@ -0,0 +1,363 @@
+#!/usr/bin/python3
+"""
+Модуль для сбора метрик работы скрипта: счётчиков и гистограмм длительности.
+
+Метрики собираются в общий для процесса реестр REGISTRY. Снимок реестра
+можно передать из дочернего процесса в основной и сложить с его метриками.
+В конце работы выводится сводка, при необходимости метрики записываются в файл
+в формате JSON или в текстовом формате Prometheus.
+"""
+
+# Блок импорта
+import json
+import threading
+import time
+from functools import wraps
+import app_logger
+
+# Конец блока импорта
+
+logger = app_logger.get_logger(__name__, 'metrics_log.log')
+
+# Границы интервалов гистограмм длительности, в секундах
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Histogram:
+    """
+    Гистограмма длительности: количество наблюдений по интервалам,
+    общее количество, сумма, минимум и максимум
+    """
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value: float):
+        """
+        Добавить наблюдение
+
+        :param value: длительность, в секундах
+        :return:
+        """
+        index = 0
+        while index < len(BUCKETS) and value > BUCKETS[index]:
+            index += 1
+        self.buckets[index] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def merge(self, other):
+        """
+        Сложить с другой гистограммой
+
+        :param other: объект Histogram
+        :return:
+        """
+        self.buckets = [a + b for a, b in zip(self.buckets, other.buckets)]
+        self.count += other.count
+        self.sum += other.sum
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+
+    def quantile(self, q: float):
+        """
+        Оценка квантиля по границам интервалов
+
+        :param q: квантиль от 0 до 1
+        :return: верхняя граница интервала, в который попадает квантиль
+        """
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        total = 0
+        for index, value in enumerate(self.buckets):
+            total += value
+            if total >= rank:
+                return BUCKETS[index] if index < len(BUCKETS) else self.max
+        return self.max
+
+
+class Metrics:
+    """
+    Реестр метрик. Метрика определяется именем и набором меток,
+    например: fgis_requests{status=200}
+    """
+
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        return {'counters': self.counters, 'histograms': self.histograms}
+
+    def __setstate__(self, state):
+        self.counters = state['counters']
+        self.histograms = state['histograms']
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, value: int = 1, **labels):
+        """
+        Увеличить счётчик
+
+        :param name: имя метрики
+        :param value: величина увеличения
+        :param labels: метки
+        :return:
+        """
+        key = make_key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, **labels):
+        """
+        Добавить наблюдение в гистограмму длительности
+
+        :param name: имя метрики
+        :param seconds: длительность, в секундах
+        :param labels: метки
+        :return:
+        """
+        key = make_key(name, labels)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    def timer(self, name: str, **labels):
+        """
+        Контекстный менеджер для замера длительности блока кода
+
+        :param name: имя метрики
+        :param labels: метки
+        :return: объект Timer
+        """
+        return Timer(self, name, labels)
+
+    def snapshot(self):
+        """
+        Снимок реестра для передачи в другой процесс
+
+        :return: объект Metrics
+        """
+        snapshot = Metrics()
+        with self._lock:
+            snapshot.counters = dict(self.counters)
+            for key, histogram in self.histograms.items():
+                snapshot.histograms[key] = Histogram()
+                snapshot.histograms[key].merge(histogram)
+        return snapshot
+
+    def merge(self, other):
+        """
+        Сложить с метриками другого реестра
+
+        :param other: объект Metrics
+        :return:
+        """
+        with self._lock:
+            for key, value in other.counters.items():
+                self.counters[key] = self.counters.get(key, 0) + value
+            for key, histogram in other.histograms.items():
+                if key not in self.histograms:
+                    self.histograms[key] = Histogram()
+                self.histograms[key].merge(histogram)
+
+    def reset(self):
+        """
+        Очистить реестр
+
+        :return:
+        """
+        with self._lock:
+            self.counters = {}
+            self.histograms = {}
+
+    def summary(self):
+        """
+        Сводка по метрикам в виде строк для вывода
+
+        :return: список строк
+        """
+        lines = []
+        for (name, labels), value in sorted(self.counters.items()):
+            lines.append(f"{format_name(name, labels)}: {value}")
+        for (name, labels), histogram in sorted(self.histograms.items()):
+            lines.append(f"{format_name(name, labels)}: количество {histogram.count}, "
+                         f"всего {histogram.sum:.3f} с, среднее {histogram.sum / histogram.count:.4f} с, "
+                         f"p50 <= {histogram.quantile(0.5):.3f} с, p95 <= {histogram.quantile(0.95):.3f} с, "
+                         f"максимум {histogram.max:.3f} с")
+        return lines
+
+    def to_json(self):
+        """
+        Метрики в формате JSON
+
+        :return: строка
+        """
+        data = {'counters': [{'name': name, 'labels': dict(labels), 'value': value}
+                             for (name, labels), value in sorted(self.counters.items())],
+                'histograms': [{'name': name, 'labels': dict(labels), 'count': histogram.count,
+                                'sum': histogram.sum, 'min': histogram.min, 'max': histogram.max,
+                                'buckets': dict(zip([str(bound) for bound in BUCKETS] + ['+Inf'],
+                                                    histogram.buckets))}
+                               for (name, labels), histogram in sorted(self.histograms.items())]}
+        return json.dumps(data, ensure_ascii=False, indent=2)
+
+    def to_prometheus(self):
+        """
+        Метрики в текстовом формате Prometheus
+
+        :return: строка
+        """
+        lines = []
+        for (name, labels), value in sorted(self.counters.items()):
+            lines.append(f"{name}_total{format_labels(labels)} {value}")
+        for (name, labels), histogram in sorted(self.histograms.items()):
+            total = 0
+            for bound, value in zip([str(bound) for bound in BUCKETS] + ['+Inf'], histogram.buckets):
+                total += value
+                lines.append(f"{name}_seconds_bucket{format_labels(labels + (('le', bound),))} {total}")
+            lines.append(f"{name}_seconds_sum{format_labels(labels)} {histogram.sum}")
+            lines.append(f"{name}_seconds_count{format_labels(labels)} {histogram.count}")
+        return '\n'.join(lines) + '\n'
+
+    def write(self, namefile: str):
+        """
+        Записать метрики в файл: при расширении .json - в формате JSON,
+        иначе - в текстовом формате Prometheus
+
+        :param namefile: имя файла
+        :return: True or False
+        """
+        try:
+            with open(namefile, 'w', encoding='utf-8') as file:
+                file.write(self.to_json() if namefile.lower().endswith('.json') else self.to_prometheus())
+            logger.info(f"Метрики записаны в файл {namefile}")
+            return True
+        except Exception as err:
+            logger.warning(f"Не удалось записать метрики в файл {namefile}. Ошибка: {err}")
+            return False
+
+
+class Timer:
+    """
+    Контекстный менеджер для замера длительности
+    """
+
+    def __init__(self, registry: Metrics, name: str, labels: dict):
+        self.registry = registry
+        self.name = name
+        self.labels = labels
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.registry.observe(self.name, time.perf_counter() - self.start, **self.labels)
+        return False
+
+
+def make_key(name: str, labels: dict):
+    """
+    Функция для получения ключа метрики: имя и отсортированные метки,
+    значения меток приводятся к строке
+
+    :param name: имя метрики
+    :param labels: словарь меток
+    :return: кортеж
+    """
+    return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def format_labels(labels: tuple):
+    """
+    Функция для форматирования меток метрики
+
+    :param labels: кортеж пар (метка, значение)
+    :return: строка вида {a="1",b="2"}
+    """
+    if len(labels) == 0:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels) + '}'
+
+
+def format_name(name: str, labels: tuple):
+    """
+    Функция для форматирования имени метрики с метками
+
+    :param name: имя метрики
+    :param labels: кортеж пар (метка, значение)
+    :return: строка
+    """
+    return name + format_labels(labels)
+
+
+# Общий реестр метрик процесса
+REGISTRY = Metrics()
+
+
+def inc(name: str, value: int = 1, **labels):
+    """
+    Увеличить счётчик общего реестра
+
+    :param name: имя метрики
+    :param value: величина увеличения
+    :param labels: метки
+    :return:
+    """
+    REGISTRY.inc(name, value, **labels)
+
+
+def observe(name: str, seconds: float, **labels):
+    """
+    Добавить наблюдение в гистограмму общего реестра
+
+    :param name: имя метрики
+    :param seconds: длительность, в секундах
+    :param labels: метки
+    :return:
+    """
+    REGISTRY.observe(name, seconds, **labels)
+
+
+def timer(name: str, **labels):
+    """
+    Контекстный менеджер для замера длительности блока кода в общий реестр
+
+    :param name: имя метрики
+    :param labels: метки
+    :return: объект Timer
+    """
+    return REGISTRY.timer(name, **labels)
+
+
+def timed(name: str, label: str = 'statement', **labels):
+    """
+    Декоратор для замера длительности вызова функции или метода,
+    имя функции добавляется в метку label
+
+    :param name: имя метрики
+    :param label: наименование метки для имени функции
+    :param labels: метки
+    :return: декоратор
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with REGISTRY.timer(name, **{label: func.__name__}, **labels):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
@@ -12,7 +12,7 @@ import re
 import app_logger
 import parse_fgis
 from work_db import WorkDb, CardFgis
-from parse_type_si import TypeParseSi
+from parse_type_si import match_any
 
 logger = app_logger.get_logger(__name__, 'log_file.log')
 # Константы
@@ -364,13 +364,7 @@ def parse_list_card(lst, type_si, verif_date):
     res_dict = {}
     date = datetime.strftime(verif_date, '%d.%m.%Y')
     for ind, card in enumerate(lst):
-        current_type = card.mi_mitype
-        current_mod = card.mi_modification
-        parse_type = TypeParseSi(current_type, type_si)
-        res_parse = parse_type.parse()
-        parse_mod = TypeParseSi(current_mod, type_si)
-        res_parse_mod = parse_mod.parse()
-        if check_true(res_parse) and date == card.verification_date:
+        if match_any(card.mi_mitype, type_si) and date == card.verification_date:
             res_dict[ind] = card
     return res_dict
 
@@ -32,11 +32,21 @@ import app_logger
 import fgis_eapi
 import localdb
 import xlsx
-from datetime import datetime, date
+import checkpoint
+import pipeline
+import metrics
+import fuzzy_match
+import dates
+import memo
+import threading
+import time
+from datetime import datetime
 import re
-from parse_type_si import TypeParseSi
+from parse_type_si import match_any
 from progress.bar import IncrementalBar
 import configparser
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import multiprocessing.util
 
 # Конец блока импорта
 
@@ -70,15 +80,7 @@ COLUMNS_SI = {
 }
 COLUMN_ID = 36
 
-EXC_STR = ['',
-           '-',
-           '--',
-           '---',
-           'не пригоден',
-           'н/д',
-           'нет данных',
-           'отсутствует',
-           None]
+EXC_STR = dates.EXC_STR
 
 
 # ================================== #
@@ -112,6 +114,38 @@ def parse_args():
     parser.add_argument('--START', type=int, default=13, help='Начальная строка')
     parser.add_argument('-cfg', '--setfile', type=str, default='settings.ini',
                         help='Файл с настройками подключения к локальной БД')
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                        help='Количество процессов для параллельной обработки видов СИ')
+    parser.add_argument('--chunk', type=int, default=0,
+                        help='Количество строк файла в одном задании для параллельной обработки '
+                             'по диапазонам строк (0 - обработка по видам СИ и годам поверки)')
+    parser.add_argument('--pipeline', action='store_true',
+                        help='Обрабатывать строки конвейером из этапов, выполняемых отдельными потоками')
+    parser.add_argument('--stage-workers', type=str, default='',
+                        help='Количество потоков по этапам конвейера: plan, fetch, normalize, resolve, write, '
+                             'match, например: <fetch=4,resolve=2,write=2>. По умолчанию - по одному потоку')
+    parser.add_argument('--queue-size', type=int, default=100,
+                        help='Максимальное количество строк в очереди между этапами конвейера')
+    parser.add_argument('--metrics', type=str, default='',
+                        help='Файл для записи метрик работы: с расширением .json - в формате JSON, '
+                             'иначе - в текстовом формате Prometheus')
+    parser.add_argument('--resume', action='store_true',
+                        help='Продолжить обработку с контрольной точки предыдущего запуска')
+    parser.add_argument('--checkpoint', type=str, default='',
+                        help='Файл контрольной точки (по умолчанию - имя файла Excel с расширением .checkpoint)')
+    parser.add_argument('--checkpoint-every', type=int, default=500,
+                        help='Количество обработанных строк между сохранениями контрольной точки '
+                             '(0 - не сохранять контрольные точки)')
+    parser.add_argument('--fuzzy', action='store_true',
+                        help='Для режима local: если карточка не найдена по номеру и типу СИ, искать её '
+                             'нечётким сопоставлением среди карточек года поверки, найденная ссылка '
+                             'выделяется жёлтым цветом для проверки')
+    parser.add_argument('--fuzzy-threshold', type=float, default=0.8,
+                        help='Минимальная оценка сходства (от 0 до 1) для нечёткого сопоставления')
+    parser.add_argument('--recheck-days', type=int, default=30,
+                        help='Через сколько дней повторять запрос во ФГИС, по которому ничего не найдено. '
+                             'С каждым повтором без результата интервал удваивается (не более года), '
+                             '0 - не использовать отрицательный кэш запросов')
     logger.info("Парсинг параметров командной строки закончен")
 
     return parser
@@ -320,25 +354,17 @@ def check_dict_for_write(dict_for_write, database):
         return dict_for_write
 
 
-def check_verif_date(card: localdb.CardFgis, last_verif_date: str):
+def check_verif_date(card: localdb.CardFgis, verif_ordinal: int):
     """
     Функция для сверки даты последней поверки текущего СИ
     и даты послдней поверки, полученной из ФГИС
 
     :param card: объект CardFgis
-    :param last_verif_date: дата последней поверки текущего СИ, полученная из файла
+    :param verif_ordinal: дата последней поверки текущего СИ, полученная из файла,
+                          порядковый номер дня
     :return: True or False
     """
-    card_last_verif_date = datetime.strptime(card.verification_date, "%d.%m.%Y")
-    if type(last_verif_date) == str:
-        tmp_verif_date = datetime.strptime(last_verif_date, "%d.%m.%Y")
-    else:
-        tmp_verif_date = last_verif_date
-
-    if card_last_verif_date == tmp_verif_date:
-        return True
-    else:
-        return False
+    return card.verif_ordinal != 0 and card.verif_ordinal == verif_ordinal
 
 
 def pass_to_si_list(keywords: str):
@@ -355,161 +381,509 @@ def pass_to_si_list(keywords: str):
     pass
 
 
-def pass_to_rows(start_row: int, end_row: int):
+def pass_to_rows(start_row: int, end_row: int, chunk_rows: int):
     """
-    Функция для прохода по строкам файла.
+    Функция для разбиения строк файла на диапазоны для обработки
+    в отдельных процессах.
 
     :param start_row: начальная строка.
     :param end_row: конечная строка.
-    :return:
+    :param chunk_rows: количество строк в одном диапазоне.
+    :return: список кортежей (начальная строка, конечная строка) по порядку строк
     """
+    chunk_rows = max(1, chunk_rows)
+    return [(row, min(row + chunk_rows - 1, end_row)) for row in range(start_row, end_row + 1, chunk_rows)]
+
+
+def fgis_request(request_parameters: dict):
     """
-    Отсюда вызывать метод чтения информации по СИ на текущей строке.
-    Метод чтения информации реализовать в модуле xlsx, с передачей в качестве аргументов
-    номера строки. Модуль xlsx должен считать в строке номер СИ, тип, даты последней и следующей поверки, 
-    проверить валидность даты последней поверки, при необходимости скорректировать её, и вернуть всё это дело
-    в виде одного объекта (или списка, словаря, кортежа) в готовом для использования виде, чтобы никаких
-    преобразований больше не требовалось.
+    Функция для отправки параметров для запроса во ФГИС и
+    обработки результатов запроса
+    :param request_parameters: словарь с параметрами
+    :return: кортеж (список записей, результат запроса fgis_eapi.query_fgis)
     """
-    pass
+    dict_request = format_dict_requests(title=request_parameters['current_si'],
+                                        number=request_parameters['current_serial'],
+                                        verif_year=request_parameters['last_verif_year'],
+                                        mitype=request_parameters['mitype'],
+                                        rows=str(100))
+    return fgis_eapi.query_fgis(dict_request)
 
 
-def main():
+def connect_database(local_db_parameters: dict):
     """
-    Основная функция скрипта.
-    Обрабатывается заданный файл Excel и сохраняет результаты работы.
+    Функция для установки соединения с локальной БД
 
-    :return:
+    :param local_db_parameters: словарь с данными подключения к локальной БД
+    :return: объект WorkDb
     """
-    START_ROW = 13
-    logger.info(f"Запуск скрипта {__name__}, дата и время: {datetime.now()}")
-    argv_parser = parse_args()
-    namespace_argv = argv_parser.parse_args(sys.argv[1:])
-    namefile_xlsx = namespace_argv.namefile
-    verif_year = namespace_argv.years
-    keyword_si = namespace_argv.keyword
-    mode = namespace_argv.mode
-    serial = namespace_argv.serial
-    start = namespace_argv.START
-    namefile_setting = namespace_argv.setfile
+    return localdb.WorkDb(database=local_db_parameters['database'],
+                          user=local_db_parameters['user'],
+                          password=local_db_parameters['password'],
+                          port=local_db_parameters['port'],
+                          host=local_db_parameters['host'])
 
-    # =========================================================================================#
 
-    # Читаем файл с параметрами подключения к локальной БД
-    local_db_parameters = read_settings_file(namefile_setting)
-    # Устанавливаем соединение с БД
-    database = localdb.WorkDb(database=local_db_parameters['database'],
-                              user=local_db_parameters['user'],
-                              password=local_db_parameters['password'],
-                              port=local_db_parameters['port'],
-                              host=local_db_parameters['host'])
+def merge_stats(target: dict, source: dict):
+    """
+    Функция для сложения статистики обработки, полученной
+    от разных обработчиков
 
-    # ==========================================================================================#
+    :param target: словарь, в который складывается статистика
+    :param source: словарь со статистикой обработчика
+    :return: target
+    """
+    for key, value in source.items():
+        target[key] = target.get(key, 0) + value
 
-    # Проверяем введённые параметры на корректность,
-    # недопустим режим unknow и год 0
-    if verif_year != 0 and mode == 'unknow':
-        print(f"Заданы некорректные параметры запуска: при использовании режима 'unknow' не нужно задавать год."
-              f"Прекращаем работу...")
-        logger.warning(
-            f"Заданы некорректные параметры запуска: mode = {mode}, verif_year = {verif_year}.\nПрекращаем работу.")
-        sys.exit()
-    if verif_year == 0 and (mode in ['fgis', 'local']):
-        joke_answer = input(f"Вы не задали год для обработки, но при этом выбрали режим {mode}."
-                            f"В таком случае будет использован текущий год - {datetime.now().year}? (Y/n): ")
-        if joke_answer.lower() == 'n':
-            logger.warning(f"Пользователь отказался от дальнейшего выполнения. Прекращаем работу и по домам!")
-            print("Ути, какие мы ранимые...ну тогда всё.")
-            sys.exit()
-        else:
-            verif_year = datetime.now().year
-    if start != 0:
-        START_ROW = start
-    else:
-        pass
+    return target
 
-    logger.info(f"Парсим файл Excel со следующими исходными данными: имя файла - {namefile_xlsx}, "
-                f"год поверки - {verif_year}, СИ для парсинга - {keyword_si}")
 
-    workbook = xlsx.XlsxFile(namefile_xlsx)
-    worksheet = workbook.active_sheet
-    row_end = worksheet.max_row
+class RowItem:
+    """
+    Данные по одной строке файла и одному виду СИ, которые передаются
+    между этапами обработки: планированием, запросами, записью в БД,
+    сопоставлением и записью изменений ячеек.
+    """
+    __slots__ = ('seq', 'kind', 'ind', 'row', 'serial_col', 'href_col', 'serial', 'serial_key', 'mitype',
+                 'type_key', 'verif_ordinal', 'valid_ordinal', 'flag_href', 'href', 'id_record',
+                 'last_verif_year', 'valid_year', 'action', 'requests', 'responses', 'records', 'result',
+                 'fuzzy', 'href_status', 'href_id', 'updates', 'stats')
 
-    def check_si_on_localdb(si_inform: dict):
+    def __init__(self, seq: int, kind: str, si_table, ind: int):
         """
-        Проверяем наличие в локальной БД информации по текущему СИ
+        Конструктор класса
 
-        :param si_inform: словарь с данными по СИ:
-                            'serial' - серийный номер СИ,
-                            'type' - тип СИ,
-                            'verif_date' - дата поверки
-        :return: True or False
+        :param seq: порядковый номер строки в общей очереди обработки
+        :param kind: вид СИ: ПУ, ТТ или ТН
+        :param si_table: объект SiTable с данными по строкам файла
+        :param ind: позиция строки в SiTable
         """
-        # Получаем из словаря серийный номер
-        # тип СИ, дату поверки и пытаемся получить из БД данные
-        # по этим данным
-        serial = si_inform['serial']
-        type = si_inform['type']
-        verif_date = si_inform['verif_date']
+        si_columns = si_table.kinds[kind]
+        self.seq = seq
+        self.kind = kind
+        self.ind = ind
+        self.row = si_table.rows[ind]
+        self.serial_col = COLUMNS_SI[kind]['serial']
+        self.href_col = COLUMNS_SI[kind]['href']
+        self.serial = si_columns.serials[ind]
+        self.serial_key = si_columns.serial_keys[ind]
+        self.mitype = si_columns.types[ind]
+        self.type_key = si_columns.type_keys[ind]
+        self.verif_ordinal = si_columns.verif_ordinals[ind]
+        self.valid_ordinal = si_columns.valid_ordinals[ind]
+        self.flag_href = si_columns.href_flags[ind]
+        self.href = si_columns.hrefs[ind]
+        self.id_record = si_table.ids[ind] or None
+        # Год последней и следующей поверки, если даты в ячейках
+        # не соответствуют исключениям в словаре
+        self.last_verif_year = si_columns.verif_years[ind] or None
+        self.valid_year = (si_columns.valid_years[ind] or None) if self.last_verif_year else None
+        self.action = None
+        self.requests = []
+        self.responses = []
+        self.records = []
+        self.result = None
+        self.fuzzy = None
+        self.href_status = None
+        self.href_id = None
+        self.updates = None
+        self.stats = None
+
+
+class SiProcessor:
+    """
+    Класс для обработки строк файла Excel по одному виду СИ.
+    Все изменения ячеек выполняются через объект writer - XlsxFile
+    или CellWriter, поэтому обработку можно выполнять в отдельном процессе,
+    а накопленные изменения затем перенести в книгу.
+    """
+
+    def __init__(self, database, writer, mode: str, verif_year: int, serial: str = '', card_table=None,
+                 checkpoint=None, fuzzy=None, href_table=None, lookups=None, not_found=None):
+        """
+        Инициализация объекта
+
+        :param database: объект WorkDb для работы с локальной БД
+        :param writer: объект XlsxFile или CellWriter для записи изменений ячеек
+        :param mode: режим работы скрипта
+        :param verif_year: год поверки для обработки
+        :param serial: конкретный номер СИ для поиска в БД ФГИС
+        :param card_table: объект CardTable с заранее загруженными карточками или None
+        :param checkpoint: объект Checkpoint для сохранения промежуточного состояния или None
+        :param fuzzy: объект MatcherCache для нечёткого поиска карточек или None
+        :param href_table: словарь (вид СИ, строка) -> (результат проверки гиперссылки, id_record)
+                           с заранее проверенными гиперссылками или None
+        :param lookups: объект LookupMemo с результатами запросов за время работы скрипта,
+                        по умолчанию - новый
+        :param not_found: объект NotFoundCache - отрицательный кэш запросов во ФГИС, или None
+        """
+        self.database = database
+        self.writer = writer
+        self.mode = mode
+        self.verif_year = verif_year
+        self.serial = serial
+        self.card_table = card_table
+        self.checkpoint = checkpoint
+        self.fuzzy = fuzzy
+        self.href_table = href_table
+        self.lookups = lookups if lookups is not None else memo.LookupMemo()
+        self.not_found = not_found
+        # Статистика по обработке для вывода в конце работы
+        self.stats = {'ambiguous': 0}
+        # Записи для локальной БД, которые не удалось записать
+        self.pending_records = []
+
+    def process_kind(self, current_si: str, si_table: xlsx.SiTable, bar=None):
+        """
+        Метод для обхода строк файла по одному виду СИ
+
+        :param current_si: вид СИ: ПУ, ТТ или ТН
+        :param si_table: объект SiTable с данными по строкам файла
+        :param bar: индикатор выполнения или None
+        :return:
+        """
+        logger.info(f"Начинаем обход строк файла для вида СИ: {current_si}")
 
-    def check_true(dct):
-        lst = list(dct.values())
-        count = 0
-        for i in lst:
-            if i:
-                count += 1
+        positions = self.select_positions(current_si, si_table)
+        for ind in positions:
+            current_row = si_table.rows[ind]
+            if bar is not None:
+                bar.next()
+            if self.checkpoint is None:
+                self.process_row(RowItem(ind, current_si, si_table, ind))
+            elif not self.checkpoint.is_done(current_si, current_row):
+                self.process_row(RowItem(ind, current_si, si_table, ind))
+                if self.checkpoint.mark(current_si, current_row):
+                    self.save_checkpoint()
+
+    def select_positions(self, current_si: str, si_table: xlsx.SiTable):
+        """
+        Метод для отбора позиций строк, которые нужно обработать по виду СИ.
+        Строки отбираются по индексу годов последней поверки: для заданного года -
+        только строки этого года, при обработке по всем годам - строки, в которых
+        есть годы последней и следующей поверки. Остальные строки при планировании
+        всё равно были бы пропущены, поэтому они не обходятся.
+
+        :param current_si: вид СИ: ПУ, ТТ или ТН
+        :param si_table: объект SiTable с данными по строкам файла
+        :return: позиции строк в SiTable по возрастанию
+        """
+        positions = self.__year_positions(si_table.kinds[current_si])
+        skipped = len(si_table) - len(positions)
+        if skipped > 0:
+            logger.info(f"Пропускаем {skipped} строк по виду СИ {current_si}, так как не совпадает год")
+            metrics.inc('rows', skipped, kind=current_si, action='skip')
+        return positions
+
+    def load_hrefs(self, si_table: xlsx.SiTable, lst_si: list):
+        """
+        Метод для проверки всех гиперссылок строк, которые будут обработаны, одним запросом
+        к локальной БД. Результаты сохраняются в href_table, если получить их не удалось,
+        то гиперссылки проверяются запросом на каждую строку.
 
-        return True if count > 0 else False
+        :param si_table: объект SiTable с данными по строкам файла
+        :param lst_si: список видов СИ
+        :return:
+        """
+        keys = []
+        rows = []
+        for current_si in lst_si:
+            si_columns = si_table.kinds[current_si]
+            for ind in self.__year_positions(si_columns):
+                if si_columns.href_flags[ind]:
+                    keys.append((current_si, si_table.rows[ind]))
+                    rows.append((si_columns.hrefs[ind], si_table.ids[ind] or None))
+        if len(rows) == 0:
+            return
+        if not self.database.has_function('get_ids_for_vri_ids'):
+            logger.warning("В локальной БД нет функции get_ids_for_vri_ids, гиперссылки проверяются запросом "
+                           "на каждую строку. Для создания функции выполните скрипты из scripts/create")
+            return
+        result = self.database.validate_hrefs(rows)
+        if result is not None:
+            self.href_table = dict(zip(keys, result))
+
+    def count_rows(self, si_table: xlsx.SiTable, lst_si: list):
+        """
+        Метод для подсчёта количества строк для обработки по всем видам СИ
 
-    def fgis_request(request_parameters: dict):
+        :param si_table: объект SiTable с данными по строкам файла
+        :param lst_si: список видов СИ
+        :return: количество строк
         """
-        Функция для отправки параметров для запроса во ФГИС и
-        обработки результатов запроса
-        :param request_parameters: словарь с параметрами
+        return sum(len(self.__year_positions(si_table.kinds[current_si])) for current_si in lst_si)
+
+    def __year_positions(self, si_columns: xlsx.SiColumns):
+        """
+        Метод для получения позиций строк по году обработки из индекса годов последней поверки
+
+        :param si_columns: объект SiColumns по виду СИ
+        :return: позиции строк по возрастанию
+        """
+        if self.verif_year != 0:
+            return si_columns.positions([self.verif_year])
+        valid_years = si_columns.valid_years
+        return [pos for pos in si_columns.positions() if valid_years[pos]]
+
+    def save_checkpoint(self):
+        """
+        Метод для сохранения контрольной точки с текущим состоянием обработки
+
         :return:
         """
-        dict_request = format_dict_requests(title=request_parameters['current_si'],
-                                            number=request_parameters['current_serial'],
-                                            verif_year=request_parameters['last_verif_year'],
-                                            mitype=request_parameters['mitype'],
-                                            rows=str(100))
-        response = fgis_eapi.request_fgis(dict_request)
-        return response
+        if self.checkpoint is not None:
+            self.checkpoint.save(self.writer.updates, self.stats, self.pending_records)
+
+    def write_pending(self):
+        """
+        Метод для повторной попытки записи в локальную БД записей,
+        которые не удалось записать ранее
+
+        :return: количество записей, которые так и не удалось записать
+        """
+        if len(self.pending_records) > 0:
+            logger.info(f"Повторная запись в БД {len(self.pending_records)} записей")
+            self.pending_records = [record for record in self.pending_records
+                                    if not self.database.write_metrology(record)]
+        return len(self.pending_records)
+
+    def process_row(self, item: RowItem):
+        """
+        Метод для обработки одной строки файла по виду СИ: все этапы
+        обработки выполняются последовательно
+
+        :param item: объект RowItem
+        :return:
+        """
+        start = time.perf_counter()
+        for stage in SiPipeline.STAGES:
+            with metrics.timer('row_stage', stage=stage):
+                getattr(self, f"{stage}_row")(item)
+        app_logger.event(logger, 'row_processed', "Строка %s по виду СИ %s обработана", item.row, item.kind,
+                         kind=item.kind, row=item.row, serial=item.serial, action=item.action,
+                         duration=round(time.perf_counter() - start, 6))
+
+    def plan_row(self, item: RowItem):
+        """
+        Этап планирования: по годам поверки и режиму работы определяется,
+        что нужно сделать со строкой, и формируются запросы во ФГИС
+
+        :param item: объект RowItem
+        :return:
+        """
+        verif_year = self.verif_year
+        last_verif_year = item.last_verif_year
+        valid_year = item.valid_year
+        app_logger.event(logger, 'row_plan', "Год последней поверки для %s и строки №%s - %s", item.kind, item.row,
+                         last_verif_year, kind=item.kind, row=item.row, serial=item.serial, year=last_verif_year)
+
+        # Проверяем год для обработки из параметров скрипта
+        # для дальнейших действий
+        if verif_year == 0 and valid_year != None:
+            # Действия для проверки СИ по всем годам,
+            # начиная с года последней поверки и до текущего года
+            if item.serial != None and item.mitype != None and last_verif_year != None:
+                item.action = 'fgis_years'
+                # Цикл по годам текущего СИ
+                for year in range(last_verif_year, datetime.now().year + 1):
+                    item.requests.append({'current_si': item.kind,
+                                          'current_serial': item.serial,
+                                          'last_verif_year': last_verif_year,
+                                          'mitype': item.mitype})
+        elif verif_year == last_verif_year:
+            # Действия для проверки по конкретному году
+            # Провряем режим работы и выбираем стезю...блядь
+            match self.mode:
+                case 'fgis':
+                    if self.serial != '' and self.serial != item.serial:
+                        logger.info(
+                            f"Задан конкретный номер СИ для поиска - {self.serial}. Текущий номер СИ - {item.serial}"
+                            f" не совпадает с введённым, пропускаем его.")
+                    else:
+                        logger.info(f"Готовим запрос в БД ФГИС по СИ - {item.kind}, №{item.serial}")
+                        item.action = 'fgis'
+                        item.requests.append({'current_si': item.kind,
+                                              'current_serial': item.serial,
+                                              'last_verif_year': last_verif_year,
+                                              'mitype': item.mitype})
+                case 'local':
+                    # Без ссылки - ищем карточку, со ссылкой - проверяем валидность гиперссылки
+                    item.action = 'href' if item.flag_href else 'local'
+                case 'change_serial':
+                    item.action = 'change_serial'
+        elif verif_year != last_verif_year and verif_year == valid_year:
+            logger.info("Пропускаем строку %s, так как не совпадает год.", item.row)
+        metrics.inc('rows', kind=item.kind, action=item.action or 'skip')
+
+    def fetch_row(self, item: RowItem):
+        """
+        Этап получения данных: запросы во ФГИС, поиск карточек
+        в локальной БД или проверка гиперссылки
+
+        :param item: объект RowItem
+        :return:
+        """
+        match item.action:
+            case 'fgis' | 'fgis_years':
+                # Одинаковые запросы по повторяющимся в файле СИ выполняются один раз
+                item.responses = [self.fgis_lookup(request) for request in item.requests]
+            case 'local':
+                # не забыть про идентификатор записи в БД и номер строки файла
+                item.result = self.lookups.get(('local', item.serial, item.mitype, item.verif_ordinal),
+                                               lambda: self.local_request(item.serial, item.kind,
+                                                                          item.last_verif_year, item.mitype,
+                                                                          item.verif_ordinal, item.serial_key,
+                                                                          item.type_key))
+                if item.result is None and self.fuzzy is not None:
+                    item.fuzzy = self.fuzzy_request(item)
+            case 'href':
+                # Гиперссылки проверяются заранее одним запросом (load_hrefs),
+                # если результата нет - запрос по строке
+                checked = self.href_table.get((item.kind, item.row)) if self.href_table is not None else None
+                if checked is None:
+                    href_id = self.database.get_id_for_href(item.href)
+                    checked = (localdb.href_status(href_id, item.id_record), href_id)
+                item.href_status, item.href_id = checked
+
+    def normalize_row(self, item: RowItem):
+        """
+        Этап подготовки к записи в локальную БД данных, полученных из ФГИС
+
+        :param item: объект RowItem
+        :return:
+        """
+        if item.action != 'fgis' or len(item.responses) == 0:
+            return
+        response = item.responses[0]
+        # Проверяем результаты запроса, получено ли вообще что-нибудь
+        # Если количество элементов списка в ответе больше 0, то есть
+        # что-то получили
+        if response:
+            logger.info(f"Ок, получили данные для номера СИ - {item.serial}")
+            row_number = item.row if len(response) == 1 else 0
+            for response_item in response:
+                logger.info("Item = %s", response_item)
+                if response_item is not None:
+                    item.records.append(format_dict_for_write(response_item, row_number))
+
+    def resolve_row(self, item: RowItem):
+        """
+        Этап проверки дубликатов и получения идентификаторов справочников
+        для записей, подготовленных к записи в локальную БД
+
+        :param item: объект RowItem
+        :return:
+        """
+        resolved = []
+        for record in item.records:
+            dict_for_write = check_dict_for_write(record, self.database)
+            logger.info("dict_for_write = %s", dict_for_write)
+            if dict_for_write is not None:
+                resolved.append(dict_for_write)
+        item.records = resolved
+
+    def write_row(self, item: RowItem):
+        """
+        Этап записи данных в локальную БД
 
-    def parse_list_card(lst, type_si, verif_date):
+        :param item: объект RowItem
+        :return:
+        """
+        for dict_for_write in item.records:
+            # Попытка записи в локальную БД
+            try:
+                if not self.database.write_metrology(dict_for_write):
+                    self.pending_records.append(dict_for_write)
+            except Exception as err:
+                self.pending_records.append(dict_for_write)
+                logger.warning(f"{err.__str__()}")
+                logger.warning(
+                    f"Не удалось записать данные в БД <{str(dict_for_write)}>")
+        if item.action == 'fgis' and item.responses[0]:
+            logger.info(f"Обработан СИ с номером - {item.serial}")
+
+    def match_row(self, item: RowItem):
+        """
+        Этап сопоставления результатов с данными файла и записи изменений ячеек
+
+        :param item: объект RowItem
+        :return:
+        """
+        coord = (item.row, item.href_col)
+        match item.action:
+            case 'local':
+                if item.fuzzy is not None:
+                    self.set_fuzzy_href(item.fuzzy, coord)
+                else:
+                    self.check_result_local_request(item.result, coord, item.verif_ordinal)
+            case 'href':
+                # Если ссылка валидна, то выделить одним цветом, если нет, то другим.
+                # Если идентификатор записи не совпадает с файлом, то ячейку не меняем
+                metrics.inc('match_result', result=f'href_{item.href_status}')
+                if item.href_status == localdb.HREF_VALID:
+                    self.writer.set_fill(coord, 'orange')
+                    # self.writer.set_id_record((item.row, COLUMN_ID), item.href_id)
+                elif item.href_status == localdb.HREF_INVALID:
+                    self.writer.set_fill(coord, 'red_brown')
+            case 'change_serial':
+                if str(item.serial)[0] == '1':
+                    self.writer._write_value((item.row, item.serial_col), '0' + str(item.serial))
+
+    def parse_list_card(self, lst, type_si, verif_ordinal):
         """
         Функция для обработки списка объектов CardFgis
 
         :param lst: список объектов CardFgis
         :param type_si: строка типа СИ
-        :param verif_date: дата последней поверки, взята из файла
+        :param verif_ordinal: дата последней поверки, взята из файла, порядковый номер дня
         :return: словарь с объектами CardFgis, по которым дата последней поверки
                 совпадает с требуемой
         """
 
         res_dict = {}
-        date = None
 
-        if type(verif_date) is datetime:
-            date = datetime.strftime(verif_date, '%d.%m.%Y')
-        elif type(verif_date) is str:
-            date = datetime.strptime(verif_date, '%d.%m.%Y')
         if len(lst) == 1:
             res_dict[0] = lst[0]
         else:
             for ind, card in enumerate(lst):
-                current_type = card.mi_mitype
-                current_mod = card.mi_modification
-                parse_type = TypeParseSi(current_type, type_si)
-                res_parse = parse_type.parse()
-                parse_mod = TypeParseSi(current_mod, type_si)
-                res_parse_mod = parse_mod.parse()
-                if check_true(res_parse) and date == card.verification_date:
+                if match_any(card.mi_mitype, type_si) and check_verif_date(card, verif_ordinal):
                     res_dict[ind] = card
 
         return res_dict
 
-    def local_request(serial, si, year, current_type, verif_date):
+    def fgis_lookup(self, request: dict):
+        """
+        Запрос во ФГИС: одинаковые запросы по повторяющимся в файле СИ выполняются один раз,
+        запросы, по которым ранее ничего не найдено, пропускаются до времени повторного
+        запроса по отрицательному кэшу
+
+        :param request: словарь с параметрами запроса
+        :return: список записей
+        """
+        key = ('fgis', request['current_si'], request['current_serial'], request['last_verif_year'],
+               request['mitype'])
+        return self.lookups.get(key, lambda: self.__fgis_checked_request(request, '|'.join(map(str, key[1:]))))
+
+    def __fgis_checked_request(self, request: dict, key: str):
+        """
+        Запрос во ФГИС с проверкой и изменением отрицательного кэша
+
+        :param request: словарь с параметрами запроса
+        :param key: ключ запроса для отрицательного кэша
+        :return: список записей
+        """
+        if self.not_found is not None and self.not_found.skip(key, self.database):
+            return []
+        response, outcome = fgis_request(request)
+        if self.not_found is not None:
+            self.not_found.update(key, outcome, self.database)
+        if outcome not in ('found', 'empty', 'too_many'):
+            # Запрос прерван или не дождался ответа: повторный запрос по этому ключу выполняется заново
+            raise memo.Unsaved(response)
+        return response
+
+    def local_request(self, serial, si, year, current_type, verif_ordinal, serial_key=None, type_key=None):
         """
         Обращаемся к локальной БД для получения данных по номеру, типу СИ
         и году поверки
@@ -518,16 +892,42 @@ def main():
         :param si: тип СИ
         :param year: год поверки СИ
         :param current_type: наименование типа СИ
+        :param verif_ordinal: дата последней поверки, порядковый номер дня
+        :param serial_key: нормализованный номер СИ, если не задан - вычисляется по serial
+        :param type_key: нормализованный тип СИ, если не задан - вычисляется по current_type
         :return: словарь с данными по текущему СИ
         """
         dict_filter = {'serial_si': serial,
                        'name_si': si,
                        'verif_year': year,
                        'type_si': current_type,
-                       'verif_date': verif_date}
+                       'verif_date': verif_ordinal}
+
+        if self.card_table is not None:
+            # Карточки загружены заранее в колоночное хранилище,
+            # выборка по номеру, типу и дате без обращения к БД
+            if serial_key is None and serial is not None:
+                serial_key = fuzzy_match.normalize_serial(serial)
+            if type_key is None and current_type is not None:
+                type_key = fuzzy_match.normalize_type(current_type)
+            positions = self.card_table.find(serial_key, type_key)
+            if len(positions) == 0:
+                logger.info("Ничего не получено для текущего СИ %s", serial)
+                return None
+            elif len(positions) == 1:
+                return self.card_table.cards[positions[0]]
+            logger.info(f"Получено для текущего СИ {len(positions)} значений из CardTable.")
+            same_positions = self.card_table.filter_same(positions, current_type, verif_ordinal)
+            if len(same_positions) == 1:
+                return self.card_table.cards[same_positions[0]]
+            elif len(same_positions) > 1 and verif_ordinal != 0:
+                # Несколько карточек с той же датой поверки: выбор по столбцам CardTable
+                return self.card_table.choose(same_positions)
+            else:
+                return self.card_table.get_cards(same_positions)
 
-        # lst_card = database.get_card_for_si(dict_filter)
-        lst_card = database.get_card_si(dict_filter['serial_si'], dict_filter['type_si'])
+        # lst_card = self.database.get_card_for_si(dict_filter)
+        lst_card = self.database.get_card_si(dict_filter['serial_si'], dict_filter['type_si'])
 
         if not type(lst_card) == list and not lst_card == None:
             return lst_card
@@ -535,28 +935,76 @@ def main():
             if not lst_card == None:
                 logger.info(f"Получено для текущего СИ {len(lst_card)} значений из БД.")
             else:
-                logger.info(f"Ничего не получено для текущего СИ {serial}")
+                logger.info("Ничего не получено для текущего СИ %s", serial)
         if type(lst_card) == list and len(lst_card) > 0:
             # Здесь нужно реализовать проверку карточек на все условия:
             #  - сформировать список карточек в которых дата поверки совпадает, если таких больше одной
             #  - проверить эти карточки по идентификаторам
 
-            d = parse_list_card(lst_card, dict_filter['type_si'], dict_filter['verif_date'])
+            d = self.parse_list_card(lst_card, dict_filter['type_si'], dict_filter['verif_date'])
             if len(d) == 1:
                 res_lst_card = d[list(d.keys())[0]]
                 return res_lst_card
             else:
                 return list(d.values())
 
-    def check_result_local_request(res_request, coord: tuple, str_verif_date: str):
+    def fuzzy_request(self, item: RowItem):
+        """
+        Нечёткий поиск карточки среди карточек года поверки, если по номеру
+        и типу СИ ничего не найдено: номера и типы сравниваются после нормализации
+        (ведущие нули, пробелы, похожие латинские буквы) по совпадению триграмм
+
+        :param item: объект RowItem
+        :return: пара (CardFgis, оценка), или None - если подходящая карточка
+                 не найдена или найдено несколько карточек с одинаковой оценкой
+        """
+        if item.last_verif_year is None or item.serial is None:
+            return None
+        matcher = self.fuzzy.get(item.last_verif_year, self.database)
+        candidates = matcher.candidates(item.serial, item.mitype,
+                                        accept=lambda card: check_verif_date(card, item.verif_ordinal))
+        if len(candidates) == 0:
+            return None
+        if len(candidates) > 1 and candidates[1][1] == candidates[0][1]:
+            logger.info("Для СИ %s нечётким поиском найдено несколько карточек с оценкой %s",
+                        item.serial, candidates[0][1])
+            return None
+        return candidates[0]
+
+    def set_fuzzy_href(self, fuzzy: tuple, coord: tuple):
+        """
+        Функция для записи гиперссылки по карточке, найденной нечётким поиском:
+        ячейка выделяется жёлтым цветом для проверки в ручном режиме
+
+        :param fuzzy: пара (CardFgis, оценка)
+        :param coord: кортеж с координатами ячейки для записи
+        :return:
+        """
+        card, score = fuzzy
+        metrics.inc('match_result', result='fuzzy')
+        logger.info("Для ячейки %s нечётким поиском найдена карточка СИ %s %s, оценка %s",
+                    coord, card.mi_number, card.mi_mitype, score)
+        if not self.writer.check_merged(coord):
+            self.writer.set_href(coord, card.href)
+            self.writer.set_fill(coord, 'yellow')
+
+    def check_result_local_request(self, res_request, coord: tuple, verif_ordinal: int):
         """
         Функция для проверки результатов запроса к локальной БД
         и записи ссылки в ячейку, если она найдена
 
         :param res_request: результаты запроса
+        :param coord: кортеж с координатами ячейки для ссылки
+        :param verif_ordinal: дата последней поверки из файла, порядковый номер дня
         :return:
         """
-        if type(res_request) == list:
+        if isinstance(res_request, localdb.CardChoice):
+            # Карточка уже выбрана из нескольких с той же датой поверки (CardTable.choose)
+            res_card = self.count_ambiguous(res_request.card, res_request.ambiguous)
+            if self.set_href(res_card, coord, verif_ordinal):
+                self.writer.set_id_record((coord[0], COLUMN_ID), res_card.id_record)
+                logger.info(f"Ссылка для {res_card.mi_number} найдена.")
+        elif type(res_request) == list:
             # worksheet.cell(row=coord[0],
             #                column=coord[1]).value = f"Проверить в ручном режиме. Найдено {len(res_request)} значения(й)"
             # xlsx.set_fill(worksheet, coord, 'yellow')
@@ -567,113 +1015,572 @@ def main():
                 # и объект CardFgis по текущему счётчику.
                 # В результате сравниваются две этих даты - если они равны, то True
                 # если не равны, то False
-                if check_verif_date(lst, str_verif_date):
+                if check_verif_date(lst, verif_ordinal):
                     # Если даты из файла и из объекта CardFgis равны, то добавляем этот счётчик
                     # в список ПУ с одинаковыми датами последней поверки
                     lst_same_date.append(lst)
             # Если в результате у нас в списке находится только один счётчик с датой последней поверки
             # совпадающей с тем, что в файле, то устанавливаем ссылку
             if len(lst_same_date) == 1:
-                if set_href(lst_same_date[0], coord, str_verif_date, worksheet):
+                if self.set_href(lst_same_date[0], coord, verif_ordinal):
                     logger.info(f"Ссылка для СИ {lst_same_date[0].mi_number} найдена.")
-                    workbook.set_id_record((coord[0], COLUMN_ID), lst_same_date[0].id_record)
+                    self.writer.set_id_record((coord[0], COLUMN_ID), lst_same_date[0].id_record)
             # Если в списке счётчиков больше 1, то отправляем список на обработку
             # и получения единственно верного объекта CardFgis, если такое возможно
             elif len(lst_same_date) > 1:
-                res_card = lst_same_date_parse(lst_same_date)
-                if set_href(res_card, coord, str_verif_date, worksheet):
-                    workbook.set_id_record((coord[0], COLUMN_ID), res_card.id_record)
+                res_card = self.lst_same_date_parse(lst_same_date)
+                if self.set_href(res_card, coord, verif_ordinal):
+                    self.writer.set_id_record((coord[0], COLUMN_ID), res_card.id_record)
                     logger.info(f"Ссылка для {res_card.mi_number} найдена.")
         else:
             # Если тип res_request == CardFgis, то считаем его единственно верным вариантом
             # и пытаемся записать ссылку на карточку в ячейку
-            if set_href(res_request, coord, str_verif_date, worksheet):
+            if self.set_href(res_request, coord, verif_ordinal):
                 logger.info(f"Ссылка для СИ {res_request.mi_number} найдена.")
 
-    def lst_same_date_parse(lst_same_date: list):
+    def lst_same_date_parse(self, lst_same_date: list):
         """
         Функция для обработки карточек с одинаковыми датами поверки
 
         :param lst_same_date: список с объектами CardFgis
         :return: объект CardFgis
         """
-        tmp_lst_card = {}
-        # for ind, card in enumerate(lst_same_date):
-        #     for i, c in enumerate(lst_same_date[1:]):
-        #         if card.result_docnum[:card.result_docnum.rfind('/')] == c.result_docnum[:c.result_docnum.rfind('/')]:
-        #             tmp_lst_card[ind].append(i)
-        # tmp_lst_card[lst_same_date[0].vri_id] = lst_same_date[0]
-        for ind in range(len(lst_same_date)):
-            try:
-                if lst_same_date[ind].check_equals(lst_same_date[ind + 1]):
-                    tmp_lst_card[lst_same_date[ind].vri_id] = lst_same_date[ind]
-                    tmp_lst_card[lst_same_date[ind + 1].vri_id] = lst_same_date[ind + 1]
-            except IndexError:
-                break
-        keys = {int(item[0][2:]): item[0] for item in tmp_lst_card.items()}
-        max_id = 0
-        for k in list(keys.keys()):
-            if k > max_id:
-                max_id = k
-        return tmp_lst_card[keys[max_id]]
-
-    def set_href(card, coord, str_verif_date, worksheet):
+        res_card, count_ambiguous = localdb.group_same_cards(lst_same_date)
+        return self.count_ambiguous(res_card, count_ambiguous)
+
+    def count_ambiguous(self, res_card, count_ambiguous: int):
+        """
+        Учёт неоднозначного выбора карточки из нескольких с одинаковыми датами поверки
+
+        :param res_card: выбранный объект CardFgis
+        :param count_ambiguous: количество групп карточек, кроме выбранной
+        :return: объект CardFgis
+        """
+        if count_ambiguous > 0:
+            self.stats['ambiguous'] += 1
+            logger.info(f"Для СИ {res_card.mi_number} найдено {count_ambiguous + 1} различных групп карточек "
+                        f"с одинаковой датой поверки, выбрана карточка {res_card.vri_id}")
+        return res_card
+
+    def set_href(self, card, coord, verif_ordinal):
         """
         Функция для записи гиперссылки по СИ в ячейку
 
         :param card: объект CardFgis с информацией по СИ
         :param coord: кортеж с коордиинатами ячейки для записи
-        :param str_verif_date: строка даты последней поверки
-        :param worksheet:
+        :param verif_ordinal: дата последней поверки из файла, порядковый номер дня
         :return: True or False
         """
         if not card == None:
-            verif_date_current_card = datetime.strptime(card.verification_date, "%d.%m.%Y")
-            date_current_card = verif_date_current_card.date()
-            if type(str_verif_date) == datetime:
-                date_verif_current_row = str_verif_date.date()
-            elif type(str_verif_date) == str:
-                date_verif_current_row = datetime.strptime(str_verif_date, "%d.%m.%Y")
-            if date_verif_current_row == date_current_card:
+            if check_verif_date(card, verif_ordinal):
                 href = card.href
 
-                if not workbook.check_merged(coord):
-                    workbook.set_href(coord, href)
-                    workbook.set_fill(coord, 'green')
+                metrics.inc('match_result', result='found')
+                if not self.writer.check_merged(coord):
+                    self.writer.set_href(coord, href)
+                    self.writer.set_fill(coord, 'green')
                     return True
             else:
+                metrics.inc('match_result', result='date_mismatch')
                 href = card.href
-                workbook.set_href(coord, href)
-                workbook.set_fill(coord, 'red')
-                workbook.set_date((coord[0], coord[1] - 2), card.verification_date)
+                self.writer.set_href(coord, href)
+                self.writer.set_fill(coord, 'red')
+                self.writer.set_date((coord[0], coord[1] - 2), card.verification_date)
                 return False
         else:
-            workbook.set_fill(coord, 'blue')
+            metrics.inc('match_result', result='not_found')
+            self.writer.set_fill(coord, 'blue')
             return False
 
-    def prepare_and_write(response: list, row_number: int = 0):
+
+# Соединение с БД и кэши процесса пула, общие для всех заданий процесса (init_worker)
+_worker = {}
+
+
+def init_worker(params: dict):
+    """
+    Функция инициализации процесса пула: настройки логирования, соединение с локальной БД
+    и кэши создаются один раз на процесс, соединение закрывается при завершении процесса
+
+    :param params: словарь с общими параметрами заданий:
+                    'db_parameters' - словарь с данными подключения к локальной БД,
+                    'log_settings' - словарь настроек секции [LOG] (app_logger.read_settings),
+                    'fuzzy', 'fuzzy_threshold', 'recheck_days' - параметры запуска скрипта
+    :return:
+    """
+    app_logger.configure(params['log_settings'])
+    # Функции atexit в процессах multiprocessing не вызываются, поэтому закрытие через Finalize:
+    # сначала соединение с БД, затем очередь логов, чтобы записать оставшиеся записи
+    multiprocessing.util.Finalize(None, app_logger.stop_queue, exitpriority=0)
+    database = connect_database(params['db_parameters'])
+    multiprocessing.util.Finalize(None, database.close, exitpriority=10)
+    _worker['database'] = database
+    _worker['fuzzy'] = fuzzy_match.MatcherCache(params['fuzzy_threshold']) if params['fuzzy'] else None
+    _worker['not_found'] = memo.NotFoundCache(params['recheck_days']) if params['recheck_days'] > 0 else None
+    _worker['lookups'] = memo.LookupMemo()
+    logger.info(f"Процесс {os.getpid()} подготовлен к обработке заданий")
+
+
+def process_task(task: dict):
+    """
+    Функция для обработки части файла в отдельном процессе.
+    Процесс использует собственное соединение с локальной БД (init_worker),
+    а изменения ячеек накапливает в своём объекте CellWriter.
+
+    :param task: словарь с параметрами обработки:
+                    'kinds' - список видов СИ,
+                    'si_table' - объект SiTable с данными по строкам этой части файла,
+                    'writer' - объект CellWriter,
+                    'mode', 'verif_year', 'serial' - параметры запуска скрипта
+    :return: кортеж (объект CellUpdates, словарь статистики, список записей для БД, которые не удалось записать,
+                     объект Metrics с метриками задания)
+    """
+    # Процесс пула может выполнять несколько заданий, метрики собираются по каждому заданию отдельно
+    metrics.REGISTRY.reset()
+    kinds = task['kinds']
+    si_table = task['si_table']
+    writer = task['writer']
+    database = _worker['database']
+    lookups = _worker['lookups']
+    duplicates = lookups.total_duplicates()
+
+    card_table = None
+    if task['mode'] == 'local':
+        lst_serials = [serial_key for si in kinds for serial_key in si_table.kinds[si].serial_keys]
+        card_table = database.get_card_table(lst_serials)
+
+    processor = SiProcessor(database, writer, task['mode'], task['verif_year'], task['serial'], card_table,
+                            fuzzy=_worker['fuzzy'], lookups=lookups, not_found=_worker['not_found'])
+    if task['mode'] == 'local':
+        processor.load_hrefs(si_table, kinds)
+    for kind in kinds:
+        processor.process_kind(kind, si_table)
+    logger.info(f"Обработка видов СИ {kinds} ({len(si_table)} строк) в процессе {os.getpid()} закончена, "
+                f"изменений ячеек - {len(writer.updates)}")
+    processor.stats['duplicates'] = lookups.total_duplicates() - duplicates
+
+    return writer.updates, processor.stats, processor.pending_records, metrics.REGISTRY.snapshot()
+
+
+def make_year_tasks(workbook, si_table, lst_si: list, params: dict):
+    """
+    Функция для формирования заданий на обработку: одно задание на вид СИ и год
+    последней поверки. В задание попадают только строки этого года из индекса годов,
+    поэтому при обработке по всем годам каждый год обрабатывается отдельно
+
+    :param workbook: объект XlsxFile
+    :param si_table: объект SiTable с данными по строкам файла
+    :param lst_si: список видов СИ
+    :param params: словарь с общими параметрами заданий
+    :return: список заданий
+    """
+    tasks = []
+    for kind in lst_si:
+        si_columns = si_table.kinds[kind]
+        years = [params['verif_year']] if params['verif_year'] != 0 else si_columns.years()
+        for year in years:
+            positions = si_columns.positions([year])
+            if len(positions) > 0:
+                tasks.append(dict(params, kinds=[kind], si_table=si_table.take(kind, positions),
+                                  writer=workbook.create_writer()))
+    return tasks
+
+
+def make_row_tasks(workbook, si_table, lst_si: list, params: dict, chunk_rows: int):
+    """
+    Функция для формирования заданий на обработку: одно задание на диапазон строк
+    файла по всем видам СИ
+
+    :param workbook: объект XlsxFile
+    :param si_table: объект SiTable с данными по строкам файла
+    :param lst_si: список видов СИ
+    :param params: словарь с общими параметрами заданий
+    :param chunk_rows: количество строк файла в одном задании
+    :return: список заданий
+    """
+    if len(si_table) == 0:
+        return []
+    tasks = []
+    for start_row, end_row in pass_to_rows(si_table.rows[0], si_table.rows[-1], chunk_rows):
+        table = si_table.select(lst_si).slice_rows(start_row, end_row)
+        if len(table) > 0:
+            tasks.append(dict(params, kinds=lst_si, si_table=table, writer=workbook.create_writer()))
+    return tasks
+
+
+def task_key(task: dict):
+    """
+    Функция для получения ключа задания для контрольной точки:
+    виды СИ, первая и последняя строка задания
+
+    :param task: словарь с параметрами задания
+    :return: кортеж
+    """
+    rows = task['si_table'].rows
+    return (tuple(task['kinds']), rows[0] if len(rows) > 0 else 0, rows[-1] if len(rows) > 0 else 0)
+
+
+def process_parallel(workbook, tasks: list, workers: int, params: dict, checkpoint=None):
+    """
+    Функция для параллельной обработки заданий в нескольких процессах.
+    Изменения ячеек из процессов переносятся в книгу в порядке заданий,
+    как при последовательной обработке.
+
+    :param workbook: объект XlsxFile
+    :param tasks: список заданий, сформированных make_year_tasks или make_row_tasks
+    :param workers: количество процессов
+    :param params: словарь с общими параметрами заданий для инициализации процессов (init_worker)
+    :param checkpoint: объект Checkpoint или None. Результаты завершённых заданий
+                       сохраняются в контрольную точку, при продолжении работы
+                       такие задания повторно не выполняются
+    :return: кортеж (словарь статистики, список записей для БД, которые не удалось записать)
+    """
+    results = [None] * len(tasks)
+    keys = [task_key(task) for task in tasks]
+    if checkpoint is not None:
+        for ind, key in enumerate(keys):
+            results[ind] = checkpoint.tasks.get(key)
+
+    bar = IncrementalBar('Выполнение: ', max=len(tasks))
+    with ProcessPoolExecutor(max_workers=max(1, min(workers, len(tasks))),
+                             initializer=init_worker, initargs=(params,)) as executor:
+        futures = {executor.submit(process_task, task): ind
+                   for ind, task in enumerate(tasks) if results[ind] is None}
+        bar.next(len(tasks) - len(futures))
+        for future in as_completed(futures):
+            ind = futures[future]
+            try:
+                updates, task_stats, task_pending, task_metrics = future.result()
+                results[ind] = (updates, task_stats, task_pending)
+                metrics.REGISTRY.merge(task_metrics)
+                if checkpoint is not None:
+                    checkpoint.add_task(keys[ind], *results[ind], rows=len(tasks[ind]['si_table']))
+            except Exception as err:
+                logger.warning(f"Ошибка при обработке задания в отдельном процессе: {err}")
+            bar.next()
+    bar.finish()
+    # Результаты заданий, завершённых после последнего сохранения по интервалу
+    if checkpoint is not None and checkpoint.interval > 0 and checkpoint.has_unsaved():
+        checkpoint.save()
+
+    stats = {'ambiguous': 0}
+    pending_records = []
+    for task, result in zip(tasks, results):
+        if result is not None:
+            updates, task_stats, task_pending = result
+            workbook.merge_updates(updates)
+            merge_stats(stats, task_stats)
+            pending_records.extend(task_pending)
+        else:
+            logger.warning(f"Нет результатов обработки для видов СИ {task['kinds']} "
+                           f"({len(task['si_table'])} строк)")
+
+    return stats, pending_records
+
+
+def parse_stage_workers(text: str):
+    """
+    Функция для разбора строки с количеством потоков по этапам конвейера
+
+    :param text: строка вида 'fetch=4,write=2'
+    :return: словарь этап -> количество потоков
+    """
+    stage_workers = {}
+    for part in text.split(','):
+        if part.strip() == '':
+            continue
+        try:
+            name, value = part.split('=')
+            name = name.strip()
+            if name not in SiPipeline.STAGES:
+                logger.warning(f"Неизвестный этап конвейера {name}, допустимые этапы - {list(SiPipeline.STAGES)}")
+                continue
+            stage_workers[name] = int(value)
+        except ValueError:
+            logger.warning(f"Не удалось разобрать количество потоков этапа конвейера <{part}>")
+
+    return stage_workers
+
+
+class SiPipeline:
+    """
+    Класс для обработки строк файла конвейером. Этапы обработки строки
+    (планирование запросов, получение данных, подготовка записей, получение
+    идентификаторов, запись в БД, сопоставление) выполняются отдельными потоками,
+    связанными ограниченными очередями. Этапы, которые обращаются к БД, открывают
+    в каждом потоке собственное соединение.
+    Изменения ячеек переносятся в книгу в порядке строк, как при последовательной обработке.
+    """
+    # Этапы конвейера и признак необходимости соединения с БД
+    STAGES = {'plan': False,
+              'fetch': True,
+              'normalize': False,
+              'resolve': True,
+              'write': True,
+              'match': False}
+
+    def __init__(self, processor: SiProcessor, workbook, db_parameters: dict, stage_workers: dict = None,
+                 queue_size: int = 100):
+        """
+        Конструктор класса
+
+        :param processor: объект SiProcessor с параметрами обработки, в него же
+                          собираются статистика и записи, которые не удалось записать в БД
+        :param workbook: объект XlsxFile
+        :param db_parameters: словарь с данными подключения к локальной БД
+        :param stage_workers: словарь этап -> количество потоков, по умолчанию по одному потоку
+        :param queue_size: максимальное количество строк в каждой очереди
+        """
+        self.processor = processor
+        self.workbook = workbook
+        self.db_parameters = db_parameters
+        self.stage_workers = stage_workers or {}
+        self.queue_size = queue_size
+        self._local = threading.local()
+        self._processors = []
+        self._lock = threading.Lock()
+        self._waiting = {}
+        self._next_seq = 0
+        self._bar = None
+
+    def _get_processor(self, need_db: bool):
+        """
+        Метод для получения объекта SiProcessor текущего потока
+
+        :param need_db: нужно ли соединение с БД
+        :return: объект SiProcessor
+        """
+        processor = getattr(self._local, 'processor', None)
+        if processor is None:
+            database = connect_database(self.db_parameters) if need_db else None
+            processor = SiProcessor(database, None, self.processor.mode, self.processor.verif_year,
+                                    self.processor.serial, self.processor.card_table,
+                                    fuzzy=self.processor.fuzzy, href_table=self.processor.href_table,
+                                    lookups=self.processor.lookups, not_found=self.processor.not_found)
+            self._local.processor = processor
+            with self._lock:
+                self._processors.append(processor)
+        return processor
+
+    def _stage_func(self, name: str):
+        """
+        Метод для получения функции этапа конвейера
+
+        :param name: наименование этапа
+        :return: функция
         """
-        Функция для подготовки к записи в локальную БД данных,
-        полученных из ФГИС.
+        need_db = SiPipeline.STAGES[name]
 
-        :param response: список со словарями
-        :param row_number: номер строки файла Excel, которая в данный момент обрабатывается
+        def run_stage(item: RowItem):
+            with metrics.timer('row_stage', stage=name):
+                getattr(self._get_processor(need_db), f"{name}_row")(item)
+
+        return run_stage
+
+    def _match(self, item: RowItem):
+        """
+        Этап сопоставления: изменения ячеек и статистика собираются отдельно по каждой строке
+
+        :param item: объект RowItem
         :return:
         """
-        for item in response:
-            logger.info(f"Item = {item}")
-            if item is not None:
-                dict_for_write = check_dict_for_write(format_dict_for_write(item, row_number), database)
-                logger.info(f"dict_for_write = {dict_for_write}")
-                # Попытка записи в локальную БД
-                if dict_for_write is not None:
-                    try:
-                        database.write_metrology(dict_for_write)
-                    except Exception as err:
-                        logger.warning(f"{err.__str__()}")
-                        logger.warning(
-                            f"Не удалось записать данные в БД <{str(dict_for_write)}>")
-        logger.info(f"Обработан СИ с номером - {current_serial}")
+        processor = self._get_processor(SiPipeline.STAGES['match'])
+        processor.writer = self.workbook.create_writer()
+        processor.stats = {'ambiguous': 0}
+        with metrics.timer('row_stage', stage='match'):
+            processor.match_row(item)
+        item.updates = processor.writer.updates
+        item.stats = processor.stats
+
+    def _apply(self, item: RowItem):
+        """
+        Приёмник конвейера: переносит изменения ячеек в книгу в порядке строк
+
+        :param item: объект RowItem
+        :return:
+        """
+        self._waiting[item.seq] = item
+        while self._next_seq in self._waiting:
+            item = self._waiting.pop(self._next_seq)
+            self._next_seq += 1
+            if item.updates is not None:
+                self.workbook.merge_updates(item.updates)
+            if item.stats is not None:
+                merge_stats(self.processor.stats, item.stats)
+            if self._bar is not None:
+                self._bar.next()
+            checkpoint = self.processor.checkpoint
+            if checkpoint is not None and checkpoint.mark(item.kind, item.row):
+                checkpoint.save(self.workbook.updates, self.processor.stats, self.pending_records())
+
+    def pending_records(self):
+        """
+        Метод для получения записей для БД, которые не удалось записать, по всем потокам
+
+        :return: список записей
+        """
+        with self._lock:
+            processors = list(self._processors)
+        return self.processor.pending_records + [record for processor in processors
+                                                 for record in processor.pending_records]
+
+    def items(self, si_table, lst_si: list):
+        """
+        Генератор строк для обработки конвейером, строки, обработанные до контрольной точки,
+        пропускаются
+
+        :param si_table: объект SiTable с данными по строкам файла
+        :param lst_si: список видов СИ
+        :return: объекты RowItem
+        """
+        seq = 0
+        checkpoint = self.processor.checkpoint
+        for kind in lst_si:
+            logger.info(f"Начинаем обход строк файла для вида СИ: {kind}")
+            for ind in self.processor.select_positions(kind, si_table):
+                current_row = si_table.rows[ind]
+                if checkpoint is None or not checkpoint.is_done(kind, current_row):
+                    yield RowItem(seq, kind, si_table, ind)
+                    seq += 1
+
+    def run(self, si_table, lst_si: list):
+        """
+        Метод для обработки строк файла конвейером
+
+        :param si_table: объект SiTable с данными по строкам файла
+        :param lst_si: список видов СИ
+        :return: количество обработанных строк
+        """
+        stages = []
+        for name in SiPipeline.STAGES:
+            func = self._match if name == 'match' else self._stage_func(name)
+            stages.append(pipeline.Stage(name, func, self.stage_workers.get(name, 1)))
+
+        self._bar = IncrementalBar('Выполнение: ', max=self.processor.count_rows(si_table, lst_si))
+        try:
+            count = pipeline.Pipeline(stages, self.queue_size).run(self.items(si_table, lst_si), self._apply)
+        finally:
+            self._bar.finish()
+            self.processor.pending_records = self.pending_records()
+            self.close()
+        return count
+
+    def close(self):
+        """
+        Метод для закрытия соединений с БД, открытых потоками этапов конвейера
+
+        :return:
+        """
+        with self._lock:
+            processors = list(self._processors)
+        for processor in processors:
+            if processor.database is not None:
+                processor.database.close()
+                processor.database = None
+
+
+def main():
+    """
+    Основная функция скрипта.
+    Обрабатывается заданный файл Excel и сохраняет результаты работы.
+
+    :return:
+    """
+    START_ROW = 13
+    argv_parser = parse_args()
+    namespace_argv = argv_parser.parse_args(sys.argv[1:])
+    namefile_xlsx = namespace_argv.namefile
+    verif_year = namespace_argv.years
+    keyword_si = namespace_argv.keyword
+    mode = namespace_argv.mode
+    serial = namespace_argv.serial
+    start = namespace_argv.START
+    namefile_setting = namespace_argv.setfile
+    workers = namespace_argv.workers
+    chunk_rows = namespace_argv.chunk
+    use_pipeline = namespace_argv.pipeline
+    stage_workers = parse_stage_workers(namespace_argv.stage_workers)
+    queue_size = namespace_argv.queue_size
+    resume = namespace_argv.resume
+    namefile_metrics = namespace_argv.metrics
+    namefile_checkpoint = namespace_argv.checkpoint or namefile_xlsx + '.checkpoint'
+    checkpoint_every = namespace_argv.checkpoint_every
+    use_fuzzy = namespace_argv.fuzzy
+    fuzzy_threshold = namespace_argv.fuzzy_threshold
+    recheck_days = namespace_argv.recheck_days
+
+    # =========================================================================================#
+
+    # Настройки логирования (асинхронная запись, уровни по модулям) из секции [LOG],
+    # те же настройки передаются в процессы пула (init_worker)
+    log_settings = app_logger.read_settings(namefile_setting)
+    app_logger.configure(log_settings)
+    logger.info(f"Запуск скрипта {__name__}, дата и время: {datetime.now()}")
+    # Читаем файл с параметрами подключения к локальной БД
+    local_db_parameters = read_settings_file(namefile_setting)
+    # Устанавливаем соединение с БД
+    database = connect_database(local_db_parameters)
+
+    # ==========================================================================================#
+
+    # Проверяем введённые параметры на корректность,
+    # недопустим режим unknow и год 0
+    if verif_year != 0 and mode == 'unknow':
+        print(f"Заданы некорректные параметры запуска: при использовании режима 'unknow' не нужно задавать год."
+              f"Прекращаем работу...")
+        logger.warning(
+            f"Заданы некорректные параметры запуска: mode = {mode}, verif_year = {verif_year}.\nПрекращаем работу.")
+        sys.exit()
+    if verif_year == 0 and (mode in ['fgis', 'local']):
+        joke_answer = input(f"Вы не задали год для обработки, но при этом выбрали режим {mode}."
+                            f"В таком случае будет использован текущий год - {datetime.now().year}? (Y/n): ")
+        if joke_answer.lower() == 'n':
+            logger.warning(f"Пользователь отказался от дальнейшего выполнения. Прекращаем работу и по домам!")
+            print("Ути, какие мы ранимые...ну тогда всё.")
+            sys.exit()
+        else:
+            verif_year = datetime.now().year
+    if start != 0:
+        START_ROW = start
+    else:
+        pass
+
+    logger.info(f"Парсим файл Excel со следующими исходными данными: имя файла - {namefile_xlsx}, "
+                f"год поверки - {verif_year}, СИ для парсинга - {keyword_si}")
+
+    # Лист читается потоком, книга целиком загружается только для записи
+    workbook = xlsx.XlsxFile(namefile_xlsx, read_only=True)
+
+    # Данные по всем видам СИ считываются за один проход по строкам листа
+    lst_si = keyword_si.split(sep=" ")
+    si_table = workbook.extract_si_table(START_ROW, lst_si)
+
+    # Для режима local загружаем карточки по всем серийным номерам файла
+    # одним проходом, чтобы не обращаться к БД по каждой строке.
+    # Если загрузить не удалось, то работаем по-старому - запросом на каждую строку.
+    # При параллельной обработке карточки загружает каждый процесс по своей части файла
+    parallel = workers > 1 and (chunk_rows > 0 or len(lst_si) > 1 or verif_year == 0)
+    card_table = None
+    if mode == 'local' and not parallel:
+        lst_serials = [serial_key for si in lst_si for serial_key in si_table.kinds[si].serial_keys]
+        card_table = database.get_card_table(lst_serials)
+
+    def check_si_on_localdb(si_inform: dict):
+        """
+        Проверяем наличие в локальной БД информации по текущему СИ
+
+        :param si_inform: словарь с данными по СИ:
+                            'serial' - серийный номер СИ,
+                            'type' - тип СИ,
+                            'verif_date' - дата поверки
+        :return: True or False
+        """
+        # Получаем из словаря серийный номер
+        # тип СИ, дату поверки и пытаемся получить из БД данные
+        # по этим данным
+        serial = si_inform['serial']
+        type = si_inform['type']
+        verif_date = si_inform['verif_date']
 
     # =============================================================================#
     # Функции по режимам работы (добавить), пока не вводить в строй
@@ -743,132 +1650,104 @@ def main():
             print(f"Запуск work_on_change_serial для режима работы {mode}")
             # work_on_change_serial()
     # ============================================================================#
-    bar = IncrementalBar('Выполнение: ', max=(row_end - START_ROW) * len(keyword_si.split(sep=" ")) + (
-                1 * len(keyword_si.split(sep=" "))))
-
-    # Основной цикл прохода по введённым СИ
-    for current_si in keyword_si.split(sep=" "):
-        # Нужно получить номера столбцов для соответствующего вида СИ
-        # Столбец типа СИ
-        type_col = COLUMNS_SI[current_si]['type']
-        # Столбец серийного номера СИ
-        serial_col = COLUMNS_SI[current_si]['serial']
-        # Столбец даты последней поверки
-        verif_date_col = COLUMNS_SI[current_si]['verif_date']
-        # Столбец даты следующей поверки
-        valid_date_col = COLUMNS_SI[current_si]['valid_date']
-        # Столбец для ссылки на корточку СИ
-        href_col = COLUMNS_SI[current_si]['href']
-        logger.info(f"Начинаем обход строк файла для вида СИ: {current_si}")
-
-        for current_row in range(START_ROW, row_end + 1):
-            bar.next()
-            inform_si = workbook.get_inform_si(current_si, current_row)
-            logger.info(f"Дата последней поверки для {current_si} и строки №{current_row} - {inform_si['verif_date']}")
+    # Контрольная точка: последние обработанные строки по видам СИ, несохранённые изменения ячеек
+    # и записи для БД, которые не удалось записать. С --resume обработка продолжается с неё
+    state = None
+    if checkpoint_every > 0 or resume:
+        state = checkpoint.Checkpoint(namefile_checkpoint,
+                                      {'namefile': os.path.abspath(namefile_xlsx),
+                                       'mode': mode,
+                                       'verif_year': verif_year,
+                                       'kinds': lst_si,
+                                       'start_row': START_ROW,
+                                       'serial': serial},
+                                      checkpoint_every)
+        if resume and state.load():
+            print(f"Продолжаем обработку с контрольной точки {namefile_checkpoint}")
+        elif os.path.isfile(namefile_checkpoint):
+            logger.info(f"Контрольная точка {namefile_checkpoint} будет перезаписана")
+
+    fuzzy = fuzzy_match.MatcherCache(fuzzy_threshold) if use_fuzzy and mode == 'local' else None
+    # Отрицательный кэш запросов во ФГИС, если в локальной БД есть его таблица
+    not_found = None
+    if recheck_days > 0 and mode != 'local':
+        if 'tbfgis_not_found' in (database.tables or []):
+            not_found = memo.NotFoundCache(recheck_days)
+        else:
+            logger.warning("В локальной БД нет таблицы tbfgis_not_found, отрицательный кэш запросов во ФГИС "
+                           "не используется. Для создания таблицы выполните скрипты 28 и 29 из scripts/create")
+    processor = SiProcessor(database, workbook, mode, verif_year, serial, card_table, state, fuzzy,
+                            not_found=not_found)
+    # Гиперссылки, которые уже есть в файле, проверяются одним запросом
+    if mode == 'local' and not parallel:
+        processor.load_hrefs(si_table, lst_si)
+    if state is not None and not parallel:
+        workbook.merge_updates(state.updates)
+        merge_stats(processor.stats, state.stats)
+        processor.pending_records = list(state.pending_records)
+        processor.write_pending()
+
+    if parallel:
+        # Задания обрабатываются в отдельных процессах (у каждого процесса своё соединение с БД):
+        # при заданном --chunk - по диапазонам строк, иначе - по видам СИ и годам поверки
+        task_params = {'db_parameters': local_db_parameters,
+                       'log_settings': log_settings,
+                       'mode': mode,
+                       'verif_year': verif_year,
+                       'serial': serial,
+                       'fuzzy': fuzzy is not None,
+                       'fuzzy_threshold': fuzzy_threshold,
+                       'recheck_days': not_found.recheck_days if not_found is not None else 0}
+        if chunk_rows > 0:
+            tasks = make_row_tasks(workbook, si_table, lst_si, task_params, chunk_rows)
+        else:
+            tasks = make_year_tasks(workbook, si_table, lst_si, task_params)
+        logger.info(f"Параллельная обработка видов СИ {lst_si}, заданий - {len(tasks)}, "
+                    f"количество процессов - {workers}")
+        stats, processor.pending_records = process_parallel(workbook, tasks, workers, task_params, state)
+        processor.write_pending()
+    elif use_pipeline:
+        logger.info(f"Обработка конвейером, потоки по этапам - {stage_workers}, размер очередей - {queue_size}")
+        SiPipeline(processor, workbook, local_db_parameters, stage_workers, queue_size).run(si_table, lst_si)
+        stats = processor.stats
+    else:
+        bar = IncrementalBar('Выполнение: ', max=processor.count_rows(si_table, lst_si))
 
-            # Пытаемся получить год поверки из полученной строки
-            # даты последней поверки, если значение ячейки не соответствует
-            # исключениям в словаре
+        # Основной цикл прохода по введённым СИ
+        for current_si in lst_si:
+            processor.process_kind(current_si, si_table, bar)
+        bar.finish()
+        stats = processor.stats
 
-            if inform_si['verif_date'] is None:
-                last_verif_year = None
-                valid_year = None
-            else:
-                last_verif_year = inform_si['verif_date'].year
-                # print(type(inform_si['valid_date']))
-                if type(inform_si['valid_date']) is date:
-                    valid_year = inform_si['valid_date'].year
-                else:
-                    # print(f"type: {type(inform_si['valid_date'])}, type_verif: {type(inform_si['verif_date'])}")
-                    # print(type(inform_si['valid_date']) == date)
-                    valid_year = None
-
-            # Проверяем год для обработки из параметров скрипта
-            # для дальнейших действий
-            if verif_year == 0 and valid_year != None:
-                # Действия для проверки СИ по всем годам,
-                # начиная с года последней поверки и до текущего года
-                current_serial = inform_si['serial']
-                mitype = inform_si['type']
-                if current_serial != None and mitype != None and last_verif_year != None:
-                    # change_date = database.get_change_date()
-                    # Цикл по годам текущего СИ
-                    for year in range(last_verif_year, datetime.now().year + 1):
-                        fgis_request({'current_si': current_si,
-                                      'current_serial': current_serial,
-                                      'last_verif_year': last_verif_year,
-                                      'mitype': mitype})
-            elif verif_year == last_verif_year:
-                # Действия для проверки по конкретному году
-                current_serial = inform_si['serial']
-                mitype = inform_si['type']
-                flag_href_style = inform_si['flag_href_style']
-                href_value = inform_si['href_value']
-                id_record = inform_si['id']
-
-                # Провряем режим работы и выбираем стезю...блядь
-                match mode:
-                    case 'fgis':
-                        if serial != '' and serial != current_serial:
-                            logger.info(
-                                f"Задан конкретный номер СИ для поиска - {serial}. Текущий номер СИ - {current_serial}"
-                                f" не совпадает с введённым, пропускаем его.")
-                        else:
-                            logger.info(f"Готовим запрос в БД ФГИС по СИ - {current_si}, №{current_serial}")
-                            response = fgis_request({'current_si': current_si,
-                                                     'current_serial': current_serial,
-                                                     'last_verif_year': last_verif_year,
-                                                     'mitype': mitype})
-                            # Проверяем результаты запроса, получено ли вообще что-нибудь
-                            # Если количество элементов списка в ответе больше 0, то есть
-                            # что-то получили
-                            if len(response) > 0:
-                                logger.info(f"Ок, получили данные для номера СИ - {current_serial}")
-                                if len(response) > 1:
-                                    prepare_and_write(response, 0)
-                                elif len(response) == 1:
-                                    prepare_and_write(response, current_row)
-
-                    case 'local':
-                        str_verif_date = workbook.get_value((current_row, verif_date_col))
-
-                        if not flag_href_style:
-                            # Ссылки нет
-                            # не забыть про идентификатор записи в БД и номер строки файла
-                            # ...
-                            # ...
-                            # ...
-                            res_local_request = local_request(current_serial, current_si, last_verif_year, mitype,
-                                                              str_verif_date)
-                            check_result_local_request(res_local_request, (current_row, href_col), str_verif_date)
-                        else:
-                            # Проверить валидность гиперссылки для начала
-                            # Если ссылка валидна, то выделить одним цветом, если нет, то другим
-                            # Учесть номер идентификатор записи и номер строки в БД
-                            # ...
-                            # ...
-                            # ...
-                            if database.check_valid_href(href_value):
-                                cur_id_record = database.get_id_for_href(href_value)
-                                if not id_record is None:
-                                    if cur_id_record == id_record:
-                                        workbook.set_fill((current_row, href_col), 'orange')
-                                else:
-                                    workbook.set_fill((current_row, href_col), 'orange')
-                                    # workbook.set_id_record((current_row, COLUMN_ID), cur_id_record)
-                            else:
-                                workbook.set_fill((current_row, href_col), 'red_brown')
-                    case 'change_serial':
-                        if str(current_serial)[0] == '0':
-                            continue
-                        elif str(current_serial)[0] == '1':
-                            current_serial = '0' + str(current_serial)
-                            workbook._write_value((current_row, COLUMNS_SI[current_si]['serial']), current_serial)
-            elif verif_year != last_verif_year and verif_year == valid_year:
-                logger.info(f"Пропускаем строку {current_row}, так как не совпадает год.")
-
-    workbook.save()
-    bar.finish()
+    if workbook.save() and state is not None:
+        if len(processor.pending_records) == 0:
+            state.remove()
+        else:
+            # Все строки обработаны, но часть данных не записана в БД:
+            # при запуске с --resume будет только повторная попытка записи
+            processor.save_checkpoint()
+            logger.warning(f"Не удалось записать в БД {len(processor.pending_records)} записей, "
+                           f"они сохранены в контрольной точке {namefile_checkpoint}")
+            print(f"Не удалось записать в БД {len(processor.pending_records)} записей, "
+                  f"для повторной попытки запустите скрипт с параметром --resume")
+    if not parallel:
+        stats['duplicates'] = stats.get('duplicates', 0) + processor.lookups.total_duplicates()
+    if stats.get('duplicates', 0) > 0:
+        logger.info(f"Повторных запросов по одинаковым СИ не выполнялось: {stats['duplicates']}")
+        print(f"Повторных запросов по одинаковым СИ не выполнялось: {stats['duplicates']}")
+    if stats['ambiguous'] > 0:
+        logger.info(f"Строк с неоднозначным выбором карточки: {stats['ambiguous']}")
+        print(f"Строк с неоднозначным выбором карточки: {stats['ambiguous']}")
+
+    # Сводка по метрикам работы
+    lst_summary = metrics.REGISTRY.summary()
+    logger.info("Метрики работы:\n" + "\n".join(lst_summary))
+    print("Метрики работы:")
+    for line in lst_summary:
+        print(f"  {line}")
+    if namefile_metrics != '':
+        metrics.REGISTRY.write(namefile_metrics)
+    app_logger.stop_queue()
 
 
 if __name__ == "__main__":
@@ -1,50 +1,62 @@
-class TypeParseSi:
-    __LST_SEP = [' ', '-', '/', '.']
-    def __init__(self, type_from_card, type_from_file):
-        self.type_from_card = type_from_card
-        self.original_type = type_from_file
-        self.split_type()
+from functools import lru_cache
 
-    def split_type(self):
-        self.dict_split = {'separator': {sep: {} for sep in TypeParseSi.__LST_SEP}}
+# Разделители частей типа СИ, в порядке приоритета при выборе разделителя
+LST_SEP = (' ', '-', '/', '.')
 
-        for sep in TypeParseSi.__LST_SEP:
-            self.dict_split['separator'][sep]['value'] = self.original_type.split(sep=sep)
-            self.dict_split['separator'][sep]['type_value'] = type(self.dict_split['separator'][sep]['value'])
-            self.dict_split['separator'][sep]['lenght_value'] = len(self.dict_split['separator'][sep]['value'])
 
-        separatop, max_len = self.__get_max_len(self.dict_split)
-        self.dict_split['max_lenght'] = {'separator': separatop,
-                                 'lenght': max_len}
+@lru_cache(maxsize=4096)
+def compile_type(type_from_file: str):
+    """
+    Подготовка типа СИ из файла к сопоставлению: тип делится по разделителю,
+    дающему больше всего частей, к частям добавляются их объединение
+    через другой разделитель и исходный тип. Результат кэшируется по типу.
 
-    def __get_max_len(self, dct):
-        tmp = {sep: dct['separator'][sep]['lenght_value'] for sep in TypeParseSi.__LST_SEP}
-        key, max = None, 0
-        for item in tmp.items():
-            if item[1] > max:
-                max = item[1]
-                key = item[0]
-        return  key, max
+    :param type_from_file: тип СИ из файла
+    :return: кортеж образцов для поиска в типе из карточки, без повторов,
+             в порядке ключей словаря TypeParseSi.parse
+    """
+    lst_split = [type_from_file.split(sep) for sep in LST_SEP]
+    ind = max(range(len(LST_SEP)), key=lambda i: (len(lst_split[i]), -i))
+    lst = lst_split[ind]
+    tmp_pattern = " ".join(lst) if LST_SEP[ind] == "-" else "-".join(lst)
+    return tuple(dict.fromkeys(lst + [tmp_pattern, type_from_file]))
 
-    def search_match(self, pattern, text):
-        return True if text.find(pattern) != -1 else False
 
-    def parse(self):
-        dict_result_parse = {}
-        if self.dict_split != None:
-            sep = self.dict_split['max_lenght']['separator']
-            lst = self.dict_split['separator'][sep]['value']
-            for i in lst:
-                if self.search_match(i, self.type_from_card):
-                    dict_result_parse[i] = True
-                else:
-                    dict_result_parse[i] = False
-            tmp_pattern = " ".join(lst) if sep == "-" else "-".join(lst)
-            dict_result_parse[tmp_pattern] = True if self.search_match(tmp_pattern, self.type_from_card) else False
-            dict_result_parse[self.original_type] = True if self.search_match(self.original_type, self.type_from_card) else False
-
-        return dict_result_parse
+@lru_cache(maxsize=65536)
+def match_type(type_from_card: str, type_from_file: str):
+    """
+    Сопоставление типа из карточки с типом из файла, результат кэшируется по паре типов
+
+    :param type_from_card: тип СИ из карточки
+    :param type_from_file: тип СИ из файла
+    :return: кортеж пар (образец, найден ли образец в типе из карточки)
+    """
+    return tuple((pattern, pattern in type_from_card) for pattern in compile_type(type_from_file))
+
+
+@lru_cache(maxsize=65536)
+def match_any(type_from_card: str, type_from_file: str):
+    """
+    Проверка, что в типе из карточки найден хотя бы один образец типа из файла
 
+    :param type_from_card: тип СИ из карточки
+    :param type_from_file: тип СИ из файла
+    :return: True or False
+    """
+    return any(pattern in type_from_card for pattern in compile_type(type_from_file))
+
+
+class TypeParseSi:
+    def __init__(self, type_from_card, type_from_file):
+        self.type_from_card = type_from_card
+        self.original_type = type_from_file
+
+    def parse(self):
+        """
+        Словарь образец -> найден ли образец в типе из карточки,
+        результат берётся из кэша сопоставлений match_type
+        """
+        return dict(match_type(self.type_from_card, self.original_type))
 
 
 def main():
@@ -0,0 +1,156 @@
+#!/usr/bin/python3
+"""
+Модуль для обработки данных конвейером: последовательностью этапов,
+связанных ограниченными по размеру очередями.
+
+Каждый этап выполняется своим набором потоков, количество потоков задаётся
+для каждого этапа отдельно. Если следующий этап не успевает, очередь перед ним
+заполняется и предыдущий этап ждёт, поэтому в памяти одновременно находится
+не больше заданного количества элементов.
+"""
+
+# Блок импорта
+import threading
+from queue import Queue
+import app_logger
+
+# Конец блока импорта
+
+logger = app_logger.get_logger(__name__, 'pipeline_log.log')
+
+# Признак окончания данных в очереди
+_STOP = object()
+
+
+class Stage:
+    """
+    Этап конвейера
+    """
+
+    def __init__(self, name: str, func, workers: int = 1):
+        """
+        Конструктор класса
+
+        :param name: наименование этапа
+        :param func: функция этапа, принимает элемент и изменяет его,
+                     после чего элемент передаётся следующему этапу
+        :param workers: количество потоков этапа
+        """
+        self.name = name
+        self.func = func
+        self.workers = max(1, workers)
+
+
+class Pipeline:
+    """
+    Конвейер из этапов, связанных ограниченными очередями.
+    Элементы из источника проходят все этапы по порядку и передаются
+    в функцию-приёмник, которая выполняется в вызывающем потоке.
+    Порядок элементов на выходе не гарантируется, если у этапа больше одного потока.
+    """
+
+    def __init__(self, stages: list, queue_size: int = 100):
+        """
+        Конструктор класса
+
+        :param stages: список объектов Stage
+        :param queue_size: максимальное количество элементов в каждой очереди
+        """
+        self.stages = stages
+        self.queue_size = max(1, queue_size)
+        self._queues = []
+        self._finished = []
+        self._lock = threading.Lock()
+
+    def run(self, source, sink):
+        """
+        Метод для запуска конвейера и ожидания его завершения
+
+        :param source: итерируемый источник элементов
+        :param sink: функция-приёмник обработанных элементов
+        :return: количество элементов, переданных в приёмник
+        """
+        self._queues = [Queue(maxsize=self.queue_size) for _ in range(len(self.stages) + 1)]
+        self._finished = [0] * len(self.stages)
+
+        threads = [threading.Thread(target=self._produce, args=(source,), name='pipeline-source', daemon=True)]
+        for index, stage in enumerate(self.stages):
+            for number in range(stage.workers):
+                threads.append(threading.Thread(target=self._work, args=(index,),
+                                                name=f"pipeline-{stage.name}-{number}", daemon=True))
+        for thread in threads:
+            thread.start()
+        logger.info(f"Конвейер запущен: этапы {[(stage.name, stage.workers) for stage in self.stages]}, "
+                    f"размер очередей - {self.queue_size}")
+
+        count = 0
+        output = self._queues[-1]
+        while True:
+            item = output.get()
+            if item is _STOP:
+                break
+            try:
+                sink(item)
+            except Exception as err:
+                logger.warning(f"Ошибка при обработке элемента приёмником конвейера: {err}")
+            count += 1
+
+        for thread in threads:
+            thread.join()
+        logger.info(f"Конвейер завершён, обработано элементов - {count}")
+        return count
+
+    def _stop_count(self, index: int):
+        """
+        Количество признаков окончания для очереди с номером index:
+        по одному на каждый поток этапа, который читает эту очередь
+
+        :param index: номер очереди
+        :return: количество
+        """
+        return self.stages[index].workers if index < len(self.stages) else 1
+
+    def _produce(self, source):
+        """
+        Метод потока-источника: передаёт элементы источника в первую очередь
+
+        :param source: итерируемый источник элементов
+        :return:
+        """
+        try:
+            for item in source:
+                self._queues[0].put(item)
+        except Exception as err:
+            logger.warning(f"Ошибка при чтении источника конвейера: {err}")
+        finally:
+            for _ in range(self._stop_count(0)):
+                self._queues[0].put(_STOP)
+
+    def _work(self, index: int):
+        """
+        Метод потока этапа: берёт элементы из входной очереди, обрабатывает
+        и передаёт в выходную. Последний завершившийся поток этапа передаёт
+        признаки окончания следующему этапу.
+
+        :param index: номер этапа
+        :return:
+        """
+        stage = self.stages[index]
+        queue_in = self._queues[index]
+        queue_out = self._queues[index + 1]
+        while True:
+            item = queue_in.get()
+            if item is _STOP:
+                break
+            try:
+                stage.func(item)
+            except Exception as err:
+                logger.warning(f"Ошибка на этапе {stage.name} конвейера: {err}")
+            queue_out.put(item)
+
+        with self._lock:
+            self._finished[index] += 1
+            last = self._finished[index] == stage.workers
+        if last:
+            for _ in range(self._stop_count(index + 1)):
+                queue_out.put(_STOP)
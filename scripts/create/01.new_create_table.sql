@@ -1,6 +1,6 @@
 create table if not exists tbtitle (id_title serial not null primary key, title text);
 create table if not exists tbmodification (id_mod serial not null primary key, modification text);
-create table if not exists tbtype (id_type serial not null primary key, type_title text, type_number text);
+create table if not exists tbtype (id_type serial not null primary key, type_title text, type_number text, type_key text);
 create table if not exists tborgmetrology (id_org serial not null primary key, name_org text);
 create table if not exists tbmetrology 
 	(id serial not null primary key,
@@ -18,4 +18,5 @@ create table if not exists tbmetrology
 	href text,
 	change_date date,
 	change_flag integer,
-	rows_number integer);
\ No newline at end of file
+	rows_number integer,
+	serial_key text);
\ No newline at end of file
@@ -1,7 +1,7 @@
 --      tbtitle
-create procedure add_title(title_si text)
+create or replace procedure add_title(title_si text)
 as $$
 begin
-insert into tbtitle (title) values (title_si);
+insert into tbtitle (title) values (title_si) on conflict do nothing;
 end;
 $$ language plpgsql;
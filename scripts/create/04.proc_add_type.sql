@@ -1,6 +1,7 @@
 --    tbtype
 create or replace procedure add_type(type_t text, type_n text) as $$
 begin 
-	insert into tbtype (type_title, type_number) values (type_t, type_n);
+	insert into tbtype (type_title, type_number, type_key) values (type_t, type_n, normalize_type_key(type_t))
+		on conflict do nothing;
 end;
 $$ language plpgsql;
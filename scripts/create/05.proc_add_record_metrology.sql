@@ -28,7 +28,8 @@ begin
 							href,
 							change_date,
 							change_flag,
-							rows_number) 
+							rows_number,
+							serial_key) 
 			values (mit_number, 
 					modif, 
 					serial, 
@@ -43,6 +44,9 @@ begin
 					hyperlink, 
 					ch_d, 
 					ch_f,
-					r_n);
+					r_n,
+					normalize_serial_key(serial))
+	--   vri_id       (   30)
+	on conflict do nothing;
 end;
 $$ language plpgsql;
\ No newline at end of file
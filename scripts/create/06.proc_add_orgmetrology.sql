@@ -1,6 +1,6 @@
 --    tborgmetrology
 create or replace procedure add_org_metrology(organization text) as $$
 begin
-	insert into tborgmetrology (name_org) values (organization);
+	insert into tborgmetrology (name_org) values (organization) on conflict do nothing;
 end;
 $$ language plpgsql;
@@ -1,6 +1,6 @@
 --    tbmodification
 create or replace procedure add_modification(modif text) as $$
 begin
-	insert into tbmodification (modification) values (modif);
+	insert into tbmodification (modification) values (modif) on conflict do nothing;
 end;
 $$ language plpgsql;
@@ -1,8 +1,8 @@
 --       tbmetrology
---    hyperlink
+--    hyperlink (  vri_id  )
 create or replace function get_id_for_href(hyperlink text) returns int as $$
 begin 
-	return (select id from tbmetrology t where href = hyperlink);
+	return (select min(id) from tbmetrology t where vri_id = href_vri_id(hyperlink));
 end;
 $$ language plpgsql;
 
@@ -0,0 +1,2 @@
+--           
+create index if not exists idx_tbmetrology_serial_key_mitype on tbmetrology (serial_key, mitype);
@@ -0,0 +1,2 @@
+--       (    dd.mm.YYYY)
+create index if not exists idx_tbmetrology_verif_year on tbmetrology (right(verif_date, 4));
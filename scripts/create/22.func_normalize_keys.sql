@@ -0,0 +1,20 @@
+--         ,
+-- normalize_serial  normalize_type  fuzzy_match:
+-- ,  ,   ,  
+--  ,    -   
+create or replace function normalize_key(value text) returns text as $$
+	select translate(upper(regexp_replace(value, '[[:space:]' || chr(160) || ']+', '', 'g')),
+					 'ABCEHKMOPTXY' || chr(8208) || chr(8209) || chr(8210) || chr(8211) || chr(8212) || chr(8722),
+					 '------');
+$$
+language sql immutable;
+
+create or replace function normalize_serial_key(value text) returns text as $$
+	select coalesce(nullif(ltrim(normalize_key(value), '0'), ''), left(normalize_key(value), 1));
+$$
+language sql immutable;
+
+create or replace function normalize_type_key(value text) returns text as $$
+	select normalize_key(value);
+$$
+language sql immutable;
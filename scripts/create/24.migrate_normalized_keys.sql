@@ -0,0 +1,14 @@
+--  :        ,
+--       .
+--    ,    normalize_key
+--   .
+--  ,     :
+--22, 24 ( ), 27, 15 ( href_vri_id  27), 18, 19, 20, 21, 23,
+--25, 26, 28, 29, 30, 31,  03-07,      
+--    
+alter table tbmetrology add column if not exists serial_key text;
+alter table tbtype add column if not exists type_key text;
+update tbmetrology set serial_key = normalize_serial_key(si_number);
+update tbtype set type_key = normalize_type_key(type_title);
+create index if not exists idx_tbmetrology_serial_key_mitype on tbmetrology (serial_key, mitype);
+create index if not exists idx_tbtype_type_key on tbtype (type_key);
@@ -0,0 +1,11 @@
+--,     tbmetrology   vri_id
+--(    )   json- {vri_id: id}
+--      .
+-- vri_id    ,   id
+create or replace function get_ids_for_vri_ids(vri_ids text[]) returns json as $$
+begin
+	return (select json_object_agg(v.vri_id, v.id)
+			from (select t.vri_id, min(t.id) as id from tbmetrology t
+				where t.vri_id = any(vri_ids) group by t.vri_id) v);
+end;
+$$ language plpgsql;
@@ -0,0 +1,4 @@
+--     vri_id   (get_id_for_href, get_ids_for_vri_ids).
+--       
+drop index if exists idx_tbmetrology_href;
+create index if not exists idx_tbmetrology_vri_id on tbmetrology (vri_id);
@@ -0,0 +1,7 @@
+--   vri_id     
+--(https://fgis.gost.ru/fundmetrology/cm/results/<vri_id>):   
+--     "/",  vri_from_href  localdb
+create or replace function href_vri_id(hyperlink text) returns text as $$
+	select nullif(substring(rtrim(split_part(split_part(btrim(hyperlink, E' \t\r\n'), '#', 1), '?', 1), '/') from '[^/]*$'), '');
+$$
+language sql immutable;
@@ -0,0 +1,7 @@
+--    : ,     .
+--request_key -   ( ,  ,  ,  ),
+--last_checked -     , attempts -     
+create table if not exists tbfgis_not_found
+	(request_key text not null primary key,
+	last_checked timestamptz not null default now(),
+	attempts integer not null default 1);
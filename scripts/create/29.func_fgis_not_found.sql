@@ -0,0 +1,21 @@
+--,         
+--  json- [     (epoch),  ]
+create or replace function get_fgis_not_found(key text) returns json as $$
+	select json_build_array(extract(epoch from last_checked), attempts) from tbfgis_not_found where request_key = key;
+$$
+language sql stable;
+
+--     ,     
+create or replace procedure add_fgis_not_found(key text) as $$
+begin
+	insert into tbfgis_not_found (request_key, last_checked, attempts) values (key, now(), 1)
+	on conflict (request_key) do update set last_checked = now(), attempts = tbfgis_not_found.attempts + 1;
+end;
+$$ language plpgsql;
+
+--   ,       
+create or replace procedure del_fgis_not_found(key text) as $$
+begin
+	delete from tbfgis_not_found where request_key = key;
+end;
+$$ language plpgsql;
@@ -0,0 +1,7 @@
+--   vri_id:          tbmetrology
+--,          (--chunk).
+--   ,     id (  get_id_for_href).
+--    26  
+delete from tbmetrology a using tbmetrology b where a.vri_id = b.vri_id and a.id > b.id;
+create unique index if not exists idx_tbmetrology_vri_id_unique on tbmetrology (vri_id);
+drop index if exists idx_tbmetrology_vri_id;
@@ -0,0 +1,33 @@
+--   tbtitle, tbmodification, tborgmetrology  tbtype:
+--,       ,   
+--( add_title, add_modification, add_org_metrology  add_type - on conflict do nothing,
+--    get_id_*).
+--   :  tbmetrology     
+--,   
+update tbmetrology m set title = d.keep
+	from (select id_title as id, min(id_title) over (partition by title) as keep from tbtitle) d
+	where m.title = d.id and d.id <> d.keep;
+delete from tbtitle t using tbtitle k where t.title = k.title and t.id_title > k.id_title;
+create unique index if not exists idx_tbtitle_title_unique on tbtitle (title);
+
+update tbmetrology m set modification = d.keep
+	from (select id_mod as id, min(id_mod) over (partition by modification) as keep from tbmodification) d
+	where m.modification = d.id and d.id <> d.keep;
+delete from tbmodification t using tbmodification k where t.modification = k.modification and t.id_mod > k.id_mod;
+create unique index if not exists idx_tbmodification_modification_unique on tbmodification (modification);
+
+update tbmetrology m set org_title = d.keep
+	from (select id_org as id, min(id_org) over (partition by name_org) as keep from tborgmetrology) d
+	where m.org_title = d.id and d.id <> d.keep;
+delete from tborgmetrology t using tborgmetrology k where t.name_org = k.name_org and t.id_org > k.id_org;
+create unique index if not exists idx_tborgmetrology_name_org_unique on tborgmetrology (name_org);
+
+update tbmetrology m set mitnumber = d.keep
+	from (select id_type as id, min(id_type) over (partition by type_title, type_number) as keep from tbtype) d
+	where m.mitnumber = d.id and d.id <> d.keep;
+update tbmetrology m set mitype = d.keep
+	from (select id_type as id, min(id_type) over (partition by type_title, type_number) as keep from tbtype) d
+	where m.mitype = d.id and d.id <> d.keep;
+delete from tbtype t using tbtype k
+	where t.type_title = k.type_title and t.type_number = k.type_number and t.id_type > k.id_type;
+create unique index if not exists idx_tbtype_title_number_unique on tbtype (type_title, type_number);
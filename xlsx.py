@@ -7,9 +7,24 @@
 # Блок импорта
 import openpyxl
 from openpyxl.styles import PatternFill, Alignment, Font, Protection
+from openpyxl.worksheet.cell_range import CellRange
+from openpyxl.styles.stylesheet import Stylesheet
+from openpyxl.reader.strings import read_string_table
+from openpyxl.cell.text import Text
+from openpyxl.utils.cell import coordinate_to_tuple
+from openpyxl.utils.datetime import from_excel, from_ISO8601, CALENDAR_WINDOWS_1900, CALENDAR_MAC_1904
 import app_logger
-from datetime import datetime, date
+import metrics
+import dates
+from fuzzy_match import normalize_serial, normalize_type
+from datetime import datetime
+from array import array
 import re
+from bisect import bisect_left, bisect_right
+from copy import copy
+import posixpath
+import zipfile
+import xml.etree.ElementTree as ET
 
 # Конец блока импорта
 
@@ -55,15 +70,7 @@ COLUMNS_SI = {
     }
 }
 
-EXC_STR = ['',
-           '-',
-           '--',
-           '---',
-           'не пригоден',
-           'н/д',
-           'нет данных',
-           'отсутствует',
-           None]
+EXC_STR = dates.EXC_STR
 
 
 def open_file(filename: str):
@@ -167,7 +174,647 @@ def merge(worksheet: openpyxl.worksheet.worksheet.Worksheet, coord: tuple):
 # ==================================================================================== #
 
 
-class XlsxFile:
+# Пространства имён XML файла xlsx
+_NS_MAIN = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+_NS_REL = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+_NS_PACKAGE_REL = 'http://schemas.openxmlformats.org/package/2006/relationships'
+
+
+def _iter_rels(archive: zipfile.ZipFile, part: str):
+    """
+    Генератор связей (rels) части архива xlsx
+
+    :param archive: открытый архив xlsx
+    :param part: путь к части архива, например 'xl/workbook.xml'
+    :return: кортежи (идентификатор связи, тип связи, цель связи). Для внутренних связей
+             цель - путь к части архива, для внешних (гиперссылки) - адрес как есть
+    """
+    folder, name = posixpath.split(part)
+    rels_path = posixpath.join(folder, '_rels', name + '.rels')
+    if rels_path not in archive.namelist():
+        return
+    for rel in ET.fromstring(archive.read(rels_path)).iter(f'{{{_NS_PACKAGE_REL}}}Relationship'):
+        target = rel.get('Target')
+        if rel.get('TargetMode') != 'External':
+            target = target.lstrip('/') if target.startswith('/') else posixpath.normpath(posixpath.join(folder, target))
+        yield rel.get('Id'), rel.get('Type'), target
+
+
+def _read_rels(archive: zipfile.ZipFile, part: str):
+    """
+    Функция для чтения связей (rels) части архива xlsx
+
+    :param archive: открытый архив xlsx
+    :param part: путь к части архива, например 'xl/workbook.xml'
+    :return: словарь идентификатор связи -> цель связи
+    """
+    return {rel_id: target for rel_id, _, target in _iter_rels(archive, part)}
+
+
+def _find_rel(archive: zipfile.ZipFile, part: str, rel_type: str):
+    """
+    Функция для поиска части архива xlsx по типу связи
+
+    :param archive: открытый архив xlsx
+    :param part: путь к части архива, связи которой просматриваются
+    :param rel_type: окончание типа связи, например '/sharedStrings'
+    :return: путь к части архива или None, если связи такого типа нет
+    """
+    for _, current_type, target in _iter_rels(archive, part):
+        if current_type is not None and current_type.endswith(rel_type) and target in archive.namelist():
+            return target
+    return None
+
+
+def _cell_value(cell, shared_strings: list, date_formats: set, timedelta_formats: set, epoch: datetime):
+    """
+    Функция для получения значения ячейки из элемента <c> XML листа.
+    Значение приводится к типу так же, как при загрузке книги openpyxl с data_only=True
+
+    :param cell: элемент ячейки
+    :param shared_strings: таблица общих строк книги
+    :param date_formats: номера стилей с форматом даты
+    :param timedelta_formats: номера стилей с форматом интервала времени
+    :param epoch: начало отсчёта дат книги
+    :return: значение ячейки
+    """
+    data_type = cell.get('t', 'n')
+    if data_type == 'inlineStr':
+        child = cell.find(f'{{{_NS_MAIN}}}is')
+        return None if child is None else Text.from_tree(child).content
+    value = cell.findtext(f'{{{_NS_MAIN}}}v') or None
+    if value is None:
+        return None
+    if data_type == 'n':
+        value = float(value) if '.' in value or 'E' in value or 'e' in value else int(value)
+        style_id = int(cell.get('s', 0))
+        if style_id in date_formats:
+            try:
+                value = from_excel(value, epoch, timedelta=style_id in timedelta_formats)
+            except (OverflowError, ValueError):
+                value = '#VALUE!'
+    elif data_type == 's':
+        value = shared_strings[int(value)]
+    elif data_type == 'b':
+        value = bool(int(value))
+    elif data_type == 'd':
+        value = from_ISO8601(value)
+    return value
+
+
+class MergedIndex:
+    """
+    Индекс объединённых диапазонов листа. Для каждого столбца хранится
+    отсортированный по первой строке список диапазонов, которые его покрывают.
+    Объединённые диапазоны не пересекаются, поэтому поиск диапазона для ячейки -
+    бинарный поиск по списку столбца, без обращения к ячейкам листа.
+    """
+
+    def __init__(self, ranges=()):
+        self._columns = {}
+        for rng in ranges:
+            self.add(rng)
+
+    def __len__(self):
+        return len({rng.coord for starts, items in self._columns.values() for rng in items})
+
+    def add(self, rng: CellRange):
+        """
+        Добавить диапазон в индекс
+
+        :param rng: объект CellRange
+        :return:
+        """
+        for col in range(rng.min_col, rng.max_col + 1):
+            starts, items = self._columns.setdefault(col, ([], []))
+            pos = bisect_left(starts, rng.min_row)
+            starts.insert(pos, rng.min_row)
+            items.insert(pos, rng)
+
+    def remove(self, rng: CellRange):
+        """
+        Удалить диапазон из индекса
+
+        :param rng: объект CellRange
+        :return:
+        """
+        for col in range(rng.min_col, rng.max_col + 1):
+            column = self._columns.get(col)
+            if column is None:
+                continue
+            starts, items = column
+            pos = bisect_left(starts, rng.min_row)
+            if pos < len(starts) and items[pos].coord == rng.coord:
+                del starts[pos]
+                del items[pos]
+
+    def find(self, row: int, col: int):
+        """
+        Диапазон, в который входит ячейка
+
+        :param row: номер строки
+        :param col: номер столбца
+        :return: объект CellRange или None
+        """
+        column = self._columns.get(col)
+        if column is None:
+            return None
+        starts, items = column
+        pos = bisect_right(starts, row) - 1
+        if pos >= 0 and items[pos].max_row >= row:
+            return items[pos]
+        return None
+
+    def is_merged(self, row: int, col: int):
+        """
+        Проверка, входит ли ячейка в объединённый диапазон. Как и для MergedCell,
+        левая верхняя ячейка диапазона объединённой не считается.
+
+        :param row: номер строки
+        :param col: номер столбца
+        :return: True or False
+        """
+        rng = self.find(row, col)
+        return rng is not None and (row, col) != (rng.min_row, rng.min_col)
+
+
+class CellUpdates:
+    """
+    Буфер изменений ячеек листа. Изменения накапливаются во время обработки
+    и записываются в книгу одним проходом перед сохранением (XlsxFile.flush).
+    Для каждой ячейки хранится словарь атрибутов:
+        value - значение;
+        style - именованный стиль ("Hyperlink");
+        hyperlink - адрес гиперссылки;
+        font_color - цвет шрифта;
+        fill - ключ цвета заливки из XlsxFile.COLORS;
+        alignment - стиль выравнивания;
+        hidden - скрыть значение (защита ячейки).
+    Атрибуты применяются в указанном порядке, независимо от порядка вызовов,
+    поэтому заливка и выравнивание не сбрасываются именованным стилем.
+    В буфере только простые значения, поэтому его можно передавать между процессами.
+    По запросу (pop_changed) буфер отслеживает, какие ячейки изменились, чтобы
+    контрольная точка записывала только новые изменения.
+    """
+
+    def __init__(self):
+        self._cells = {}
+        # Ячейки, изменённые после последнего вызова pop_changed, None - изменения не отслеживаются
+        self._changed = None
+
+    def __len__(self):
+        return len(self._cells)
+
+    def set(self, coord: tuple, **attrs):
+        """
+        Добавить изменения для ячейки
+
+        :param coord: кортеж с координатами ячейки, 0 - строка, 1 - столбец
+        :param attrs: атрибуты ячейки
+        :return:
+        """
+        key = (coord[0], coord[1])
+        cell_attrs = self._cells.get(key)
+        if cell_attrs is None:
+            self._cells[key] = attrs
+        else:
+            cell_attrs.update(attrs)
+        if self._changed is not None:
+            self._changed.add(key)
+
+    def get(self, coord: tuple):
+        """
+        Изменения для ячейки
+
+        :param coord: кортеж с координатами ячейки
+        :return: словарь атрибутов или None
+        """
+        return self._cells.get((coord[0], coord[1]))
+
+    def items(self):
+        """
+        Изменения по всем ячейкам в порядке строк и столбцов
+
+        :return: список кортежей ((строка, столбец), атрибуты)
+        """
+        return sorted(self._cells.items())
+
+    def merge(self, other):
+        """
+        Добавить изменения из другого буфера, при совпадении атрибутов
+        приоритет у other
+
+        :param other: объект CellUpdates
+        :return:
+        """
+        for coord, attrs in other._cells.items():
+            self.set(coord, **attrs)
+
+    def set_many(self, coords, **attrs):
+        """
+        Добавить одинаковые изменения для нескольких ячеек
+
+        :param coords: итерируемый объект с координатами ячеек
+        :param attrs: атрибуты ячеек
+        :return:
+        """
+        for coord in coords:
+            self.set(coord, **attrs)
+
+    def pop_changed(self):
+        """
+        Изменения ячеек после предыдущего вызова метода,
+        первый вызов включает отслеживание изменений
+
+        :return: объект CellUpdates с текущими атрибутами изменённых ячеек или None,
+                 если до этого изменения не отслеживались или буфер очищался
+        """
+        changed, self._changed = self._changed, set()
+        if changed is None:
+            return None
+        delta = CellUpdates()
+        for key in changed:
+            delta._cells[key] = dict(self._cells[key])
+        return delta
+
+    def clear(self):
+        self._cells.clear()
+        self._changed = None
+
+
+class StyleRegistry:
+    """
+    Реестр стилей для записи в книгу. Каждый шрифт, выравнивание и защита
+    создаются один раз, а итоговый набор стилей ячейки (StyleArray) запоминается
+    по исходному стилю ячейки и набору изменений, поэтому для ячеек
+    с одинаковым оформлением стиль вычисляется один раз и дальше только копируется.
+    Реестр привязан к одной книге.
+    """
+    HIDDEN = Protection(hidden=True)
+
+    def __init__(self):
+        self._fonts = {}
+        self._alignments = {}
+        self._styles = {}
+
+    def font(self, color: str):
+        """
+        Шрифт заданного цвета
+
+        :param color: цвет шрифта
+        :return: объект Font
+        """
+        font = self._fonts.get(color)
+        if font is None:
+            font = Font(color=color)
+            self._fonts[color] = font
+        return font
+
+    def alignment(self, align_style: str):
+        """
+        Выравнивание по вертикали и горизонтали
+
+        :param align_style: стиль выравнивания: center
+        :return: объект Alignment
+        """
+        alignment = self._alignments.get(align_style)
+        if alignment is None:
+            alignment = Alignment(vertical=align_style, horizontal=align_style)
+            self._alignments[align_style] = alignment
+        return alignment
+
+    def apply(self, cell, attrs: dict):
+        """
+        Применить к ячейке стилевые атрибуты из буфера CellUpdates:
+        style, font_color, fill, alignment, hidden
+
+        :param cell: объект ячейки
+        :param attrs: словарь атрибутов
+        :return:
+        """
+        key = (tuple(cell._style) if cell._style is not None else None,
+               attrs.get('style'),
+               attrs.get('font_color'),
+               attrs.get('fill'),
+               attrs.get('alignment'),
+               attrs.get('hidden'))
+        style_array = self._styles.get(key)
+        if style_array is not None:
+            cell._style = copy(style_array)
+            return
+        if 'style' in attrs:
+            cell.style = attrs['style']
+        if 'font_color' in attrs:
+            cell.font = self.font(attrs['font_color'])
+        if 'fill' in attrs:
+            cell.fill = XlsxFile.COLORS[attrs['fill']]
+        if 'alignment' in attrs:
+            cell.alignment = self.alignment(attrs['alignment'])
+        if attrs.get('hidden'):
+            cell.protection = StyleRegistry.HIDDEN
+        self._styles[key] = copy(cell._style)
+
+
+class SiColumns:
+    """
+    Столбцы с данными по одному виду СИ (ПУ, ТТ или ТН), по позиции строки в SiTable:
+        serials - серийные номера;
+        serial_keys - нормализованные серийные номера для поиска карточек (normalize_serial);
+        types - типы СИ, как их возвращает XlsxFile.get_type;
+        type_keys - нормализованные типы СИ для поиска карточек (normalize_type);
+        verif_ordinals - дата последней поверки, порядковый номер дня (0 - даты нет);
+        valid_ordinals - дата следующей поверки, порядковый номер дня (0 - даты нет);
+        verif_years - год последней поверки (0 - даты нет);
+        valid_years - год следующей поверки (0 - даты нет);
+        href_flags - 1, если в ячейке есть гиперссылка;
+        hrefs - адрес гиперссылки или None.
+    Индекс year_rows: год последней поверки -> позиции строк с этим годом
+    по возрастанию, строится методом index_years.
+    """
+
+    def __init__(self):
+        self.serials = []
+        self.serial_keys = []
+        self.types = []
+        self.type_keys = []
+        self.verif_ordinals = array('l')
+        self.valid_ordinals = array('l')
+        self.verif_years = array('l')
+        self.valid_years = array('l')
+        self.href_flags = array('b')
+        self.hrefs = []
+        self.year_rows = {}
+
+    def index_years(self):
+        """
+        Метод для построения индекса год последней поверки -> позиции строк
+
+        :return:
+        """
+        year_rows = {}
+        for pos, year in enumerate(self.verif_years):
+            if year:
+                rows = year_rows.get(year)
+                if rows is None:
+                    rows = year_rows[year] = array('l')
+                rows.append(pos)
+        self.year_rows = year_rows
+
+    def years(self):
+        """
+        Метод для получения годов последней поверки, которые есть в столбцах
+
+        :return: отсортированный список годов
+        """
+        return sorted(self.year_rows)
+
+    def positions(self, years=None):
+        """
+        Метод для получения позиций строк по годам последней поверки
+
+        :param years: итерируемый объект с годами, None - все строки с датой последней поверки
+        :return: array('l') с позициями по возрастанию
+        """
+        if years is None:
+            years = self.year_rows
+        lst_rows = [self.year_rows[year] for year in set(years) if year in self.year_rows]
+        if len(lst_rows) == 1:
+            return lst_rows[0]
+        return array('l', sorted(pos for rows in lst_rows for pos in rows))
+
+    def take(self, positions):
+        """
+        Метод для получения столбцов только по заданным позициям строк
+
+        :param positions: позиции строк по возрастанию
+        :return: объект SiColumns
+        """
+        columns = SiColumns()
+        columns.serials = [self.serials[pos] for pos in positions]
+        columns.serial_keys = [self.serial_keys[pos] for pos in positions]
+        columns.types = [self.types[pos] for pos in positions]
+        columns.type_keys = [self.type_keys[pos] for pos in positions]
+        columns.verif_ordinals = array('l', [self.verif_ordinals[pos] for pos in positions])
+        columns.valid_ordinals = array('l', [self.valid_ordinals[pos] for pos in positions])
+        columns.verif_years = array('l', [self.verif_years[pos] for pos in positions])
+        columns.valid_years = array('l', [self.valid_years[pos] for pos in positions])
+        columns.href_flags = array('b', [self.href_flags[pos] for pos in positions])
+        columns.hrefs = [self.hrefs[pos] for pos in positions]
+        columns.index_years()
+        return columns
+
+    def slice(self, start: int, end: int):
+        """
+        Метод для получения части столбцов по позициям строк
+
+        :param start: начальная позиция
+        :param end: конечная позиция (не включается)
+        :return: объект SiColumns
+        """
+        columns = SiColumns()
+        columns.serials = self.serials[start:end]
+        columns.serial_keys = self.serial_keys[start:end]
+        columns.types = self.types[start:end]
+        columns.type_keys = self.type_keys[start:end]
+        columns.verif_ordinals = self.verif_ordinals[start:end]
+        columns.valid_ordinals = self.valid_ordinals[start:end]
+        columns.verif_years = self.verif_years[start:end]
+        columns.valid_years = self.valid_years[start:end]
+        columns.href_flags = self.href_flags[start:end]
+        columns.hrefs = self.hrefs[start:end]
+        columns.index_years()
+        return columns
+
+
+class SiTable:
+    """
+    Таблица с данными по СИ всех строк листа, общая для всех видов СИ:
+        rows - номера строк;
+        ids - идентификатор записи tbmetrology из столбца COLUMN_ID (0 - нет);
+        kinds - словарь вид СИ -> SiColumns.
+    """
+
+    def __init__(self, kinds):
+        self.rows = array('l')
+        self.ids = array('q')
+        self.kinds = {kind: SiColumns() for kind in kinds}
+
+    def __len__(self):
+        return len(self.rows)
+
+    def select(self, kinds):
+        """
+        Метод для получения таблицы только с заданными видами СИ,
+        номера строк и идентификаторы записей общие с исходной таблицей
+
+        :param kinds: список видов СИ
+        :return: объект SiTable
+        """
+        table = SiTable([])
+        table.rows = self.rows
+        table.ids = self.ids
+        table.kinds = {kind: self.kinds[kind] for kind in kinds}
+        return table
+
+    def slice_rows(self, start_row: int, end_row: int):
+        """
+        Метод для получения таблицы по диапазону строк листа
+
+        :param start_row: начальная строка
+        :param end_row: конечная строка (включительно)
+        :return: объект SiTable
+        """
+        start = bisect_left(self.rows, start_row)
+        end = bisect_right(self.rows, end_row)
+        table = SiTable([])
+        table.rows = self.rows[start:end]
+        table.ids = self.ids[start:end]
+        table.kinds = {kind: columns.slice(start, end) for kind, columns in self.kinds.items()}
+        return table
+
+    def take(self, kind: str, positions):
+        """
+        Метод для получения таблицы по одному виду СИ только с заданными позициями строк,
+        например, со строками одного года последней поверки
+
+        :param kind: вид СИ
+        :param positions: позиции строк по возрастанию
+        :return: объект SiTable
+        """
+        table = SiTable([])
+        table.rows = array('l', [self.rows[pos] for pos in positions])
+        table.ids = array('q', [self.ids[pos] for pos in positions])
+        table.kinds = {kind: self.kinds[kind].take(positions)}
+        return table
+
+
+class CellWriter:
+    """
+    Класс для записи изменений ячеек листа в буфер CellUpdates.
+    Используется XlsxFile, а также отдельно - в процессах, которые обрабатывают
+    часть данных файла без самой книги: изменения из буфера такого объекта
+    потом переносятся в книгу методом XlsxFile.merge_updates.
+    """
+
+    def __init__(self, merged_index=None):
+        """
+        Конструктор класса
+
+        :param merged_index: индекс объединённых диапазонов листа MergedIndex
+        """
+        self._updates = CellUpdates()
+        self._merged_index = merged_index
+
+    @property
+    def updates(self):
+        """
+        Свойство - буфер изменений ячеек, ещё не записанных в книгу
+
+        :return: объект CellUpdates
+        """
+        return self._updates
+
+    def _write_value(self, coord: tuple, value=None):
+        """
+        Метод для записи значения в ячейку с указаннми координатами.
+        Значение попадает в буфер изменений и записывается в ячейку при сохранении.
+
+        :param coord: кортеж с координатами ячейки, 0 - строка, 1 - столбец
+        :param value: само значение для записи
+        :return:
+        """
+        self._updates.set(coord, value=value)
+
+    def set_date(self, coord: tuple, date):
+        """
+        Метод для записи даты в ячейку
+
+        :param coord: кортеж с координатами ячейки
+        :param date: значение даты для записи
+        :return:
+        """
+        self._write_value(coord, date)
+
+    def set_href(self, coord: tuple, href: str):
+        """
+        Метод для записи ссылки в ячейку
+
+        :param coord: кортеж с координатами ячейки
+        :param href: строка URL
+        :return:
+        """
+        self._write_value(coord, "ФГИС")
+        self.set_hlink_style(coord, href)
+        self.set_alignment(coord, align_style="center")
+
+    def set_hlink_style(self, coord: tuple, href: str):
+        """
+        Метод для присвоения ячейке формата "гиперссылка"
+
+        :param coord: кортеж с координатами ячейки
+        :return:
+        """
+        self._updates.set(coord, style="Hyperlink", hyperlink=href)
+        app_logger.event(logger, 'cell_href', "В ячейку с координатами <%s> добавлена гиперссылка %s", coord, href,
+                         row=coord[0], column=coord[1], href=href)
+
+    def set_alignment(self, coord: tuple, align_style: str = "center"):
+        """
+        Метод для установки стиля выравнивания ячейки
+
+        :param coord: кортеж с координатами ячейки
+        :param align_style: стиль выравнивания: center
+        :return:
+        """
+        self._updates.set(coord, alignment=align_style)
+        app_logger.event(logger, 'cell_alignment', "Для ячейки с координатами <%s> установлен стиль выравнивания %s",
+                         coord, align_style, row=coord[0], column=coord[1], alignment=align_style)
+
+    def set_fill(self, coord: tuple, color: str):
+        """
+        Метод для установки заливки ячейки
+
+        :param coord: кортеж с координатами ячейки
+        :param color: цвет заливки, выбирается из предложенных заранее: green, red, blue, orange, yellow
+        :return:
+        """
+        self._updates.set(coord, fill=color)
+        app_logger.event(logger, 'cell_fill', "Для ячейки с координатами <%s> установлен цвет заливки %s", coord, color,
+                         row=coord[0], column=coord[1], color=color)
+
+    def apply_style_to_rows(self, rows, column: int, **attrs):
+        """
+        Метод для установки одинакового оформления ячейкам столбца column
+        в нескольких строках, например apply_style_to_rows(rows, 14, fill='orange')
+
+        :param rows: итерируемый объект с номерами строк
+        :param column: номер столбца
+        :param attrs: атрибуты оформления: style, font_color, fill, alignment, hidden
+        :return:
+        """
+        self._updates.set_many(((row, column) for row in rows), **attrs)
+
+    def set_id_record(self, coord: tuple, id_record: int):
+        """
+        Метод для записи идентификатора из тиблицы tbmetrology
+
+        :param coord: кортеж с координатами ячейки
+        :param id_record: идентификатор записи
+        :return:
+        """
+        self._updates.set(coord, value=f"{id_record}", font_color='00ffffff', hidden=True)
+
+    def check_merged(self, coord: tuple):
+        """
+        Проверка диапазона ячеек на объединение
+
+        :param coord: кортеж с координатами
+        :return: True or False
+        """
+        return self._merged_index.is_merged(coord[0], coord[1])
+
+
+class XlsxFile(CellWriter):
     """
     Класс, представляющий струкутуру данных для файла Excel
     с параметрами и методами для работы с файлом в рамках конкретной задачи
@@ -220,25 +867,36 @@ class XlsxFile:
         }
     }
 
-    EXC_STR = ['',
-               '-',
-               '--',
-               '---',
-               'не пригоден',
-               'н/д',
-               'нет данных',
-               'отсутствует',
-               None]
+    EXC_STR = dates.EXC_STR
 
     SHEETNAME = 'Прил.1.1 (Сч,ТТ,ТН)'
 
     COLUMN_ID = 36
 
-    def __init__(self, namefile: str):
+    # Столбцы, которые считываются при потоковой загрузке листа
+    EXTRACT_COLUMNS = tuple(sorted({col for columns in COLUMNS_SI.values() for col in columns.values()} |
+                                   {COLUMN_ID}))
+    EXTRACT_INDEX = {col: ind for ind, col in enumerate(EXTRACT_COLUMNS)}
+
+    def __init__(self, namefile: str, read_only: bool = False):
         """
         Конструктор класса
+
+        :param namefile: имя файла Excel
+        :param read_only: True - лист читается потоком в режиме только для чтения,
+                          в память попадают только нужные столбцы и гиперссылки,
+                          книга целиком загружается только при сохранении изменений
         """
+        super().__init__()
         self.namefile = namefile
+        self.read_only = read_only
+        self._file = None
+        self._active_sheet = None
+        self._rows = None
+        self._hyperlinks = None
+        self._max_row = None
+        self._merge_ops = []
+        self._styles = StyleRegistry()
         self.__setup()
 
     def __setup(self):
@@ -247,8 +905,106 @@ class XlsxFile:
 
         :return:
         """
-        self._file = openpyxl.load_workbook(self.namefile, data_only=True)
-        self.active_sheet = self._file[XlsxFile.SHEETNAME]
+        if self.read_only:
+            with metrics.timer('excel', operation='read'):
+                self.__stream_sheet()
+        else:
+            self.__load_workbook()
+
+    def __load_workbook(self):
+        """
+        Загрузка книги целиком, для чтения и записи
+
+        :return:
+        """
+        with metrics.timer('excel', operation='load'):
+            self._file = openpyxl.load_workbook(self.namefile, data_only=True)
+        self._active_sheet = self._file[XlsxFile.SHEETNAME]
+        if self._merged_index is None:
+            self._merged_index = MergedIndex(self._active_sheet.merged_cells.ranges)
+
+    def __stream_sheet(self):
+        """
+        Потоковое чтение листа SHEETNAME в режиме только для чтения.
+        XML листа разбирается один раз: за этот проход читаются значения столбцов
+        EXTRACT_COLUMNS, гиперссылки и объединённые диапазоны, остальное не загружается.
+        Книга целиком загружается только в save(), если есть изменения для записи:
+        openpyxl не умеет изменять отдельные ячейки файла без полной загрузки.
+
+        :return:
+        """
+        rows = {}
+        hyperlinks = {}
+        merged_ranges = []
+        max_row = 0
+        with zipfile.ZipFile(self.namefile) as archive:
+            workbook_xml = ET.fromstring(archive.read('xl/workbook.xml'))
+            workbook_rels = _read_rels(archive, 'xl/workbook.xml')
+            sheet_path = None
+            for item in workbook_xml.iter(f'{{{_NS_MAIN}}}sheet'):
+                if item.get('name') == XlsxFile.SHEETNAME:
+                    sheet_path = workbook_rels.get(item.get(f'{{{_NS_REL}}}id'))
+                    break
+            if sheet_path is None:
+                raise KeyError(f"В файле {self.namefile} не найден лист {XlsxFile.SHEETNAME}")
+            epoch = CALENDAR_WINDOWS_1900
+            workbook_pr = workbook_xml.find(f'{{{_NS_MAIN}}}workbookPr')
+            if workbook_pr is not None and workbook_pr.get('date1904') in ('1', 'true'):
+                epoch = CALENDAR_MAC_1904
+            shared_strings = []
+            strings_path = _find_rel(archive, 'xl/workbook.xml', '/sharedStrings')
+            if strings_path is not None:
+                with archive.open(strings_path) as src:
+                    shared_strings = read_string_table(src)
+            date_formats = timedelta_formats = set()
+            styles_path = _find_rel(archive, 'xl/workbook.xml', '/styles')
+            if styles_path is not None:
+                stylesheet = Stylesheet.from_tree(ET.fromstring(archive.read(styles_path)))
+                date_formats = stylesheet.date_formats
+                timedelta_formats = stylesheet.timedelta_formats
+            sheet_rels = _read_rels(archive, sheet_path)
+            with archive.open(sheet_path) as src:
+                for _, elem in ET.iterparse(src):
+                    if elem.tag == f'{{{_NS_MAIN}}}row':
+                        max_row = int(elem.get('r', max_row + 1))
+                        values = [None] * len(XlsxFile.EXTRACT_COLUMNS)
+                        col = 0
+                        for cell in elem.iter(f'{{{_NS_MAIN}}}c'):
+                            coordinate = cell.get('r')
+                            col = coordinate_to_tuple(coordinate)[1] if coordinate else col + 1
+                            pos = XlsxFile.EXTRACT_INDEX.get(col)
+                            if pos is not None:
+                                values[pos] = _cell_value(cell, shared_strings, date_formats,
+                                                          timedelta_formats, epoch)
+                        if any(value is not None for value in values):
+                            rows[max_row] = values
+                        # Остальные ячейки строки в памяти не держим
+                        elem.clear()
+                    elif elem.tag == f'{{{_NS_MAIN}}}hyperlink':
+                        target = sheet_rels.get(elem.get(f'{{{_NS_REL}}}id'))
+                        for row, col in CellRange(elem.get('ref')).cells:
+                            hyperlinks[(row, col)] = target
+                    elif elem.tag == f'{{{_NS_MAIN}}}mergeCell':
+                        merged_ranges.append(elem.get('ref'))
+        self._hyperlinks = hyperlinks
+        self._merged_index = MergedIndex(CellRange(ref) for ref in merged_ranges)
+        self._rows = rows
+        self._max_row = max_row
+        logger.info(f"Лист {XlsxFile.SHEETNAME} файла {self.namefile} прочитан потоком: строк - {len(rows)}, "
+                    f"гиперссылок - {len(hyperlinks)}")
+
+    @property
+    def active_sheet(self):
+        """
+        Свойство - активный лист книги, при потоковом чтении
+        книга загружается целиком при первом обращении
+
+        :return: объект worksheet
+        """
+        if self._active_sheet is None:
+            logger.info(f"Загружаем книгу {self.namefile} целиком")
+            self.__load_workbook()
+        return self._active_sheet
 
     @property
     def max_row(self):
@@ -257,6 +1013,8 @@ class XlsxFile:
 
         :return: int - номер последней используемой строки книги
         """
+        if self._max_row is not None:
+            return self._max_row
         return self.active_sheet.max_row
 
     @property
@@ -266,7 +1024,7 @@ class XlsxFile:
 
         :return: List - список листов книги Excel
         """
-        return self._file.worksheets
+        return self.active_sheet.parent.worksheets
 
     @property
     def mereged_range(self):
@@ -284,22 +1042,16 @@ class XlsxFile:
         :param coord: кортеж с координатами ячейки, 0 - строка, 1 - столбец
         :return: прочитанное необработанное значение
         """
+        pending = self._updates.get(coord)
+        if pending is not None and 'value' in pending:
+            return pending['value']
+        if self._rows is not None:
+            pos = XlsxFile.EXTRACT_INDEX.get(coord[1])
+            if pos is not None:
+                row = self._rows.get(coord[0])
+                return None if row is None else row[pos]
         return self.active_sheet.cell(coord[0], coord[1]).value
 
-    def _write_value(self, coord: tuple, value=None):
-        """
-        Метод для записи значения в ячейку с указаннми координатами
-
-        :param coord: кортеж с координатами ячейки, 0 - строка, 1 - столбец
-        :param value: само значение для записи
-        :return:
-        """
-        try:
-            self.active_sheet.cell(coord[0], coord[1]).value = value
-        except Exception as err:
-            logger.warning(f"Не удалось записать значение <{value}> в ячейку с координатами <{coord}>."
-                           f"Ошибка: {err.__str__()}")
-
     def _check_date(self, date_for_check: object):
         """
         Метод для проверки даты, принадлежит ли дата к типу datetime
@@ -355,7 +1107,15 @@ class XlsxFile:
         :param coord: кортеж с координатами ячейки
         :return: дата последней поверки в формате datetime
         """
-        tmp_val = self._read_value(coord)
+        return self._date_from_value(self._read_value(coord))
+
+    def _date_from_value(self, tmp_val):
+        """
+        Приведение значения ячейки к дате
+
+        :param tmp_val: значение ячейки
+        :return: дата или None
+        """
         if self._check_date(tmp_val):
             return tmp_val.date()
         else:
@@ -369,7 +1129,15 @@ class XlsxFile:
         :param coord: кортеж с координатами ячейки
         :return: тип СИ
         """
-        tmp_val = self._read_value(coord)
+        return self._type_from_value(self._read_value(coord))
+
+    def _type_from_value(self, tmp_val):
+        """
+        Приведение значения ячейки к типу СИ
+
+        :param tmp_val: значение ячейки
+        :return: тип СИ или None
+        """
         if tmp_val is None:
             return None
         else:
@@ -386,7 +1154,15 @@ class XlsxFile:
         :param coord: кортеж с координатами ячейки
         :return: строку серийного номера
         """
-        tmp_serial = self._read_value(coord)
+        return self._serial_from_value(self._read_value(coord))
+
+    def _serial_from_value(self, tmp_serial):
+        """
+        Приведение значения ячейки к серийному номеру
+
+        :param tmp_serial: значение ячейки
+        :return: серийный номер
+        """
         if not tmp_serial is None and type(tmp_serial) is str:
             serial = tmp_serial.strip().rstrip()
             return serial
@@ -400,18 +1176,13 @@ class XlsxFile:
         :param coord: кортеж с координатами ячейки
         :return: строку URL
         """
+        pending = self._updates.get(coord)
+        if pending is not None and 'hyperlink' in pending:
+            return pending['hyperlink']
+        if self._hyperlinks is not None:
+            return self._hyperlinks.get((coord[0], coord[1]))
         return self.active_sheet.cell(coord[0], coord[1]).hyperlink.target
 
-    def set_date(self, coord: tuple, date):
-        """
-        Метод для записи даты в ячейку
-
-        :param coord: кортеж с координатами ячейки
-        :param date: значение даты для записи
-        :return:
-        """
-        self._write_value(coord, date)
-
     def get_id_record(self, coord: tuple):
         """
         Метод для получения номера идентификатора записи таблицы tbmetrology
@@ -426,6 +1197,24 @@ class XlsxFile:
         else:
             return int(id_record)
 
+    def _id_from_value(self, id_value, row: int):
+        """
+        Получение идентификатора записи tbmetrology из значения ячейки столбца COLUMN_ID.
+        Значение, которое не является числом, не прерывает обработку файла
+
+        :param id_value: значение ячейки
+        :param row: номер строки для лога
+        :return: идентификатор записи, 0 - если ячейка пустая или значение не число
+        """
+        if id_value is None:
+            return 0
+        try:
+            return int(str(id_value).strip() or 0) if isinstance(id_value, str) else int(id_value)
+        except (TypeError, ValueError):
+            logger.warning(f"В строке {row} в столбце {XlsxFile.COLUMN_ID} не число <{id_value}>, "
+                           f"идентификатор записи не учитывается")
+            return 0
+
     def get_value(self, coord: tuple):
         """
         Метод для получения значения ячейки с координатами coord.
@@ -435,79 +1224,10 @@ class XlsxFile:
         """
         return self._read_value(coord)
 
-    def set_href(self, coord: tuple, href: str):
-        """
-        Метод для записи ссылки в ячейку
-
-        :param coord: кортеж с координатами ячейки
-        :param href: строка URL
-        :return:
-        """
-        self._write_value(coord, "ФГИС")
-        self.set_hlink_style(coord, href)
-        self.set_alignment(coord, align_style="center")
-
-    def set_hlink_style(self, coord: tuple, href: str):
-        """
-        Метод для присвоения ячейке формата "гиперссылка"
-
-        :param coord: кортеж с координатами ячейки
-        :return:
-        """
-        self.active_sheet.cell(coord[0], coord[1]).style = "Hyperlink"
-        self.active_sheet.cell(coord[0], coord[1]).hyperlink = href
-        logger.info(f"В ячейку с координатами <{coord}> добавлена гиперссылка {href}")
-
-    def set_alignment(self, coord: tuple, align_style: str = "center"):
-        """
-        Метод для установки стиля выравнивания ячейки
-
-        :param coord: кортеж с координатами ячейки
-        :param align_style: стиль выравнивания: center
-        :return:
-        """
-        self.active_sheet.cell(coord[0], coord[1]).alignment = Alignment(vertical=align_style, horizontal=align_style)
-        logger.info(f"Для ячейки с координатами <{coord}> установлен стиль выравнивания {align_style}")
-
-    def set_fill(self, coord: tuple, color: str):
-        """
-        Метод для установки заливки ячейки
-
-        :param coord: кортеж с координатами ячейки
-        :param color: цвет заливки, выбирается из предложенных заранее: green, red, blue, orange, yellow
-        :return:
-        """
-        self.active_sheet.cell(coord[0], coord[1]).fill = XlsxFile.COLORS[color]
-        logger.info(f"Для ячейки с координатами <{coord}> установлен цвет заливки {color}")
-
-    def set_id_record(self, coord: tuple, id_record: int):
-        """
-        Метод для записи идентификатора из тиблицы tbmetrology
-
-        :param coord: кортеж с координатами ячейки
-        :param id_record: идентификатор записи
-        :return:
-        """
-        current_cell = self.active_sheet.cell(coord[0], coord[1])
-        current_cell.font = Font(color='00ffffff')
-        current_cell.value = f"{id_record}"
-        current_cell.protection = Protection(hidden=True)
-
-    def check_merged(self, coord: tuple):
-        """
-        Проверка диапазона ячеек на объединение
-
-        :param coord: кортеж с координатами
-        :return: True or False
-        """
-        if type(self.active_sheet.cell(row=coord[0], column=coord[1])) is openpyxl.cell.cell.MergedCell:
-            return True
-        else:
-            return False
-
     def unmerge(self, coord: tuple):
         """
-        Метод для снятия объединения для диапазона ячеек
+        Метод для снятия объединения для диапазона ячеек.
+        Индекс объединённых диапазонов меняется сразу, сам лист - при записи буфера (flush)
 
         :param worksheet: объект листа
         :param coord: кортеж с координатами: 0 - start_row,
@@ -516,14 +1236,13 @@ class XlsxFile:
                                              3 - end_column
         :return:
         """
-        self.active_sheet.unmerge_cells(start_row=coord[0],
-                                        start_column=coord[1],
-                                        end_row=coord[2],
-                                        end_column=coord[3])
+        self._merge_ops.append(('unmerge', coord))
+        self._merged_index.remove(CellRange(min_row=coord[0], min_col=coord[1], max_row=coord[2], max_col=coord[3]))
 
     def merge(self, coord: tuple):
         """
-        Объединение диапазона ячеек
+        Объединение диапазона ячеек.
+        Индекс объединённых диапазонов меняется сразу, сам лист - при записи буфера (flush)
 
         :param worksheet: объект листа worksheet
         :param coord: кортеж с координатами: 0 - start_row,
@@ -533,10 +1252,8 @@ class XlsxFile:
         :return:
         """
         try:
-            self.active_sheet.merge_cells(start_row=coord[0],
-                                          start_column=coord[1],
-                                          end_row=coord[2],
-                                          end_column=coord[3])
+            self._merged_index.add(CellRange(min_row=coord[0], min_col=coord[1], max_row=coord[2], max_col=coord[3]))
+            self._merge_ops.append(('merge', coord))
         except Exception as err:
             logger.warning(f"Не удалось объединить диапазон, ошибка <{err.__str__()}>")
 
@@ -547,6 +1264,11 @@ class XlsxFile:
         :param coord: кортеж с координатами ячейки
         :return: True or False
         """
+        pending = self._updates.get(coord)
+        if pending is not None and 'hyperlink' in pending:
+            return True
+        if self._hyperlinks is not None:
+            return (coord[0], coord[1]) in self._hyperlinks
         if self.active_sheet.cell(coord[0], coord[1]).hyperlink is None:
             return False
         else:
@@ -583,6 +1305,61 @@ class XlsxFile:
                      'id': id_record}
         return inform_si
 
+    @metrics.timed('excel', label='operation')
+    def extract_si_table(self, start_row: int, kinds=None):
+        """
+        Метод для получения данных по СИ всех строк листа за один проход.
+        Вместо вызова get_inform_si для каждой строки и каждого вида СИ
+        значения строки читаются один раз и раскладываются по столбцам SiTable.
+
+        :param start_row: начальная строка
+        :param kinds: виды СИ (ПУ, ТТ, ТН), по умолчанию - все
+        :return: объект SiTable
+        """
+        kinds = list(kinds) if kinds else list(XlsxFile.COLUMNS_SI)
+        table = SiTable(kinds)
+        index = XlsxFile.EXTRACT_INDEX
+        pos_id = index[XlsxFile.COLUMN_ID]
+        kind_pos = {kind: {name: index[col] for name, col in XlsxFile.COLUMNS_SI[kind].items()} for kind in kinds}
+        empty_row = [None] * len(XlsxFile.EXTRACT_COLUMNS)
+        # Значения дат собираются по столбцам и разбираются после прохода по листу
+        raw_dates = {kind: ([], []) for kind in kinds}
+        for row in range(start_row, self.max_row + 1):
+            if self._rows is not None and len(self._updates) == 0:
+                values = self._rows.get(row, empty_row)
+            else:
+                values = [self._read_value((row, col)) for col in XlsxFile.EXTRACT_COLUMNS]
+            table.rows.append(row)
+            id_record = values[pos_id]
+            table.ids.append(self._id_from_value(id_record, row))
+            for kind in kinds:
+                pos = kind_pos[kind]
+                columns = table.kinds[kind]
+                serial = self._serial_from_value(values[pos['serial']])
+                type_si = self._type_from_value(values[pos['type']])
+                columns.serials.append(serial)
+                columns.serial_keys.append(None if serial is None else normalize_serial(serial))
+                columns.types.append(type_si)
+                columns.type_keys.append(None if type_si is None else normalize_type(type_si))
+                raw_dates[kind][0].append(values[pos['verif_date']])
+                raw_dates[kind][1].append(values[pos['valid_date']])
+                coord_href = (row, XlsxFile.COLUMNS_SI[kind]['href'])
+                if self.check_href_style(coord_href):
+                    columns.href_flags.append(1)
+                    columns.hrefs.append(self.get_href(coord_href))
+                else:
+                    columns.href_flags.append(0)
+                    columns.hrefs.append(None)
+        for kind, (verif_values, valid_values) in raw_dates.items():
+            columns = table.kinds[kind]
+            columns.verif_ordinals = dates.CONVERTER.column(verif_values)
+            columns.valid_ordinals = dates.CONVERTER.column(valid_values)
+            columns.verif_years = dates.CONVERTER.years(columns.verif_ordinals)
+            columns.valid_years = dates.CONVERTER.years(columns.valid_ordinals)
+            columns.index_years()
+        logger.info(f"Получены данные по СИ {kinds} для {len(table)} строк")
+        return table
+
     def get_cell(self, coord: tuple):
         """
         Метод для получения объекта ячейки.
@@ -595,16 +1372,88 @@ class XlsxFile:
 
         return cells
 
-    def save(self):
+    def create_writer(self):
         """
-        Метод для сохранения и закрытия файла
+        Метод для получения отдельного объекта записи изменений с пустым буфером
+        и индексом объединённых диапазонов этого листа
 
-        :param namefile: Имя файла для сохранения
+        :return: объект CellWriter
+        """
+        return CellWriter(self._merged_index)
+
+    def merge_updates(self, updates):
+        """
+        Метод для переноса изменений из буфера другого объекта CellWriter
+
+        :param updates: объект CellUpdates
         :return:
         """
+        self._updates.merge(updates)
+
+    def flush(self):
+        """
+        Метод для записи накопленных в буфере изменений в ячейки книги за один проход.
+        Стили ячеек берутся из реестра StyleRegistry.
+        Сначала выполняются отложенные объединения и снятия объединения диапазонов,
+        затем объединённые ячейки (кроме левой верхней) пропускаются.
+
+        :return: количество изменённых ячеек
+        """
+        if len(self._updates) == 0 and not self._merge_ops:
+            return 0
+        sheet = self.active_sheet
+        for operation, coord in self._merge_ops:
+            try:
+                if operation == 'merge':
+                    sheet.merge_cells(start_row=coord[0], start_column=coord[1],
+                                      end_row=coord[2], end_column=coord[3])
+                else:
+                    sheet.unmerge_cells(start_row=coord[0], start_column=coord[1],
+                                        end_row=coord[2], end_column=coord[3])
+            except Exception as err:
+                logger.warning(f"Не удалось выполнить {operation} для диапазона <{coord}>, "
+                               f"ошибка <{err.__str__()}>")
+        self._merge_ops.clear()
+        count_cells = 0
+        for (row, col), attrs in self._updates.items():
+            if self._merged_index.is_merged(row, col):
+                logger.warning(f"Ячейка с координатами <{(row, col)}> входит в объединённый диапазон, "
+                               f"изменения {attrs} не записаны")
+                continue
+            cell = sheet.cell(row, col)
+            try:
+                if 'value' in attrs:
+                    cell.value = attrs['value']
+                self._styles.apply(cell, attrs)
+                if 'hyperlink' in attrs:
+                    cell.hyperlink = attrs['hyperlink']
+                count_cells += 1
+            except Exception as err:
+                logger.warning(f"Не удалось записать изменения {attrs} в ячейку с координатами <{(row, col)}>. "
+                               f"Ошибка: {err.__str__()}")
+        self._updates.clear()
+        metrics.inc('excel_cells_written', count_cells)
+        logger.info(f"Из буфера записаны изменения для {count_cells} ячеек")
+        return count_cells
+
+    def save(self):
+        """
+        Метод для сохранения и закрытия файла,
+        перед сохранением в книгу записывается буфер изменений
+
+        :return: True, если файл сохранён или сохранение не требуется, иначе False
+        """
+        with metrics.timer('excel', operation='flush'):
+            self.flush()
+        if self._file is None:
+            logger.info(f"Файл {self.namefile} не изменялся, сохранение не требуется")
+            return True
         try:
-            self._file.save(self.namefile)
+            with metrics.timer('excel', operation='save'):
+                self._file.save(self.namefile)
             self._file.close()
-            logger.info(f"Файл сохранён: {namefile}")
+            logger.info(f"Файл сохранён: {self.namefile}")
+            return True
         except Exception as err:
             logger.warning(f"Не удалось сохранить файл: {self.namefile}. Ошибка: {err.__str__()}")
+            return False